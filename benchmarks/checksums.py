@@ -0,0 +1,90 @@
+"""
+Compares the throughput of the checksum read paths on a large file.
+
+Usage:
+    checksums.py [options]
+    checksums.py -h | --help
+
+Options:
+    --chunk-size <size>     The chunk size in bytes [default: 1048576]
+    --path <path>           An existing file to read instead of a generated one
+    --repeat <number>       Number of times each read path is measured [default: 3]
+    --size <size>           The size of the generated file in megabytes [default: 1024]
+
+Each path is measured with a warm page cache, so the numbers reflect the cost of
+copying and allocating rather than the speed of the disk.
+"""
+
+from docopt import docopt
+import binascii
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from supernode.commands.update import UpdateCommand
+
+
+def generate_file(size):
+    """
+    Writes a temporary file of random data and returns its path
+
+    @type size: int
+    @rtype: str
+    """
+    handle, path = tempfile.mkstemp(prefix='supernode-benchmark-')
+    block = os.urandom(1024 * 1024)
+
+    with os.fdopen(handle, 'wb') as f:
+        for i in range(size):
+            f.write(block)
+
+    return path
+
+
+def measure(read, path, chunk_size, digest):
+    """
+    Reads the file using the read path, optionally hashing it, and returns the elapsed seconds
+
+    @type read: callable
+    @type path: str
+    @type chunk_size: int
+    @type digest: bool
+    @rtype: float
+    """
+    md5 = hashlib.md5()
+    start = time.time()
+
+    for chunk in read(path, chunk_size):
+        if digest:
+            binascii.crc32(chunk)
+            md5.update(chunk)
+
+    return time.time() - start
+
+
+def main():
+    options = docopt(__doc__)
+    chunk_size = int(options['--chunk-size'])
+    repeat = int(options['--repeat'])
+    path = options['--path'] or generate_file(int(options['--size']))
+    size = os.path.getsize(path) / 1024.0 / 1024.0
+
+    try:
+        # Warm the page cache
+        measure(UpdateCommand.read_chunks, path, chunk_size, False)
+
+        for digest in [False, True]:
+            for name, read in [('read', UpdateCommand.read_chunks), ('readinto', UpdateCommand.read_chunks_into)]:
+                elapsed = min(measure(read, path, chunk_size, digest) for i in range(repeat))
+                name += ' + hash' if digest else ''
+                print '{0:<16} {1:>10.2f} MB/s {2:>8.3f} s'.format(name, size / elapsed, elapsed)
+    finally:
+        if not options['--path']:
+            os.remove(path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,945 @@
+"""
+Local stand-ins for the manifest REST API and the S3 origin bucket, used to measure
+the client's throughput without touching production. Both servers can inject a
+fixed latency per request and share a bandwidth limit between all connections,
+and the REST API can fail requests to exercise the client's retries.
+"""
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from email.utils import formatdate
+from xml.sax.saxutils import escape
+import binascii
+import hashlib
+import itertools
+import json
+import os
+import re
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import urllib
+import urlparse
+import xml.etree.ElementTree as ElementTree
+
+# The size of the pieces bodies are read and written in, which is also the throttling granularity
+BLOCK_SIZE = 64 * 1024
+
+S3_NAMESPACE = 'http://s3.amazonaws.com/doc/2006-03-01/'
+
+
+class Throttle(object):
+    """
+    A token bucket limiting the bytes per second transferred by all connections of a server
+    """
+    def __init__(self, rate):
+        """
+        @param rate: The bytes per second, or zero for no limit
+        @type rate: float
+        """
+        self.rate = rate
+        self.__allowance = 0.0
+        self.__last = time.time()
+        self.__lock = threading.Lock()
+
+    def consume(self, size):
+        """
+        Blocks until the bytes may be transferred
+
+        @type size: int
+        """
+        if not self.rate:
+            return
+
+        with self.__lock:
+            now = time.time()
+            self.__allowance = min(self.__allowance + (now - self.__last) * self.rate, self.rate)
+            self.__allowance -= size
+            self.__last = now
+            delay = -self.__allowance / self.rate
+
+        if delay > 0:
+            time.sleep(delay)
+
+
+class BenchmarkServer(ThreadingMixIn, HTTPServer):
+    """
+    A threaded HTTP server counting its requests and bytes
+    """
+    daemon_threads = True
+
+    def __init__(self, handler, latency=0.0, rate=0.0):
+        """
+        @type latency: float
+        @param rate: The bandwidth limit in bytes per second
+        @type rate: float
+        """
+        HTTPServer.__init__(self, ('127.0.0.1', 0), handler)
+        self.latency = latency
+        self.throttle = Throttle(rate)
+        self.requests = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+        self.__connections = set()
+
+    @property
+    def url(self):
+        """
+        @rtype: str
+        """
+        return 'http://{0}:{1}'.format(*self.server_address)
+
+    def start(self):
+        """
+        Serves the requests on a background thread
+        """
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def handle_error(self, request, client_address):
+        # Clients closing keep-alive connections are expected
+        pass
+
+    def process_request(self, request, client_address):
+        with self.lock:
+            self.__connections.add(request)
+
+        ThreadingMixIn.process_request(self, request, client_address)
+
+    def shutdown_request(self, request):
+        with self.lock:
+            self.__connections.discard(request)
+
+        HTTPServer.shutdown_request(self, request)
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+
+        # Release the handler threads waiting on idle keep-alive connections
+        with self.lock:
+            connections = list(self.__connections)
+
+        for request in connections:
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def count(self, received=0, sent=0):
+        """
+        @type received: int
+        @type sent: int
+        """
+        with self.lock:
+            self.bytes_received += received
+            self.bytes_sent += sent
+
+
+class BenchmarkHandler(BaseHTTPRequestHandler):
+    """
+    Handles reading and writing throttled bodies
+    """
+    protocol_version = 'HTTP/1.1'
+
+    # Buffer the response headers, so they are not delayed by Nagle's algorithm
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    def parse_request(self):
+        if not BaseHTTPRequestHandler.parse_request(self):
+            return False
+
+        with self.server.lock:
+            self.server.requests += 1
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        return True
+
+    def read_body(self):
+        """
+        Yields the request body in blocks
+
+        @rtype: collections.Iterable[str]
+        """
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            size = int(self.rfile.readline().split(';')[0], 16)
+
+            while size:
+                for block in self._read(size):
+                    yield block
+
+                self.rfile.readline()
+                size = int(self.rfile.readline().split(';')[0], 16)
+
+            # Trailers end with an empty line
+            while self.rfile.readline().strip():
+                pass
+        else:
+            for block in self._read(int(self.headers.get('Content-Length', 0))):
+                yield block
+
+    def _read(self, size):
+        """
+        @type size: int
+        @rtype: collections.Iterable[str]
+        """
+        while size > 0:
+            block = self.rfile.read(min(size, BLOCK_SIZE))
+
+            if not block:
+                break
+
+            self.server.throttle.consume(len(block))
+            self.server.count(received=len(block))
+            size -= len(block)
+
+            yield block
+
+    def send(self, status, body='', headers=None, content_type='application/xml'):
+        """
+        Sends the response
+
+        @type status: int
+        @type body: str
+        @type headers: dict
+        @type content_type: str
+        """
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+
+        self.end_headers()
+
+        if self.command == 'HEAD':
+            return
+
+        for i in range(0, len(body), BLOCK_SIZE):
+            block = body[i:i + BLOCK_SIZE]
+            self.server.throttle.consume(len(block))
+            self.server.count(sent=len(block))
+            self.wfile.write(block)
+
+    def log_message(self, *args):
+        pass
+
+
+class ManifestState(object):
+    """
+    The packages, versions and files created through the fake REST API
+    """
+    def __init__(self, bucket_name, s3_url):
+        self.bucket_name = bucket_name
+        self.s3_url = s3_url
+        self.partners = [{'PartnerId': 'partner', 'Name': 'Benchmark Partner'}]
+        self.packages = {}
+        self.versions = {}
+        self.lock = threading.Lock()
+        self.__ids = itertools.count(1)
+
+        # The failures of the next requests to each endpoint, keyed by endpoint name
+        self.failures = {}
+
+    def new_id(self):
+        """
+        @rtype: str
+        """
+        return '{0:024x}'.format(next(self.__ids))
+
+    def fail(self, endpoint, status, processed=False, headers=None):
+        """
+        Fails the next request to the endpoint which was not failed yet
+
+        @param endpoint: The name of the handler method, such as add_file
+        @type endpoint: str
+        @param status: The status code of the response
+        @type status: int
+        @param processed: Whether the request is processed before failing, as when a response is lost
+        @type processed: bool
+        @type headers: dict
+        """
+        with self.lock:
+            self.failures.setdefault(endpoint, []).append((status, processed, headers))
+
+    def next_failure(self, endpoint):
+        """
+        Returns the status, whether the request is processed and the headers of the next failure
+        of the endpoint, or None when the request succeeds
+
+        @type endpoint: str
+        @rtype: tuple
+        """
+        with self.lock:
+            failures = self.failures.get(endpoint)
+
+            return failures.pop(0) if failures else None
+
+
+class ManifestHandler(BenchmarkHandler):
+    """
+    Implements the REST API endpoints used by RestApi
+    """
+    routes = [
+        ('GET', r'^/users/current/partners$', 'get_partners'),
+        ('POST', r'^/packages$', 'create_package'),
+        ('GET', r'^/packages/([^/]+)$', 'get_package'),
+        ('POST', r'^/packages/([^/]+)/versions$', 'create_version'),
+        ('PUT', r'^/packages/([^/]+)/tags/([^/]+)$', 'set_tag'),
+        ('DELETE', r'^/packages/([^/]+)/tags/([^/]+)$', 'remove_tag'),
+        ('GET', r'^/versions/([^/]+)/files$', 'get_files'),
+        ('POST', r'^/versions/([^/]+)/files$', 'add_file'),
+        ('POST', r'^/versions/([^/]+)/upload-complete$', 'complete_upload'),
+        ('GET', r'^/versions/([^/]+)/upload-credentials$', 'get_upload_credentials'),
+    ]
+
+    def do_GET(self):
+        self.route()
+
+    def do_POST(self):
+        self.route()
+
+    def do_PUT(self):
+        self.route()
+
+    def do_DELETE(self):
+        self.route()
+
+    def route(self):
+        path = urlparse.urlparse(self.path).path
+
+        for method, pattern, name in self.routes:
+            match = re.match(pattern, path)
+
+            if method == self.command and match:
+                form = urlparse.parse_qs(''.join(self.read_body()))
+                parameters = dict((k, v[0]) for k, v in form.items())
+                failure = self.state.next_failure(name)
+
+                if failure is not None and not failure[1]:
+                    return self.send(failure[0], headers=failure[2], content_type='application/json')
+
+                with self.state.lock:
+                    result = getattr(self, name)(parameters, *match.groups())
+
+                if failure is not None:
+                    return self.send(failure[0], headers=failure[2], content_type='application/json')
+
+                if result is None:
+                    return self.send(404, content_type='application/json')
+
+                return self.send(200, json.dumps(result), content_type='application/json')
+
+        self.send(404, content_type='application/json')
+
+    @property
+    def state(self):
+        """
+        @rtype: ManifestState
+        """
+        return self.server.state
+
+    def get_partners(self, parameters):
+        return self.state.partners
+
+    def create_package(self, parameters):
+        package_id = self.state.new_id()
+        package = {
+            'PackageId': package_id,
+            'PartnerId': parameters.get('PartnerId'),
+            'Name': parameters.get('Name'),
+            'Type': parameters.get('Type'),
+            'Tags': ['current', 'beta'],
+            'TagVersions': {}
+        }
+        self.state.packages[package_id] = package
+
+        return package
+
+    def get_package(self, parameters, package_id):
+        return self.state.packages.get(package_id)
+
+    def create_version(self, parameters, package_id):
+        package = self.state.packages.get(package_id)
+
+        if package is None:
+            return None
+
+        version_id = self.state.new_id()
+        version = {
+            'VersionId': version_id,
+            'PackageId': package_id,
+            'Name': parameters.get('Name'),
+            'Run': parameters.get('Run'),
+            'Arguments': parameters.get('Arguments'),
+            'Files': [],
+            'Complete': False
+        }
+        self.state.versions[version_id] = version
+
+        return version
+
+    def set_tag(self, parameters, package_id, tag):
+        package = self.state.packages.get(package_id)
+
+        if package is None or parameters.get('VersionId') not in self.state.versions:
+            return None
+
+        package['TagVersions'][tag] = parameters['VersionId']
+
+        return {}
+
+    def remove_tag(self, parameters, package_id, tag):
+        package = self.state.packages.get(package_id)
+
+        if package is None or tag not in package['TagVersions']:
+            return None
+
+        del package['TagVersions'][tag]
+
+        return {}
+
+    def get_files(self, parameters, version_id):
+        version = self.state.versions.get(version_id)
+
+        return None if version is None else version['Files']
+
+    def add_file(self, parameters, version_id):
+        version = self.state.versions.get(version_id)
+
+        if version is None:
+            return None
+
+        version['Files'].append({
+            'Path': parameters['Path'],
+            'Size': int(parameters['Size']),
+            'Chunk': int(parameters['Chunk']),
+            'Checksums': parameters['Checksums'],
+            'MD5': parameters['MD5']
+        })
+
+        return {}
+
+    def complete_upload(self, parameters, version_id):
+        version = self.state.versions.get(version_id)
+
+        if version is None:
+            return None
+
+        version['Complete'] = True
+
+        return {}
+
+    def get_upload_credentials(self, parameters, version_id):
+        version = self.state.versions.get(version_id)
+
+        if version is None:
+            return None
+
+        package = self.state.packages[version['PackageId']]
+
+        return {
+            'AccessKeyId': 'benchmark',
+            'SecretAccessKey': 'benchmark',
+            'SessionToken': 'benchmark',
+            'BucketName': self.state.bucket_name,
+            'KeyPrefix': '{0}/{1}/{2}/'.format(package['PartnerId'], package['PackageId'], version_id),
+            'Endpoint': self.state.s3_url
+        }
+
+
+class S3Object(object):
+    """
+    An object stored by the fake S3 server, with its contents kept on disk
+    """
+    def __init__(self, path, size, md5, etag, metadata):
+        self.path = path
+        self.size = size
+        self.md5 = md5
+        self.etag = etag
+        self.metadata = metadata
+        self.modified = time.time()
+
+
+class S3State(object):
+    """
+    The objects and multipart uploads stored by the fake S3 server
+    """
+    def __init__(self, root):
+        self.root = root
+        self.objects = {}
+        self.uploads = {}
+        self.lock = threading.Lock()
+        self.__ids = itertools.count(1)
+
+    def new_path(self):
+        """
+        Returns a new path for storing contents
+
+        @rtype: str
+        """
+        return os.path.join(self.root, str(next(self.__ids)))
+
+    def new_upload_id(self):
+        """
+        @rtype: str
+        """
+        return 'upload{0}'.format(next(self.__ids))
+
+
+class S3Handler(BenchmarkHandler):
+    """
+    Implements the path-style S3 requests made by boto: objects, copies, listings and multipart uploads
+    """
+    def parse(self):
+        """
+        Returns the bucket, key and query parameters of the request
+
+        @rtype: tuple
+        """
+        url = urlparse.urlparse(self.path)
+        bucket, _, key = url.path.lstrip('/').partition('/')
+        query = dict((k, v[0]) for k, v in urlparse.parse_qs(url.query, keep_blank_values=True).items())
+
+        return urllib.unquote(bucket), urllib.unquote(key), query
+
+    @property
+    def state(self):
+        """
+        @rtype: S3State
+        """
+        return self.server.state
+
+    def do_GET(self):
+        bucket, key, query = self.parse()
+
+        if not key and 'uploads' in query:
+            self.list_uploads(bucket, query)
+        elif not key:
+            self.list_objects(bucket, query)
+        elif 'uploadId' in query:
+            self.list_parts(bucket, key, query)
+        else:
+            self.get_object(bucket, key)
+
+    def do_HEAD(self):
+        bucket, key, query = self.parse()
+        self.get_object(bucket, key)
+
+    def do_PUT(self):
+        bucket, key, query = self.parse()
+        copy_source = self.headers.get('x-amz-copy-source')
+
+        if 'partNumber' in query and copy_source:
+            self.copy_part(bucket, key, query, copy_source)
+        elif 'partNumber' in query:
+            self.upload_part(bucket, key, query)
+        elif copy_source:
+            self.copy_object(bucket, key, copy_source)
+        else:
+            self.put_object(bucket, key)
+
+    def do_POST(self):
+        bucket, key, query = self.parse()
+
+        if 'uploads' in query:
+            self.initiate_upload(bucket, key)
+        else:
+            self.complete_upload(bucket, key, query)
+
+    def do_DELETE(self):
+        bucket, key, query = self.parse()
+
+        if 'uploadId' in query:
+            with self.state.lock:
+                upload = self.state.uploads.pop(query['uploadId'], None)
+
+            if upload is None:
+                return self.error(404, 'NoSuchUpload')
+
+            for part in upload['Parts'].values():
+                os.remove(part.path)
+        else:
+            with self.state.lock:
+                self.state.objects.pop((bucket, key), None)
+
+        self.send(204)
+
+    def error(self, status, code):
+        """
+        @type status: int
+        @type code: str
+        """
+        self.send(status, '<?xml version="1.0" encoding="UTF-8"?>\n'
+                          '<Error><Code>{0}</Code><Message>{0}</Message></Error>'.format(code))
+
+    def xml(self, name, body):
+        """
+        Sends a successful XML response
+
+        @type name: str
+        @type body: str
+        """
+        self.send(200, '<?xml version="1.0" encoding="UTF-8"?>\n<{0} xmlns="{1}">{2}</{0}>'.format(
+            name, S3_NAMESPACE, body))
+
+    @staticmethod
+    def timestamp(value):
+        """
+        @type value: float
+        @rtype: str
+        """
+        return time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(value))
+
+    @staticmethod
+    def elements(**values):
+        """
+        Returns the escaped XML elements of the values
+
+        @rtype: str
+        """
+        return ''.join('<{0}>{1}</{0}>'.format(k, escape(str(v))) for k, v in sorted(values.items()))
+
+    def metadata(self):
+        """
+        Returns the user metadata headers of the request
+
+        @rtype: dict
+        """
+        return dict((k.lower(), v) for k, v in self.headers.items() if k.lower().startswith('x-amz-meta-'))
+
+    def store_body(self):
+        """
+        Writes the request body to a new file, verifying its Content-MD5 when supplied,
+        and returns the file path, size and MD5 digest or None when the digest does not match
+
+        @rtype: tuple
+        """
+        path = self.state.new_path()
+        md5 = hashlib.md5()
+        size = 0
+
+        with open(path, 'wb') as f:
+            for block in self.read_body():
+                md5.update(block)
+                size += len(block)
+                f.write(block)
+
+        expected = self.headers.get('Content-MD5')
+
+        if expected and binascii.a2b_base64(expected) != md5.digest():
+            os.remove(path)
+            return None
+
+        return path, size, md5
+
+    def get_object(self, bucket, key):
+        with self.state.lock:
+            obj = self.state.objects.get((bucket, key))
+
+        if obj is None:
+            return self.error(404, 'NoSuchKey')
+
+        headers = {'ETag': obj.etag, 'Last-Modified': formatdate(obj.modified, usegmt=True)}
+        headers.update(obj.metadata)
+
+        if self.command == 'HEAD':
+            self.send_response(200)
+            self.send_header('Content-Length', str(obj.size))
+
+            for name, value in headers.items():
+                self.send_header(name, value)
+
+            return self.end_headers()
+
+        with open(obj.path, 'rb') as f:
+            self.send(200, f.read(), headers, 'application/octet-stream')
+
+    def put_object(self, bucket, key):
+        stored = self.store_body()
+
+        if stored is None:
+            return self.error(400, 'BadDigest')
+
+        path, size, md5 = stored
+        etag = '"{0}"'.format(md5.hexdigest())
+
+        with self.state.lock:
+            self.state.objects[(bucket, key)] = S3Object(path, size, md5.hexdigest(), etag, self.metadata())
+
+        self.send(200, headers={'ETag': etag})
+
+    def source(self, copy_source):
+        """
+        Returns the object named by the copy source header
+
+        @type copy_source: str
+        @rtype: S3Object
+        """
+        bucket, _, key = urllib.unquote(copy_source).lstrip('/').partition('/')
+
+        with self.state.lock:
+            return self.state.objects.get((bucket, key))
+
+    def copy_object(self, bucket, key, copy_source):
+        source = self.source(copy_source)
+
+        if source is None:
+            return self.error(404, 'NoSuchKey')
+
+        if self.headers.get('x-amz-metadata-directive', 'COPY').upper() == 'REPLACE':
+            metadata = self.metadata()
+        else:
+            metadata = source.metadata
+
+        # Copies always have the MD5 of their contents as the etag, even copies of multipart objects
+        path = self.state.new_path()
+        shutil.copyfile(source.path, path)
+        etag = '"{0}"'.format(source.md5)
+        obj = S3Object(path, source.size, source.md5, etag, metadata)
+
+        with self.state.lock:
+            self.state.objects[(bucket, key)] = obj
+
+        self.xml('CopyObjectResult', self.elements(LastModified=self.timestamp(obj.modified), ETag=etag))
+
+    def list_objects(self, bucket, query):
+        prefix = query.get('prefix', '')
+        marker = query.get('marker', '')
+        max_keys = int(query.get('max-keys', 1000))
+
+        with self.state.lock:
+            keys = sorted((k, o) for (b, k), o in self.state.objects.items()
+                          if b == bucket and k.startswith(prefix) and k > marker)
+
+        body = self.elements(Name=bucket, Prefix=prefix, Marker=marker, MaxKeys=max_keys,
+                             IsTruncated=str(len(keys) > max_keys).lower())
+
+        for key, obj in keys[:max_keys]:
+            body += '<Contents>{0}</Contents>'.format(self.elements(
+                Key=key, LastModified=self.timestamp(obj.modified), ETag=obj.etag, Size=obj.size,
+                StorageClass='STANDARD'))
+
+        self.xml('ListBucketResult', body)
+
+    def initiate_upload(self, bucket, key):
+        # Discard the (empty) body
+        list(self.read_body())
+
+        upload_id = self.state.new_upload_id()
+
+        with self.state.lock:
+            self.state.uploads[upload_id] = {
+                'Bucket': bucket,
+                'Key': key,
+                'Initiated': time.time(),
+                'Metadata': self.metadata(),
+                'Parts': {}
+            }
+
+        self.xml('InitiateMultipartUploadResult', self.elements(Bucket=bucket, Key=key, UploadId=upload_id))
+
+    def upload_part(self, bucket, key, query):
+        with self.state.lock:
+            upload = self.state.uploads.get(query.get('uploadId'))
+
+        if upload is None:
+            list(self.read_body())
+            return self.error(404, 'NoSuchUpload')
+
+        stored = self.store_body()
+
+        if stored is None:
+            return self.error(400, 'BadDigest')
+
+        path, size, md5 = stored
+        etag = '"{0}"'.format(md5.hexdigest())
+
+        with self.state.lock:
+            upload['Parts'][int(query['partNumber'])] = S3Object(path, size, md5.hexdigest(), etag, {})
+
+        self.send(200, headers={'ETag': etag})
+
+    def copy_part(self, bucket, key, query, copy_source):
+        with self.state.lock:
+            upload = self.state.uploads.get(query.get('uploadId'))
+
+        source = self.source(copy_source)
+
+        if upload is None:
+            return self.error(404, 'NoSuchUpload')
+
+        if source is None:
+            return self.error(404, 'NoSuchKey')
+
+        start, end = 0, source.size - 1
+        copy_range = self.headers.get('x-amz-copy-source-range')
+
+        if copy_range:
+            start, end = [int(i) for i in copy_range.split('=', 1)[1].split('-')]
+
+        if start > end or end >= source.size:
+            return self.error(400, 'InvalidRange')
+
+        path = self.state.new_path()
+        md5 = hashlib.md5()
+
+        with open(source.path, 'rb') as src:
+            with open(path, 'wb') as dst:
+                src.seek(start)
+                remaining = end - start + 1
+
+                while remaining:
+                    block = src.read(min(remaining, BLOCK_SIZE))
+                    md5.update(block)
+                    dst.write(block)
+                    remaining -= len(block)
+
+        etag = '"{0}"'.format(md5.hexdigest())
+        part = S3Object(path, end - start + 1, md5.hexdigest(), etag, {})
+
+        with self.state.lock:
+            upload['Parts'][int(query['partNumber'])] = part
+
+        self.xml('CopyPartResult', self.elements(LastModified=self.timestamp(part.modified), ETag=etag))
+
+    def list_parts(self, bucket, key, query):
+        with self.state.lock:
+            upload = self.state.uploads.get(query['uploadId'])
+
+        if upload is None:
+            return self.error(404, 'NoSuchUpload')
+
+        marker = int(query.get('part-number-marker') or 0)
+        max_parts = int(query.get('max-parts', 1000))
+
+        with self.state.lock:
+            parts = sorted((n, p) for n, p in upload['Parts'].items() if n > marker)
+
+        truncated = len(parts) > max_parts
+        parts = parts[:max_parts]
+        body = self.elements(Bucket=bucket, Key=key, UploadId=query['uploadId'], PartNumberMarker=marker,
+                             NextPartNumberMarker=parts[-1][0] if parts else marker, MaxParts=max_parts,
+                             IsTruncated=str(truncated).lower())
+
+        for number, part in parts:
+            body += '<Part>{0}</Part>'.format(self.elements(
+                PartNumber=number, LastModified=self.timestamp(part.modified), ETag=part.etag, Size=part.size))
+
+        self.xml('ListPartsResult', body)
+
+    def complete_upload(self, bucket, key, query):
+        document = ElementTree.fromstring(''.join(self.read_body()))
+
+        with self.state.lock:
+            upload = self.state.uploads.get(query.get('uploadId'))
+
+        if upload is None:
+            return self.error(404, 'NoSuchUpload')
+
+        requested = [(int(p.findtext('PartNumber')), p.findtext('ETag')) for p in document.iter('Part')]
+        parts = []
+
+        for number, etag in requested:
+            part = upload['Parts'].get(number)
+
+            if part is None or part.etag.strip('"') != etag.strip('"'):
+                return self.error(400, 'InvalidPart')
+
+            parts.append(part)
+
+        # Every part except the last must be at least 5 MB
+        if any(p.size < 5 * 1024 * 1024 for p in parts[:-1]):
+            return self.error(400, 'EntityTooSmall')
+
+        path = self.state.new_path()
+        md5 = hashlib.md5()
+        digests = hashlib.md5()
+        size = 0
+
+        with open(path, 'wb') as dst:
+            for part in parts:
+                digests.update(binascii.a2b_hex(part.md5))
+                size += part.size
+
+                with open(part.path, 'rb') as src:
+                    for block in iter(lambda: src.read(BLOCK_SIZE), ''):
+                        md5.update(block)
+                        dst.write(block)
+
+        etag = '"{0}-{1}"'.format(digests.hexdigest(), len(parts))
+
+        with self.state.lock:
+            self.state.uploads.pop(query['uploadId'], None)
+            self.state.objects[(bucket, key)] = S3Object(path, size, md5.hexdigest(), etag, upload['Metadata'])
+
+        for part in upload['Parts'].values():
+            os.remove(part.path)
+
+        self.xml('CompleteMultipartUploadResult', self.elements(
+            Location='{0}/{1}/{2}'.format(self.server.url, bucket, key), Bucket=bucket, Key=key, ETag=etag))
+
+    def list_uploads(self, bucket, query):
+        prefix = query.get('prefix', '')
+        key_marker = query.get('key-marker', '')
+        upload_id_marker = query.get('upload-id-marker', '')
+        max_uploads = int(query.get('max-uploads', 1000))
+
+        with self.state.lock:
+            uploads = sorted((u['Key'], u['Initiated'], i, u) for i, u in self.state.uploads.items()
+                             if u['Bucket'] == bucket and u['Key'].startswith(prefix))
+
+        # Uploads after the key marker, or after the upload id marker for the same key
+        if upload_id_marker:
+            uploads = [u for u in uploads if u[0] > key_marker or (u[0] == key_marker and u[2] > upload_id_marker)]
+        else:
+            uploads = [u for u in uploads if u[0] > key_marker]
+
+        truncated = len(uploads) > max_uploads
+        uploads = uploads[:max_uploads]
+        body = self.elements(Bucket=bucket, KeyMarker=key_marker, UploadIdMarker=upload_id_marker, Prefix=prefix,
+                             NextKeyMarker=uploads[-1][0] if uploads else '',
+                             NextUploadIdMarker=uploads[-1][2] if uploads else '',
+                             MaxUploads=max_uploads, IsTruncated=str(truncated).lower())
+
+        for key, initiated, upload_id, upload in uploads:
+            owner = self.elements(ID='benchmark', DisplayName='benchmark')
+            body += '<Upload>{0}<Initiator>{1}</Initiator><Owner>{1}</Owner></Upload>'.format(self.elements(
+                Key=key, UploadId=upload_id, StorageClass='STANDARD', Initiated=self.timestamp(initiated)), owner)
+
+        self.xml('ListMultipartUploadsResult', body)
+
+
+def start_servers(latency=0.0, rate=0.0, root=None):
+    """
+    Starts the fake S3 and REST API servers and returns them
+
+    @param latency: The seconds added to every request
+    @type latency: float
+    @param rate: The bandwidth limit of each server in bytes per second, or zero for no limit
+    @type rate: float
+    @param root: The directory the S3 objects are stored in
+    @type root: str
+    @rtype: tuple
+    """
+    root = root or tempfile.mkdtemp(prefix='supernode-s3-')
+
+    if not os.path.isdir(root):
+        os.makedirs(root)
+
+    s3 = BenchmarkServer(S3Handler, latency, rate)
+    s3.state = S3State(root)
+    s3.start()
+
+    api = BenchmarkServer(ManifestHandler, latency)
+    api.state = ManifestState('origin', s3.url)
+    api.start()
+
+    return api, s3
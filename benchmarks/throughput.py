@@ -0,0 +1,218 @@
+"""
+Measures the throughput of the package commands against local stand-ins of the
+REST API and the S3 origin bucket.
+
+Usage:
+    throughput.py [options] [<command-option>...]
+    throughput.py -h | --help
+
+Options:
+    --bandwidth <mb>        The S3 bandwidth limit in megabytes per second, zero for none [default: 0]
+    --cold-cache            Drop the page cache before each command, which requires root on Linux
+    --commands <commands>   The comma separated commands to run [default: create,upload]
+    --large-files <number>  Number of large files generated [default: 2]
+    --large-size <mb>       Size of each large file in megabytes [default: 64]
+    --latency <ms>          Latency added to every request in milliseconds [default: 0]
+    --small-files <number>  Number of small files generated [default: 1000]
+    --small-size <kb>       Size of each small file in kilobytes [default: 16]
+    --verbose               Show the output of the commands
+    --work-dir <path>       The directory the package and bucket are created in
+
+Command options are passed to a single command using the format command:option,
+for example: upload:--parallel=8 create:--jobs=4
+"""
+
+from docopt import docopt
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from servers import start_servers
+
+
+def generate_package(path, small_files, small_size, large_files, large_size):
+    """
+    Writes the synthetic package files and returns their total size
+
+    @type path: str
+    @type small_files: int
+    @type small_size: int
+    @type large_files: int
+    @type large_size: int
+    @rtype: int
+    """
+    for i in range(small_files):
+        directory = os.path.join(path, 'small', '{0:03d}'.format(i / 100))
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        with open(os.path.join(directory, '{0:05d}.bin'.format(i)), 'wb') as f:
+            f.write(os.urandom(small_size))
+
+    if large_files:
+        os.makedirs(os.path.join(path, 'large'))
+
+    for i in range(large_files):
+        with open(os.path.join(path, 'large', '{0:02d}.bin'.format(i)), 'wb') as f:
+            for j in range(large_size / (1024 * 1024)):
+                f.write(os.urandom(1024 * 1024))
+
+    return small_files * small_size + large_files * large_size
+
+
+def drop_page_cache():
+    """
+    Writes the dirty pages and drops the page cache, so the package files are read from the disk again
+    """
+    subprocess.check_call(['sync'])
+
+    try:
+        with open('/proc/sys/vm/drop_caches', 'w') as f:
+            f.write('3\n')
+    except IOError as e:
+        exit('Failure dropping the page cache, --cold-cache requires root on Linux: {0}'.format(e))
+
+
+def command_argv(command, path, command_options):
+    """
+    Returns the arguments the command is run with
+
+    @type command: str
+    @type path: str
+    @type command_options: list of str
+    @rtype: list of str
+    """
+    argv = [command]
+
+    if command == 'create':
+        argv += ['--path', path, '--name', 'Benchmark']
+    elif command in ('update', 'publish'):
+        argv += ['--path', path]
+
+    for option in command_options:
+        name, _, value = option.partition(':')
+
+        if name == command:
+            argv.append(value)
+
+    return argv
+
+
+def run_command(command, argv, verbose):
+    """
+    Runs the command and returns whether it succeeded
+
+    @type command: supernode.command.Command
+    @type argv: list of str
+    @type verbose: bool
+    @rtype: bool
+    """
+    saved = []
+
+    # The progress bars write to the stderr captured at import, so the descriptors are redirected
+    if not verbose:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        saved = [(fd, os.dup(fd)) for fd in (1, 2)]
+
+        for fd, copy in saved:
+            os.dup2(devnull, fd)
+
+        os.close(devnull)
+
+    error = None
+
+    try:
+        command.run(docopt(command.help(), argv=argv))
+    except SystemExit as e:
+        error = e
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        for fd, copy in saved:
+            os.dup2(copy, fd)
+            os.close(copy)
+
+    if error is not None:
+        print '{0} exited: {1}'.format(argv[0], error)
+
+    return error is None
+
+
+def main():
+    options = docopt(__doc__)
+    work_dir = options['--work-dir'] or tempfile.mkdtemp(prefix='supernode-benchmark-')
+    package_path = os.path.join(work_dir, 'package')
+    latency = float(options['--latency']) / 1000
+    rate = float(options['--bandwidth']) * 1024 * 1024
+
+    # The configuration and cache are stored in the home folder
+    os.environ['HOME'] = work_dir
+
+    from supernode.commands.create import CreateCommand
+    from supernode.commands.publish import PublishCommand
+    from supernode.commands.update import UpdateCommand
+    from supernode.commands.upload import UploadCommand, connections
+    from supernode.config import Config
+
+    commands = {
+        'create': CreateCommand,
+        'publish': PublishCommand,
+        'update': UpdateCommand,
+        'upload': UploadCommand
+    }
+
+    servers = []
+
+    try:
+        print 'Generating package files...'
+        size = generate_package(package_path, int(options['--small-files']), int(options['--small-size']) * 1024,
+                                int(options['--large-files']), int(options['--large-size']) * 1024 * 1024)
+
+        api, s3 = servers = start_servers(latency, rate, os.path.join(work_dir, 'bucket'))
+        Config.save({
+            'url': api.url,
+            'email': 'benchmark@example.com',
+            'password': 'benchmark',
+            'verify': 'False',
+            'partner_id': 'partner'
+        })
+
+        print '{0:<10} {1:>9} {2:>10} {3:>12} {4:>11} {5:>10} {6:>14}'.format(
+            'Command', 'Time (s)', 'MB/s', 'API req/s', 'S3 req/s', 'S3 MB', 'S3 conn/reuse')
+
+        for name in options['--commands'].split(','):
+            command = commands[name]()
+            argv = command_argv(name, package_path, options['<command-option>'])
+            api.requests = s3.requests = s3.bytes_received = 0
+            connections.opened = connections.reused = 0
+
+            if options['--cold-cache']:
+                drop_page_cache()
+
+            start = time.time()
+            succeeded = run_command(command, argv, options['--verbose'])
+            elapsed = max(time.time() - start, 0.001)
+
+            print '{0:<10} {1:>9.2f} {2:>10.2f} {3:>12.1f} {4:>11.1f} {5:>10.1f} {6:>14}{7}'.format(
+                name, elapsed, size / 1024.0 / 1024.0 / elapsed, api.requests / elapsed, s3.requests / elapsed,
+                s3.bytes_received / 1024.0 / 1024.0, '{0}/{1}'.format(connections.opened, connections.reused),
+                '' if succeeded else ' (failed)')
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+        if not options['--work-dir']:
+            shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main()
@@ -9,7 +9,7 @@ setup(
         'docopt == 0.6.1',
         'futures == 2.1.6',
         'progressbar2 == 2.6.2',
-        'requests >= 2.0'
+        'requests >= 2.4'
     ],
     packages=find_packages(),
     entry_points={
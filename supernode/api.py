@@ -1,4 +1,4 @@
-import requests
+from transport import CONNECT_TIMEOUT, READ_TIMEOUT, StreamingForm, Transport
 
 
 class RestApi:
@@ -14,6 +14,11 @@ class RestApi:
         self.password = settings['password']
         self.verify = settings['verify'] == 'True'
 
+        # The timeouts are optional settings
+        connect_timeout = float(settings.get('connect_timeout', CONNECT_TIMEOUT))
+        read_timeout = float(settings.get('read_timeout', READ_TIMEOUT))
+        self.transport = Transport(self.auth(), self.verify, connect_timeout, read_timeout)
+
     def auth(self):
         """
         Returns a tuple used for authenticating an API request
@@ -28,7 +33,8 @@ class RestApi:
 
         @rtype : list
         """
-        response = requests.get('{0}/users/current/partners'.format(self.url), auth=self.auth(), verify=self.verify)
+        url = '{0}/users/current/partners'.format(self.url)
+        response = self.transport.get('get_user_partners', url)
 
         if response.status_code != 200:
             raise Exception('Failure querying user partners')
@@ -54,7 +60,7 @@ class RestApi:
             'Type': package_type
         }
 
-        response = requests.post(url, data=parameters, auth=self.auth(), verify=self.verify)
+        response = self.transport.post('create_package', url, data=parameters)
 
         if response.status_code != 200:
             raise Exception('Failure creating package')
@@ -92,7 +98,7 @@ class RestApi:
             if parameters[key] is not None:
                 headers = None
 
-        response = requests.post(url, data=parameters, headers=headers, auth=self.auth(), verify=self.verify)
+        response = self.transport.post('create_version', url, data=parameters, headers=headers)
 
         if response.status_code != 200:
             raise Exception('Failure creating version')
@@ -114,23 +120,40 @@ class RestApi:
         @param checksums: A list of checksum values
         @param md5: The MD5 hex of the file
         @type md5: str
-        @type checksums: list
+        @type checksums: array or list
 
         """
         url = '{0}/versions/{1}/files'.format(self.url, version_id)
         parameters = {
-            'Checksums': ','.join(str(i) for i in checksums),
             'Chunk': chunk_size,
             'MD5': md5,
             'Path': path,
             'Size': size
         }
 
-        response = requests.post(url, data=parameters, auth=self.auth(), verify=self.verify)
+        # The checksums are encoded while they are sent
+        form = StreamingForm(parameters, 'Checksums', checksums)
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        response = self.transport.post('add_file', url, data=form, headers=headers)
 
         if response.status_code != 200:
             raise Exception('Failure adding file')
 
+    def get_files(self, version_id):
+        """
+        Returns the files added to the version
+
+        @type version_id str
+        @rtype: list of dict
+        """
+        url = '{0}/versions/{1}/files'.format(self.url, version_id)
+        response = self.transport.get('get_files', url)
+
+        if response.status_code != 200:
+            raise Exception('Failure querying version files')
+
+        return response.json()
+
     def complete_upload(self, version_id):
         """
         Marks the version as completely uploaded
@@ -138,7 +161,7 @@ class RestApi:
         @type version_id str
         """
         url = '{0}/versions/{1}/upload-complete'.format(self.url, version_id)
-        response = requests.post(url, auth=self.auth(), verify=self.verify)
+        response = self.transport.post('complete_upload', url, idempotent=True)
 
         if response.status_code != 200:
             raise Exception('Failure completing version')
@@ -151,7 +174,7 @@ class RestApi:
         @rtype: dict
         """
         url = '{0}/versions/{1}/upload-credentials'.format(self.url, version_id)
-        response = requests.get(url, auth=self.auth(), verify=self.verify)
+        response = self.transport.get('get_upload_credentials', url)
 
         if response.status_code != 200:
             raise Exception('Failure querying upload credentials')
@@ -166,7 +189,7 @@ class RestApi:
         @rtype: list of str
         """
         url = '{0}/packages/{1}'.format(self.url, package_id)
-        response = requests.get(url, auth=self.auth(), verify=self.verify)
+        response = self.transport.get('get_tags', url)
 
         if response.status_code != 200:
             raise Exception('Failure querying package tags')
@@ -184,7 +207,7 @@ class RestApi:
         """
         url = '{0}/packages/{1}/tags/{2}'.format(self.url, package_id, tag)
         parameters = {'VersionId': version_id}
-        response = requests.put(url, data=parameters, auth=self.auth(), verify=self.verify)
+        response = self.transport.put('set_tag', url, data=parameters)
 
         if response.status_code != 200:
             raise Exception('Failure setting package tag')
@@ -197,7 +220,7 @@ class RestApi:
         @type tag str
         """
         url = '{0}/packages/{1}/tags/{2}'.format(self.url, package_id, tag)
-        response = requests.delete(url, auth=self.auth(), verify=self.verify)
+        response = self.transport.delete('remove_tag', url)
 
         if response.status_code != 200:
             raise Exception('Failure deleting package tag')
@@ -210,7 +233,7 @@ class RestApi:
         @rtype : dict
         """
         url = '{0}/packages/{1}'.format(self.url, package_id)
-        response = requests.get(url, auth=self.auth(), verify=self.verify)
+        response = self.transport.get('get_package', url)
 
         if response.status_code != 200:
             raise Exception('Failure querying package')
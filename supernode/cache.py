@@ -0,0 +1,271 @@
+from array import array
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_PATH = os.path.expanduser('~/package.cache')
+
+# The maximum number of files remembered before the least recently used are evicted
+MAXIMUM_ENTRIES = 1000000
+
+# The number of writes buffered, and the seconds they may be buffered for, before they are committed
+# The seconds are counted by a timer, so the writes are committed even while the next file is being read
+COMMIT_INTERVAL = 100
+COMMIT_SECONDS = 1
+
+# The number of files read from the cache before the times they were used are written
+USED_INTERVAL = 10000
+
+# The size of an MD5 digest in bytes
+DIGEST_SIZE = 16
+
+
+class ChecksumCache(object):
+    """
+    Stores the checksums of files in a local SQLite database, so that unchanged files
+    do not need to be read again. Files are identified by their absolute path, size,
+    modification time, inode and the chunk size used to calculate the checksums.
+
+    The MD5 digests of the parts of large files, calculated by upload, are stored alongside
+    keyed by part size, so each part is only read once while it is uploaded.
+
+    SQLite handles the locking, so multiple processes may share the same cache file. Reading
+    does not write to the database: the times files are used are kept in memory and written
+    together, and other writes are committed within a second by a timer, even when no other write
+    follows, so the lock is never held while files are read.
+    """
+    def __init__(self, path=CACHE_PATH, max_entries=MAXIMUM_ENTRIES):
+        """
+        Opens the cache, creating it when it does not exist
+
+        @type path: str
+        @type max_entries: int
+        """
+        self.__connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.__max_entries = max_entries
+        self.__pending = 0
+        self.__timer = None
+        self.__closed = False
+        self.__lock = threading.Lock()
+
+        # The times the files were last used, keyed by table and then by path and chunk or part size
+        self.__used = {'checksums': {}, 'parts': {}}
+
+        self.__connection.execute(
+            'CREATE TABLE IF NOT EXISTS checksums ('
+            'path TEXT NOT NULL, chunk_size INTEGER NOT NULL, size INTEGER NOT NULL, '
+            'mtime_ns INTEGER NOT NULL, inode INTEGER NOT NULL, md5 TEXT NOT NULL, '
+            'checksums BLOB NOT NULL, used REAL NOT NULL, PRIMARY KEY (path, chunk_size))')
+        self.__connection.execute('CREATE INDEX IF NOT EXISTS checksums_used ON checksums (used)')
+        self.__connection.execute(
+            'CREATE TABLE IF NOT EXISTS parts ('
+            'path TEXT NOT NULL, part_size INTEGER NOT NULL, size INTEGER NOT NULL, '
+            'mtime_ns INTEGER NOT NULL, inode INTEGER NOT NULL, digests BLOB NOT NULL, '
+            'used REAL NOT NULL, PRIMARY KEY (path, part_size))')
+        self.__connection.execute('CREATE INDEX IF NOT EXISTS parts_used ON parts (used)')
+        self.__connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def identity(path, stat):
+        """
+        Returns the values identifying the contents of a file
+
+        @type path: str
+        @type stat: posix.stat_result
+        @rtype: tuple
+        """
+        return os.path.abspath(path), stat.st_size, int(stat.st_mtime * 1000000000), stat.st_ino
+
+    def get(self, path, stat, chunk_size):
+        """
+        Returns the cached MD5 and CRC chunk values of the file, or None when the
+        file has changed or was never cached
+
+        @type path: str
+        @type stat: posix.stat_result
+        @type chunk_size: int
+        @rtype: tuple
+        """
+        path, size, mtime_ns, inode = self.identity(path, stat)
+
+        with self.__lock:
+            row = self.__connection.execute(
+                'SELECT md5, checksums FROM checksums '
+                'WHERE path = ? AND chunk_size = ? AND size = ? AND mtime_ns = ? AND inode = ?',
+                (path, chunk_size, size, mtime_ns, inode)).fetchone()
+
+            if row is None:
+                return None
+
+            self._use('checksums', path, chunk_size)
+
+        checksums = array('I')
+        checksums.fromstring(str(row[1]))
+
+        return str(row[0]), checksums
+
+    def get_md5(self, path, stat):
+        """
+        Returns the cached MD5 of the file calculated with any chunk size, or None when the
+        file has changed or was never cached
+
+        @type path: str
+        @type stat: posix.stat_result
+        @rtype: str
+        """
+        with self.__lock:
+            row = self.__connection.execute(
+                'SELECT md5 FROM checksums WHERE path = ? AND size = ? AND mtime_ns = ? AND inode = ? LIMIT 1',
+                self.identity(path, stat)).fetchone()
+
+        return str(row[0]) if row is not None else None
+
+    def set(self, path, stat, chunk_size, md5, checksums):
+        """
+        Stores the MD5 and CRC chunk values of the file
+
+        @type path: str
+        @type stat: posix.stat_result
+        @type chunk_size: int
+        @type md5: str
+        @type checksums: array or list of int
+        """
+        path, size, mtime_ns, inode = self.identity(path, stat)
+
+        if not isinstance(checksums, array):
+            checksums = array('I', checksums)
+
+        blob = sqlite3.Binary(checksums.tostring())
+
+        with self.__lock:
+            self._write('INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        (path, chunk_size, size, mtime_ns, inode, md5, blob, time.time()))
+
+    def get_part_digests(self, path, stat, part_size):
+        """
+        Returns the cached MD5 digest of each part of the file, or None when the
+        file has changed or its parts were never cached with the part size
+
+        @type path: str
+        @type stat: posix.stat_result
+        @type part_size: int
+        @rtype: list of str
+        """
+        path, size, mtime_ns, inode = self.identity(path, stat)
+
+        with self.__lock:
+            row = self.__connection.execute(
+                'SELECT digests FROM parts '
+                'WHERE path = ? AND part_size = ? AND size = ? AND mtime_ns = ? AND inode = ?',
+                (path, part_size, size, mtime_ns, inode)).fetchone()
+
+            if row is None:
+                return None
+
+            self._use('parts', path, part_size)
+
+        digests = str(row[0])
+
+        return [digests[i:i + DIGEST_SIZE] for i in range(0, len(digests), DIGEST_SIZE)]
+
+    def set_part_digests(self, path, stat, part_size, digests):
+        """
+        Stores the MD5 digest of each part of the file
+
+        @type path: str
+        @type stat: posix.stat_result
+        @type part_size: int
+        @type digests: list of str
+        """
+        path, size, mtime_ns, inode = self.identity(path, stat)
+
+        with self.__lock:
+            self._write('INSERT OR REPLACE INTO parts VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (path, part_size, size, mtime_ns, inode, sqlite3.Binary(''.join(digests)), time.time()))
+
+    def _use(self, table, path, size):
+        """
+        Remembers when a file was read from the cache, writing the times once enough are remembered,
+        the caller holding the lock
+
+        @type table: str
+        @type path: str
+        @param size: The chunk or part size
+        @type size: int
+        """
+        used = self.__used[table]
+        used[(path, size)] = time.time()
+
+        if len(used) >= USED_INTERVAL:
+            self._commit()
+
+    def _write(self, sql, parameters):
+        """
+        Executes the statement, committing once enough writes are buffered or when the timer
+        expires, the caller holding the lock
+
+        @type sql: str
+        @type parameters: tuple
+        """
+        self.__connection.execute(sql, parameters)
+        self.__pending += 1
+
+        if self.__pending >= COMMIT_INTERVAL:
+            self._commit()
+        elif self.__timer is None:
+            self.__timer = threading.Timer(COMMIT_SECONDS, self._flush)
+            self.__timer.daemon = True
+            self.__timer.start()
+
+    def _flush(self):
+        """
+        Commits the writes buffered since the timer started
+        """
+        with self.__lock:
+            self.__timer = None
+
+            if not self.__closed and self.__pending:
+                self._commit()
+
+    def _commit(self):
+        """
+        Writes the remembered times the files were used and commits, in a single transaction,
+        the caller holding the lock
+        """
+        for table, column in (('checksums', 'chunk_size'), ('parts', 'part_size')):
+            used = self.__used[table]
+
+            if used:
+                self.__connection.executemany(
+                    'UPDATE {0} SET used = ? WHERE path = ? AND {1} = ?'.format(table, column),
+                    ((t, path, size) for (path, size), t in used.iteritems()))
+                used.clear()
+
+        self.__connection.commit()
+        self.__pending = 0
+
+    def close(self):
+        """
+        Evicts the least recently used files above the size limit and closes the cache
+        """
+        with self.__lock:
+            if self.__timer is not None:
+                self.__timer.cancel()
+
+            self._commit()
+
+            for table in ('checksums', 'parts'):
+                self.__connection.execute(
+                    'DELETE FROM {0} WHERE rowid IN '
+                    '(SELECT rowid FROM {0} ORDER BY used DESC LIMIT -1 OFFSET ?)'.format(table),
+                    (self.__max_entries,))
+            self.__connection.commit()
+            self.__connection.close()
+            self.__closed = True
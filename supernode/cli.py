@@ -9,6 +9,7 @@ Usage:
 Commands:
     config      Collects configuration information needed to use other commands
     create      Creates a new package
+    publish     Publishes a new version, uploading the files as they are processed
     tag         Updates the specified version tag for a package
     update      Updates an existing package with a new version
     upload      Uploads the package contents to the S3 origin bucket
@@ -16,6 +17,7 @@ Commands:
 
 from commands.config import ConfigCommand
 from commands.create import CreateCommand
+from commands.publish import PublishCommand
 from commands.tag import TagCommand
 from commands.update import UpdateCommand
 from commands.upload import UploadCommand
@@ -32,6 +34,8 @@ def main():
         command = ConfigCommand()
     elif command_name == 'create':
         command = CreateCommand()
+    elif command_name == 'publish':
+        command = PublishCommand()
     elif command_name == 'tag':
         command = TagCommand()
     elif command_name == 'update':
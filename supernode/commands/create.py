@@ -3,14 +3,20 @@ Creates a new package.
 
 Usage:
     supernode create --path <path> --name <name>
-        [--arguments <args>] [--chunk-size 1048576]
+        [--arguments <args>] [--chunk-size 1048576] [--exclude <globs>]
+        [--include <globs>] [--jobs 1] [--no-cache] [--parallel 8]
         [--run <run>] [--type package] [--version-name <name>]
     supernode create -h | --help
 
 Options:
     --arguments <args>      The arguments to pass to the file being run
     --chunk-size <size>     The chunk size in bytes [default: 1048576]
+    --exclude <globs>       Comma separated glob patterns of the files and folders to leave out
+    --include <globs>       Comma separated glob patterns of the only files to add
+    --jobs <jobs>           Number of processes calculating checksums [default: 1]
+    --no-cache              Recalculate the checksums of every file
     --name <name>           The name of the package
+    --parallel <number>     Number of files added to the version in parallel [default: 8]
     --path <path>           The path to the package files
     --run <run>             The path of the file to run for the package
     --type <type>           The type of package [default: package]
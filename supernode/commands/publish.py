@@ -0,0 +1,263 @@
+"""
+Publishes a new package version, reading each file only once to both calculate
+its checksums and upload it to the S3 origin bucket.
+
+Usage:
+    supernode publish --path <path>
+        [--arguments <args>] [--chunk-size 1048576] [--exclude <globs>]
+        [--include <globs>] [--packageid <packageid>] [--parallel 4]
+        [--progress bar] [--run <run>] [--version-name <name>]
+    supernode publish -h | --help
+
+Options:
+    --arguments <args>          The arguments to pass to the file being run
+    --chunk-size <size>         The chunk size in bytes [default: 1048576]
+    --exclude <globs>           Comma separated glob patterns of the files and folders to leave out
+    --include <globs>           Comma separated glob patterns of the only files to publish
+    --packageid <packageid>     The package being updated
+    --parallel <number>         Number of parallel uploads [default: 4]
+    --progress <mode>           Display the progress as a bar, or as JSON lines with json [default: bar]
+    --path <path>               The path to the package files
+    --run <run>                 The path of the file to run for the package
+    --version-name <name>       The name of the package version
+
+Publishing is equivalent to running update followed by upload. If no package is
+specified, the command will update package_id stored in the current configuration.
+The version is saved to the configuration as soon as it is created, so an interrupted
+publish can be finished by upload, which also adds the files the version is missing.
+"""
+
+from array import array
+from cStringIO import StringIO
+from .update import UpdateCommand
+from .upload import MINIMUM_MULTIPART_SIZE, PROGRESS_MODES, ParallelUpload, TransferGovernor, UploadCommand, \
+    UploadProgress, UploadScheduler
+from supernode.journal import UploadJournal
+from supernode.walk import parse_patterns
+import base64
+import binascii
+import functools
+import hashlib
+import os
+
+
+class PublishCommand(UpdateCommand):
+    def help(self):
+        return __doc__
+
+    def run(self, options):
+        package_id = self.get_package_id(options)
+
+        print 'Processing package files...'
+        path_absolute = os.path.abspath(options['--path'])
+        chunk_size = int(options['--chunk-size'])
+        max_parallel_uploads = int(options['--parallel'])
+
+        if options['--progress'] not in PROGRESS_MODES:
+            exit('Invalid progress mode: {0}'.format(options['--progress']))
+
+        self.check_chunk_size(chunk_size)
+        package_files = self.list_files(path_absolute, parse_patterns(options['--include']),
+                                        parse_patterns(options['--exclude']))
+
+        if not package_files:
+            exit('The package directory contains no files')
+
+        print 'Creating new version...'
+        version_id = self.create_version(package_id, path_absolute, options)
+
+        # Upload adds the files which were not added with this chunk size when the publish is interrupted
+        self.settings['register_chunk_size'] = str(chunk_size)
+        self.save_version(package_id, version_id, path_absolute, options)
+
+        print 'Querying upload credentials...'
+        credentials = self.api.get_upload_credentials(version_id)
+
+        print 'Publishing files...'
+        progress = UploadProgress('{0} files'.format(len(package_files)), mode=options['--progress'])
+        governor = TransferGovernor(max_parallel_uploads)
+
+        with UploadJournal(version_id) as journal:
+            scheduler = PublishScheduler(self, version_id, credentials, chunk_size, max_parallel_uploads, progress,
+                                         governor, journal)
+
+            for file_path, relative_path, file_stat in package_files:
+                scheduler.add_package_file(file_path, relative_path, file_stat.st_size)
+
+            scheduler.run()
+            self.api.complete_upload(version_id)
+            journal.remove()
+
+        del self.settings['register_chunk_size']
+        self.save_settings()
+
+    def publish_file(self, bucket, key_name, path, chunk_size, progress):
+        """
+        Uploads the file in a single request and returns its MD5 and CRC chunk values
+
+        @type bucket: Bucket
+        @type key_name: str
+        @type path: str
+        @type chunk_size: int
+        @type progress: UploadProgress
+        @rtype: tuple
+        """
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        checksums = self.calculate_chunk_checksums(data, chunk_size) or array('I', [0])
+        md5 = hashlib.md5(data)
+
+        key = bucket.new_key(key_name)
+        key.set_contents_from_file(StringIO(data), cb=functools.partial(progress.update, key_name), num_cb=100,
+                                   md5=(md5.hexdigest(), base64.b64encode(md5.digest())))
+        progress.file_done()
+
+        return md5.hexdigest(), checksums
+
+    def publish_multipart(self, credentials, key_name, multipart_id, path, relative_path, chunk_size,
+                          max_parallel_uploads, progress):
+        """
+        Uploads the file using a multipart upload and returns its MD5 and CRC chunk values
+        The parts are aligned with the chunks, so the checksums can be calculated part by part
+
+        @type credentials: dict
+        @type key_name: str
+        @type multipart_id: str
+        @type path: str
+        @type relative_path: str
+        @type chunk_size: int
+        @type max_parallel_uploads: int
+        @type progress: UploadProgress
+        @rtype: tuple
+        """
+        part_size = ParallelUpload.calculate_chunk_size(os.path.getsize(path))
+        part_size += -part_size % chunk_size
+
+        checksums = array('I')
+        md5 = hashlib.md5()
+        upload = ParallelUpload(credentials, key_name, multipart_id, path, relative_path, max_parallel_uploads,
+                                part_size, progress)
+        upload.upload_parts(self.read_parts(path, part_size, chunk_size, checksums, md5))
+
+        return md5.hexdigest(), checksums
+
+    def read_parts(self, path, part_size, chunk_size, checksums, md5):
+        """
+        Reads the file sequentially and yields the number, data and MD5 digests of each part,
+        appending the CRC chunk values to the checksums and updating the file MD5 along the way
+
+        @type path: str
+        @type part_size: int
+        @type chunk_size: int
+        @type checksums: array
+        @type md5: _hashlib.HASH
+        @rtype: collections.Iterable[tuple]
+        """
+        part_number = 1
+
+        with open(path, 'rb') as f:
+            data = f.read(part_size)
+
+            while data:
+                checksums.extend(self.calculate_chunk_checksums(data, chunk_size))
+                md5.update(data)
+                part_md5 = hashlib.md5(data)
+
+                yield part_number, data, (part_md5.hexdigest(), base64.b64encode(part_md5.digest()))
+
+                part_number += 1
+                data = f.read(part_size)
+
+    @staticmethod
+    def calculate_chunk_checksums(data, chunk_size):
+        """
+        Returns the CRC values of each chunk in the data
+
+        @type data: str
+        @type chunk_size: int
+        @rtype: array
+        """
+        offsets = range(0, len(data), chunk_size)
+
+        # The chunks are read through buffers, which unlike memoryview are also available on Python 2.6
+        return array('I', (binascii.crc32(buffer(data, i, chunk_size)) & 0xffffffff for i in offsets))
+
+
+class PublishScheduler(UploadScheduler):
+    """
+    Publishes the files through the transfers of an upload scheduler, reading each file once to
+    calculate its checksums while it is uploaded, and adds each file to the version once it is uploaded
+    """
+    def __init__(self, command, version_id, credentials, chunk_size, max_parallel_uploads, progress, governor,
+                 journal):
+        """
+        @type command: PublishCommand
+        @type version_id: str
+        @type credentials: dict
+        @type chunk_size: int
+        @type max_parallel_uploads: int
+        @type progress: UploadProgress
+        @type governor: TransferGovernor
+        @param journal: Records the files once they are added to the version
+        @type journal: UploadJournal
+        """
+        UploadScheduler.__init__(self, credentials, max_parallel_uploads, progress, governor)
+        self.__command = command
+        self.__version_id = version_id
+        self.__credentials = credentials
+        self.__chunk_size = chunk_size
+        self.__max_parallel_uploads = max_parallel_uploads
+        self.__progress = progress
+        self.__governor = governor
+        self.__journal = journal
+        self.__relative_paths = {}
+
+    def add_package_file(self, path, relative_path, size):
+        """
+        Adds a file of the package, which is uploaded in parts when it is large
+
+        @type path: str
+        @type relative_path: str
+        @type size: int
+        """
+        key_name = self.__credentials['KeyPrefix'] + relative_path.replace('\\', '/')
+        self.__relative_paths[key_name] = relative_path
+        self.add_file(key_name, path, size)
+
+    def _transfer_file(self, key_name, path, size):
+        """
+        Publishes a file and adds it to the version
+
+        @type key_name: str
+        @type path: str
+        @type size: int
+        """
+        result = []
+
+        # Smaller files can be uploaded directly, and the parts of multipart uploads are transferred in parallel
+        if size <= MINIMUM_MULTIPART_SIZE:
+            self.__governor.run(size, self._publish_file, key_name, path, result)
+        else:
+            multipart = UploadCommand.get_bucket(self.__credentials).initiate_multipart_upload(key_name)
+            result.append(self.__command.publish_multipart(self.__credentials, key_name, multipart.id, path,
+                                                           self.__relative_paths[key_name], self.__chunk_size,
+                                                           self.__max_parallel_uploads, self.__progress))
+
+        md5, checksums = result[-1]
+        package_file = {'path': self.__relative_paths[key_name], 'size': size, 'md5': md5, 'checksums': checksums}
+        self.__command.add_file(self.__version_id, package_file, self.__chunk_size)
+
+        if self.__journal is not None:
+            self.__journal.add_file(key_name, size)
+
+    def _publish_file(self, key_name, path, result):
+        """
+        Uploads a file in a single request, appending its MD5 and CRC chunk values to the result
+
+        @type key_name: str
+        @type path: str
+        @type result: list
+        """
+        bucket = UploadCommand.get_bucket(self.__credentials)
+        result.append(self.__command.publish_file(bucket, key_name, path, self.__chunk_size, self.__progress))
@@ -3,27 +3,59 @@ Updates an existing package with a new version.
 
 Usage:
     supernode update --path <path>
-        [--arguments <args>] [--chunk-size 1048576]
-        [--packageid <packageid>] [--run <run>]
-        [--type package] [--version-name <name>]
+        [--arguments <args>] [--chunk-size 1048576] [--exclude <globs>]
+        [--include <globs>] [--jobs 1] [--no-cache] [--packageid <packageid>]
+        [--parallel 8] [--run <run>] [--type package] [--version-name <name>]
     supernode update -h | --help
 
 Options:
     --arguments <args>          The arguments to pass to the file being run
     --chunk-size <size>         The chunk size in bytes [default: 1048576]
+    --exclude <globs>           Comma separated glob patterns of the files and folders to leave out
+    --include <globs>           Comma separated glob patterns of the only files to add
+    --jobs <jobs>               Number of processes calculating checksums [default: 1]
+    --no-cache                  Recalculate the checksums of every file
     --packageid <packageid>     The package being updated
+    --parallel <number>         Number of files added to the version in parallel [default: 8]
     --path <path>               The path to the package files
     --run <run>                 The path of the file to run for the package
     --version-name <name>       The name of the package version
 
 If no package is specified, the command will update package_id stored in the
 current configuration.
+
+Checksums of unchanged files are reused from the cache stored in your home
+folder under the file: ~/package.cache
+
+The glob patterns are matched against both the path relative to the package
+folder and the name of each file or folder. They are saved with the version,
+so upload walks the same files.
 """
 
+from array import array
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from supernode.cache import ChecksumCache
 from supernode.command import Command
+from supernode.manifest import ManifestWriter
+from supernode.walk import parse_patterns, walk_files
 import binascii
 import hashlib
+import io
+import itertools
 import os
+import stat
+import sys
+import time
+
+# The number of times adding a file is attempted before giving up
+ADD_FILE_ATTEMPTS = 3
+
+# Python 2.6 has no memoryview, so files are read into new strings there
+try:
+    memoryview
+except NameError:
+    memoryview = None
 
 
 class UpdateCommand(Command):
@@ -31,6 +63,140 @@ class UpdateCommand(Command):
         return __doc__
 
     def run(self, options):
+        package_id = self.get_package_id(options)
+
+        # Walk the package files, calculating their checksums as they are added
+        print 'Processing package files...'
+        path_absolute = os.path.abspath(options['--path'])
+        chunk_size = int(options['--chunk-size'])
+        jobs = int(options['--jobs'])
+        parallel = int(options['--parallel'])
+
+        # The options are validated before the version is created
+        self.check_chunk_size(chunk_size)
+
+        if jobs < 1:
+            exit('The number of jobs must be at least 1')
+
+        if parallel < 1:
+            exit('The number of parallel requests must be at least 1')
+
+        package_files = self.walk_package(path_absolute, parse_patterns(options['--include']),
+                                          parse_patterns(options['--exclude']))
+
+        # Only the first file is walked, so an empty package is rejected before the version is created
+        first_file = next(package_files, None)
+
+        if first_file is None:
+            exit('The package directory contains no files')
+
+        # Create the version
+        print 'Creating new version...'
+        version_id = self.create_version(package_id, path_absolute, options)
+        cache = None if options['--no-cache'] else ChecksumCache()
+
+        try:
+            # Walk, hash and add the files in a pipeline, each stage only running a few files ahead of the next
+            package_files = self.chunk_files(itertools.chain([first_file], package_files), chunk_size, jobs, cache)
+
+            # Add files as their checksums are calculated, writing them to the manifest read by upload
+            print 'Adding files to version...'
+            manifest = ManifestWriter(version_id)
+
+            try:
+                self.register_files(version_id, package_files, chunk_size, parallel, manifest)
+            except BaseException:
+                manifest.abort()
+                raise
+
+            manifest.close()
+        finally:
+            if cache is not None:
+                cache.close()
+
+        self.save_version(package_id, version_id, path_absolute, options)
+
+    def register_files(self, version_id, package_files, chunk_size, parallel, manifest=None):
+        """
+        Adds the files to the version using parallel requests, printing them in order as they are added
+        Only a limited number of files are queued, so the files are read no faster than they are added
+
+        @type version_id: str
+        @type package_files: collections.Iterable[dict]
+        @type chunk_size: int
+        @type parallel: int
+        @param manifest: Records the files as they are added
+        @type manifest: ManifestWriter
+        """
+        pending = deque()
+
+        with ThreadPoolExecutor(max_workers=parallel) as pool:
+            for f in package_files:
+                if manifest is not None:
+                    manifest.add(f['path'], f['size'], chunk_size, f['md5'], f['checksums'])
+
+                pending.append((f['path'], pool.submit(self.add_file, version_id, f, chunk_size)))
+
+                while pending and (len(pending) >= parallel * 2 or pending[0][1].done()):
+                    self.wait_added(*pending.popleft())
+
+            while pending:
+                self.wait_added(*pending.popleft())
+
+    def add_file(self, version_id, package_file, chunk_size):
+        """
+        Adds the file to the version, retrying failed requests
+        Adding a file is not idempotent and a failed request may have been processed before its response
+        was lost, so the files of the version are checked for the file before it is added again
+
+        @type version_id: str
+        @type package_file: dict
+        @type chunk_size: int
+        """
+        for attempt in range(ADD_FILE_ATTEMPTS):
+            if attempt and self.is_added(version_id, package_file['path']):
+                return
+
+            try:
+                return self.api.add_file(version_id, package_file['path'], package_file['size'], chunk_size,
+                                         package_file['checksums'], package_file['md5'])
+            except Exception:
+                if attempt == ADD_FILE_ATTEMPTS - 1:
+                    raise
+
+                time.sleep(2 ** attempt)
+
+    def is_added(self, version_id, path):
+        """
+        Returns whether the file has been added to the version
+
+        @type version_id: str
+        @type path: str
+        @rtype: bool
+        """
+        path = path.replace('\\', '/')
+
+        return any(f['Path'].replace('\\', '/') == path for f in self.api.get_files(version_id))
+
+    @staticmethod
+    def wait_added(path, future):
+        """
+        Waits for the file to be added to the version and prints it
+
+        @type path: str
+        @type future: Future
+        """
+        # We must provide a timeout to be able to interrupt the threads
+        future.result(timeout=sys.maxint)
+        print '  {0}'.format(path)
+
+    def get_package_id(self, options):
+        """
+        Returns the package being updated, after validating it belongs to the configured partner
+
+        @type options: dict
+        @rtype: str
+        """
         # Which package is being updated?
         package_id = options['--packageid'] or self.settings['package_id']
 
@@ -43,17 +209,17 @@ class UpdateCommand(Command):
         if package['PartnerId'] != self.settings['partner_id']:
             exit('The specified package does not belong to the currently configured partner')
 
-        # Read the package files and calculate their checksums
-        print 'Processing package files...'
-        path_absolute = os.path.abspath(options['--path'])
-        chunk_size = int(options['--chunk-size'])
-        package_files = self.chunk_files(path_absolute, chunk_size)
+        return package_id
 
-        if not package_files:
-            exit('The package directory contains no files')
+    def create_version(self, package_id, path, options):
+        """
+        Creates the package version described by the options and returns its primary key
 
-        # Create the version
-        print 'Creating new version...'
+        @type package_id: str
+        @type path: str
+        @type options: dict
+        @rtype: str
+        """
         arguments = options['--arguments']
 
         # Run is optional
@@ -63,66 +229,169 @@ class UpdateCommand(Command):
             if not os.path.isfile(run_path):
                 exit('Run file specified does not exist')
 
-            run_relative_path = run_path.replace(path_absolute, '').lstrip('/\\')
+            run_relative_path = os.path.relpath(run_path, path)
+
+            if run_relative_path.startswith(os.pardir + os.sep):
+                exit('Run file specified must be inside the package folder')
         else:
             run_relative_path = None
 
         version_name = options['--version-name']
         version = self.api.create_version(package_id, run_relative_path, arguments, version_name)
-        version_id = version['VersionId']
 
-        # Add files
-        print 'Adding files to version...'
+        return version['VersionId']
 
-        for f in package_files:
-            print '  {0}'.format(f['path'])
-            self.api.add_file(version_id, f['path'], f['size'], chunk_size, f['checksums'], f['md5'])
+    def save_version(self, package_id, version_id, path, options):
+        """
+        Saves the package, version and file patterns to the configuration and displays them
 
+        @type package_id: str
+        @type version_id: str
+        @type path: str
+        @type options: dict
+        """
         print 'Saving package information to configuration...'
         self.settings['package_id'] = package_id
         self.settings['version_id'] = version_id
-        self.settings['path'] = path_absolute
+        self.settings['path'] = path
+
+        # Upload walks the same files as the version
+        for name in ('include', 'exclude'):
+            if options.get('--' + name):
+                self.settings[name] = options['--' + name]
+            else:
+                self.settings.pop(name, None)
         self.save_settings()
 
         print ''
         print 'PackageId = {0}'.format(package_id)
         print 'VersionId = {0}'.format(version_id)
 
-    def chunk_files(self, path, chunk_size):
+    def chunk_files(self, package_files, chunk_size, jobs=1, cache=None):
         """
-        Recursively reads all of the files in the specified path and returns a list of tuples
-        representing them with their appropriate CRC values based on the chunk_size
+        Reads the walked files and yields dicts representing them with their
+        appropriate CRC values based on the chunk_size
+
+        The files are yielded in walk order as soon as their checksums are available,
+        regardless of the number of jobs used. Only files missing from the cache are read,
+        and the files are only walked a few files ahead of the oldest one still being read.
+
+        @param package_files: The path, relative path and stat of each file, as yielded by walk_package
+        @type package_files: collections.Iterable[tuple]
+        @type chunk_size: int
+        @type jobs: int
+        @type cache: ChecksumCache
+        @rtype: collections.Iterable[dict]
+        """
+        pool = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+        pending = deque()
+
+        try:
+            for file_path, relative_path, file_stat in package_files:
+                checksums = cache.get(file_path, file_stat, chunk_size) if cache else None
+
+                if checksums is None and pool is not None:
+                    checksums = pool.submit(calculate_checksums, file_path, chunk_size)
+
+                pending.append((file_path, relative_path, file_stat, checksums))
+
+                # Only a few files are read ahead of the oldest one still being read
+                while pending and (len(pending) > jobs * 4 or self.is_ready(pending[0][3])):
+                    yield self.create_package_file(chunk_size, cache, *pending.popleft())
+
+            while pending:
+                yield self.create_package_file(chunk_size, cache, *pending.popleft())
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    @staticmethod
+    def is_ready(checksums):
+        """
+        Returns whether the checksums are available without waiting on another process
+
+        @type checksums: tuple or Future or None
+        @rtype: bool
+        """
+        return not isinstance(checksums, Future) or checksums.done()
+
+    def create_package_file(self, chunk_size, cache, file_path, relative_path, file_stat, checksums):
+        """
+        Returns the dict representing the file, calculating its checksums when they are not available yet
 
-        @type path: str
         @type chunk_size: int
-        @rtype: list of dict
+        @type cache: ChecksumCache
+        @type file_path: str
+        @param relative_path: The path of the file relative to the package folder
+        @type relative_path: str
+        @type file_stat: posix.stat_result
+        @param checksums: The cached checksums, the future calculating them or None
+        @type checksums: tuple or Future or None
+        @rtype: dict
+        """
+        if checksums is None:
+            md5, checksums = self.calculate_checksums(file_path, chunk_size)
+        elif isinstance(checksums, Future):
+            md5, checksums = checksums.result(timeout=sys.maxint)
+        else:
+            md5, checksums = checksums
+            cache = None
+
+        if cache is not None:
+            cache.set(file_path, file_stat, chunk_size, md5, checksums)
+
+        return {
+            'md5': md5,
+            'path': relative_path,
+            'size': file_stat.st_size,
+            'checksums': checksums
+        }
+
+    @staticmethod
+    def walk_package(path, include=None, exclude=None):
+        """
+        Recursively walks the path, path relative to the specified path and stat of the files,
+        sorted so they are always in the same order
+
+        @type path: str
+        @param include: The glob patterns of the files to walk, or None for every file
+        @type include: list of str
+        @param exclude: The glob patterns of the files and folders to skip
+        @type exclude: list of str
+        @rtype: collections.Iterable[tuple]
         """
         if not os.path.isdir(path):
             exit('The path specified is not a directory')
 
-        if type(chunk_size) is not int:
-            exit("The chunk size must be an integer")
+        return walk_files(path, include, exclude)
 
-        if chunk_size < 1024 or chunk_size > 1073741824:
-            exit("The chunk size must be between 1KB and 1GB")
+    @staticmethod
+    def list_files(path, include=None, exclude=None):
+        """
+        Recursively lists the path, path relative to the specified path and stat of the files,
+        sorted so they are always in the same order
 
-        package_files = []
+        @type path: str
+        @param include: The glob patterns of the files to list, or None for every file
+        @type include: list of str
+        @param exclude: The glob patterns of the files and folders to skip
+        @type exclude: list of str
+        @rtype: list of tuple
+        """
+        return list(UpdateCommand.walk_package(path, include, exclude))
 
-        for root, dirs, files in os.walk(path):
-            for f in files:
-                file_path = os.path.join(root, f)
-                file_path_relative = file_path.replace(path, '').lstrip('/\\')
-                size = os.path.getsize(file_path)
-                md5, checksums = self.calculate_checksums(file_path, chunk_size)
+    @staticmethod
+    def check_chunk_size(chunk_size):
+        """
+        Exits when the chunk size is not supported
 
-                package_files.append({
-                    'md5': md5,
-                    'path': file_path_relative,
-                    'size': size,
-                    'checksums': checksums
-                })
+        @type chunk_size: int
+        """
+        if type(chunk_size) is not int:
+            exit("The chunk size must be an integer")
 
-        return package_files
+        if chunk_size < 1024 or chunk_size > 1073741824:
+            exit("The chunk size must be between 1KB and 1GB")
 
     @staticmethod
     def calculate_checksums(path, chunk_size):
@@ -133,16 +402,18 @@ class UpdateCommand(Command):
         @type chunk_size: int
         @rtype: tuple
         """
-        checksums = []
+        checksums = array('I')
         md5 = hashlib.md5()
 
-        with open(path, 'rb') as f:
-            chunk = f.read(chunk_size)
+        # Special files (pipes, devices) may return short reads, so they use the buffered path
+        if memoryview is not None and stat.S_ISREG(os.stat(path).st_mode):
+            chunks = UpdateCommand.read_chunks_into(path, chunk_size)
+        else:
+            chunks = UpdateCommand.read_chunks(path, chunk_size)
 
-            while chunk:
-                checksums.append(binascii.crc32(chunk) & 0xffffffff)
-                md5.update(chunk)
-                chunk = f.read(chunk_size)
+        for chunk in chunks:
+            checksums.append(binascii.crc32(chunk) & 0xffffffff)
+            md5.update(chunk)
 
         # In the case of a zero-byte file, just return zero
         if len(checksums) == 0:
@@ -150,3 +421,63 @@ class UpdateCommand(Command):
             md5.update('')
 
         return md5.hexdigest(), checksums
+
+    @staticmethod
+    def read_chunks(path, chunk_size):
+        """
+        Yields the file contents in chunks, allocating a new string for each chunk
+
+        @type path: str
+        @type chunk_size: int
+        @rtype: collections.Iterable[str]
+        """
+        with open(path, 'rb') as f:
+            chunk = f.read(chunk_size)
+
+            while chunk:
+                yield chunk
+                chunk = f.read(chunk_size)
+
+    @staticmethod
+    def read_chunks_into(path, chunk_size):
+        """
+        Yields the file contents in chunks read into a single preallocated buffer
+        The yielded memoryview is overwritten by the next chunk, so it must not be kept
+
+        @type path: str
+        @type chunk_size: int
+        @rtype: collections.Iterable[memoryview]
+        """
+        view = memoryview(bytearray(chunk_size))
+
+        # Unbuffered, so the data is read straight into the buffer
+        with io.open(path, 'rb', buffering=0) as f:
+            while True:
+                size = 0
+
+                while size < chunk_size:
+                    read = f.readinto(view[size:])
+
+                    if not read:
+                        break
+
+                    size += read
+
+                if size == 0:
+                    break
+
+                yield view[:size]
+
+                if size < chunk_size:
+                    break
+
+
+def calculate_checksums(path, chunk_size):
+    """
+    Module level wrapper of UpdateCommand.calculate_checksums which can be pickled by the process pool
+
+    @type path: str
+    @type chunk_size: int
+    @rtype: tuple
+    """
+    return UpdateCommand.calculate_checksums(path, chunk_size)
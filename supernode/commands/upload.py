@@ -6,27 +6,181 @@ Usage:
     supernode upload -h | --help
 
 Options:
+    --adaptive              Size the parts of multipart uploads from the measured throughput
+    --aimd                  Lower the number of parallel uploads when they slow down or fail
+    --base-tag <tag>        Copy the files unchanged since the version with the tag instead of uploading them
+    --base-version <id>     Copy the files unchanged since the version instead of uploading them
+    --check                 Check the files recorded in the journal against the bucket in the background
+    --delta                 Copy the unchanged parts of large files changed since the base version
+    --gc                    Abort the stale multipart uploads of the version instead of uploading
+    --gc-age <hours>        The number of hours after which multipart uploads are stale [default: 24]
+    --max-rate <rate>       The maximum upload rate in bytes per second, with an optional K, M or G suffix
+    --no-dedup              Upload every copy of identical files instead of copying them in the bucket
+    --md5-metadata          Record the MD5 of large files as metadata instead of copying them to restore their ETag
     --parallel <number>     Number of parallel uploads [default: 4]
+    --processes <number>    Number of processes the files are sharded across, each with its own uploads [default: 1]
+    --part-md5              Hash the parts of large files in a sequential pass, so they are read once when uploaded
+    --progress <mode>       Display the progress as a bar, or as JSON lines with json [default: bar]
+    --read-ahead <mb>       Read large files sequentially into buffers using at most this many megabytes
+    --rate-file <path>      A file containing the maximum upload rate, read again whenever it changes
     --test                  Disable skip, resume, and complete functionality
+
+The files and parts are recorded in a local journal as they are uploaded, so an
+interrupted upload resumes without listing the bucket. With --check, the bucket is
+still listed while uploading, and the recorded files missing from it are uploaded again.
+
+With a base version, the files whose size and MD5 were added to the base version are
+copied from it within the bucket, only the new and changed files being uploaded.
+
+With --delta, the parts of the large files changed since the base version are aligned with
+the checksum chunks. The parts whose chunks did not change are copied from the same range
+of the base version's file, and only uploaded when the MD5 of the copied part differs.
+
+Identical files are only uploaded once, the other copies being created by copying the
+uploaded file in the bucket. Only files sharing their size with another file are hashed,
+the MD5 calculated by update being reused when the file has not changed since.
+
+The multipart uploads aborted by --gc exclude the ones recorded in the journal, which
+the next upload will resume.
+
+The maximum rate of an upload in progress can be changed by writing the new rate to
+the rate file, zero removing the limit.
+
+Files uploaded in parts do not have their MD5 as ETag, which is restored by copying them
+over themselves once uploaded. With --md5-metadata, the MD5 and the ETag of the parts are
+calculated locally and recorded as x-amz-meta-md5 and x-amz-meta-multipart-etag instead,
+the MD5 calculated by update being reused when the file has not changed since.
 """
 
+from array import array
+import base64
+import binascii
 import boto
+import datetime
 import functools
+import hashlib
+import json
 import math
+import multiprocessing
 import os
+import Queue
 import sys
+import threading
+import time
+import urlparse
 
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from boto.exception import S3ResponseError
+from boto.s3.connection import OrdinaryCallingFormat
 from boto.s3.multipart import MultiPartUpload
+from cStringIO import StringIO
 from progressbar import ETA, FileTransferSpeed, Percentage, ProgressBar, WidgetHFill
+from supernode.cache import ChecksumCache
 from supernode.command import Command
+from supernode.commands.update import UpdateCommand
+from supernode.journal import UploadJournal
+from supernode.manifest import Manifest, unpack_checksums
+from supernode.walk import parse_patterns, walk_files
 
-# The upload progress bar is tied to the console, so it's global
-progress = None
+# Python 2.6 has no memoryview, so parts are copied into the buffers there
+try:
+    memoryview
+except NameError:
+    memoryview = None
 
 MINIMUM_CHUNK_SIZE = 5 * 1024 * 1024
 MINIMUM_MULTIPART_SIZE = 2 * MINIMUM_CHUNK_SIZE
 MAXIMUM_COPY_SIZE = 5 * 1024 * 1024 * 1024
+MAXIMUM_PART_SIZE = 5 * 1024 * 1024 * 1024
+MAXIMUM_PART_COUNT = 10000
+
+# The number of seconds each part should take to upload when the part sizes are adaptive
+PART_SECONDS = 15
+
+# The number of times a file or part is uploaded before giving up
+UPLOAD_ATTEMPTS = 3
+
+# The multipliers of the maximum rate suffixes
+RATE_UNITS = {'K': 1024, 'M': 1024 * 1024, 'G': 1024 * 1024 * 1024}
+
+# The number of seconds between checks of the rate file
+RATE_FILE_INTERVAL = 1
+
+# The seconds between redraws of the progress bar and between JSON progress lines
+BAR_INTERVAL = 0.1
+JSON_INTERVAL = 1
+
+# The progress display modes
+PROGRESS_MODES = ('bar', 'json')
+
+# The metadata names of the MD5 and the multipart ETag of files uploaded in parts
+MD5_METADATA = 'md5'
+ETAG_METADATA = 'multipart-etag'
+
+# The size of the blocks read when calculating the MD5 of files
+READ_SIZE = 1024 * 1024
+
+# The fraction of the best throughput a part may drop to before the number of parallel uploads is lowered
+SLOW_PART_RATIO = 0.5
+
+
+def parse_checksums(checksums):
+    """
+    Returns the CRC chunk values of a file returned by the REST API or read from a manifest
+
+    @param checksums: The comma separated values, a list of values, or the values packed by a manifest
+    @type checksums str
+    @rtype: array
+    """
+    if isinstance(checksums, buffer):
+        return unpack_checksums(checksums)
+
+    if isinstance(checksums, basestring):
+        checksums = checksums.split(',') if checksums else []
+
+    return array('I', (int(c) for c in checksums))
+
+
+def upload_shard(index, credentials, transfers, parts, options, processes, queue, started):
+    """
+    Uploads a shard of the files in a worker process, reporting its progress, files and parts to the coordinator
+
+    @param index: The index of the shard
+    @type index int
+    @type credentials dict
+    @param transfers: The files of the shard, as passed to UploadCommand.upload_transfers
+    @type transfers list of tuple
+    @param parts: The parts recorded in the journal of each multipart upload, keyed by multipart upload ID,
+                  or None when the coordinator has no journal
+    @type parts dict
+    @type options dict
+    @param processes: The number of processes sharing the maximum rate and the read ahead memory
+    @type processes int
+    @type queue multiprocessing.Queue
+    @param started: Set by the coordinator once every shard is ready to upload
+    @type started multiprocessing.Event
+    """
+    # The connections of the coordinator may have been inherited, and must not be shared
+    connections.reset()
+
+    try:
+        max_rate = UploadCommand.parse_rate(options['--max-rate']) if options['--max-rate'] else 0
+        limiter = None
+
+        # Without a limit, the progress callbacks of the transfers do not share a lock
+        if max_rate or options['--rate-file']:
+            limiter = BandwidthLimiter(max_rate, options['--rate-file'], processes)
+
+        progress = ShardProgress(index, queue, started, limiter)
+        journal = ShardJournal(queue, parts) if parts is not None else None
+
+        copied_bytes = UploadCommand.upload_transfers(credentials, transfers, progress, journal, options, processes)
+    except BaseException as e:
+        # exit() raises SystemExit with the message
+        queue.put(('error', str(e) or e.__class__.__name__))
+        return
+
+    queue.put(('done', copied_bytes, connections.opened, connections.reused))
 
 
 class UploadCommand(Command):
@@ -40,7 +194,18 @@ class UploadCommand(Command):
 
         path = self.settings['path']
         version_id = self.settings['version_id']
-        max_parallel_uploads = int(options['--parallel'])
+
+        if options['--progress'] not in PROGRESS_MODES:
+            exit('Invalid progress mode: {0}'.format(options['--progress']))
+
+        if int(options['--processes']) < 1:
+            exit('The number of processes must be at least 1')
+
+        if options['--max-rate']:
+            try:
+                self.parse_rate(options['--max-rate'])
+            except ValueError:
+                exit('Invalid maximum rate: {0}'.format(options['--max-rate']))
 
         print 'Querying upload credentials...'
         credentials = self.api.get_upload_credentials(version_id)
@@ -48,233 +213,2203 @@ class UploadCommand(Command):
 
         print 'Connecting to S3 bucket...'
         bucket = self.get_bucket(credentials)
-        keys = []
 
-        if not options['--test']:
-            print 'Querying existing objects...'
-            keys = list(bucket.list(prefix))
+        if options['--gc']:
+            self.collect_garbage(bucket, credentials, version_id, options)
+            return
 
-        multipart_uploads = []
+        journal = None
+        check = None
+        key_sizes = {}
+        multipart_ids = {}
 
         if not options['--test']:
+            journal = UploadJournal(version_id)
+
+        if journal is not None and not journal.is_empty():
+            print 'Reading upload journal...'
+            key_sizes = journal.file_sizes(prefix)
+            multipart_ids = journal.multipart_ids(prefix)
+
+            if options['--check']:
+                check = ThreadPoolExecutor(max_workers=1).submit(self.check_keys, credentials, prefix)
+
+        elif journal is not None:
+            print 'Querying existing objects...'
+            key_sizes = self.index_keys(bucket, prefix)
+
             print 'Querying multipart uploads...'
-            multipart_uploads = list(bucket.list_multipart_uploads())
+            multipart_ids = self.index_multipart_uploads(bucket, prefix)
+
+        uploads = []
+        skipped = []
+        reused = []
+        copies = []
+        deltas = {}
+
+        # Walk the same files as the version
+        include = parse_patterns(self.settings.get('include'))
+        exclude = parse_patterns(self.settings.get('exclude'))
+
+        for local_path, relative_path, file_stat in walk_files(path, include, exclude):
+            relative_path = relative_path.replace('\\', '/')
+            size = file_stat.st_size
+
+            # Skip files that have already been uploaded
+            if key_sizes.get(relative_path) == size:
+                skipped.append((size, local_path, relative_path))
+                continue
+
+            uploads.append((size, local_path, relative_path))
+
+        base_version_id = self.get_base_version_id(options)
+
+        if base_version_id is not None:
+            print 'Comparing with the base version...'
+            base_prefix = self.get_base_prefix(prefix, version_id, base_version_id)
+            manifests = [Manifest.open(version_id), Manifest.open(base_version_id)]
+
+            try:
+                # The manifests written by update are read instead of querying the files when they exist
+                files, base_files = [list(m.files()) if m else self.api.get_files(v)
+                                     for m, v in zip(manifests, (version_id, base_version_id))]
+                uploads, reused = self.find_reused(files, base_files, base_prefix, uploads)
+
+                if options['--delta']:
+                    deltas = self.find_deltas(files, base_files, base_prefix, uploads)
+            finally:
+                for manifest in manifests:
+                    if manifest is not None:
+                        manifest.close()
+
+        if not options['--no-dedup']:
+            print 'Finding identical files...'
+            uploads, copies = self.find_copies(uploads, skipped)
+            copies = [(size, relative_path, prefix + source) for size, relative_path, source in copies]
 
         print 'Uploading files...'
 
-        for root, dirs, files in os.walk(path):
-            for f in files:
-                local_path = os.path.join(root, f)
-                relative_path = local_path.replace(path, '').replace('\\', '/').lstrip('/\\')
-                key_name = prefix + relative_path
-                size = os.path.getsize(local_path)
+        try:
+            self.upload_files(bucket, credentials, uploads, multipart_ids, journal, options, deltas)
 
-                # Skip files that have already been uploaded
-                if (key_name, size) in [(k.name, k.size) for k in keys]:
-                    continue
+            if check is not None:
+                print 'Checking the journal against the bucket...'
+                remote_sizes = check.result()
+                missing = [u for u in skipped if remote_sizes.get(u[2]) != u[0]]
 
-                # Smaller files can be uploaded directly
-                if size <= MINIMUM_MULTIPART_SIZE:
-                    key = bucket.new_key(key_name)
-                    progress_bar = self.create_progress_bar(relative_path, size)
-                    key.set_contents_from_filename(local_path, cb=self.update_progress, num_cb=100)
-                    progress_bar.finish()
-                    continue
+                if missing:
+                    print 'Uploading {0} files missing from the bucket...'.format(len(missing))
+                    self.upload_files(bucket, credentials, missing, {}, journal, options)
 
-                # Continue the last multipart upload?
-                matching_uploads = [u for u in multipart_uploads if u.key_name == key_name]
+            if reused:
+                print 'Copying {0} files unchanged since the base version...'.format(len(reused))
+                self.copy_files(credentials, reused, journal, int(options['--parallel']))
+                print 'Saved uploading {0:.1f} MB of unchanged files.'.format(
+                    sum(size for size, relative_path, source in reused) / 1024.0 / 1024.0)
 
-                if matching_uploads:
-                    multipart = matching_uploads[-1]
-                else:
-                    multipart = bucket.initiate_multipart_upload(key_name)
+            if copies:
+                print 'Copying {0} identical files...'.format(len(copies))
+                self.copy_files(credentials, copies, journal, int(options['--parallel']))
+                print 'Saved uploading {0:.1f} MB of identical files.'.format(
+                    sum(size for size, relative_path, source in copies) / 1024.0 / 1024.0)
 
-                # Let the class handle the multipart upload
-                ParallelUpload(credentials, key_name, multipart.id, local_path, relative_path,
-                               max_parallel_uploads).upload()
+            if not options['--test']:
+                # An interrupted publish leaves files which were not added to the version
+                register_chunk_size = self.settings.get('register_chunk_size')
 
-        if not options['--test']:
-            self.api.complete_upload(version_id)
+                if register_chunk_size:
+                    print 'Adding the files missing from the version...'
+                    self.add_missing_files(version_id, path, include, exclude, int(register_chunk_size))
+
+                self.api.complete_upload(version_id)
+                journal.remove()
+        finally:
+            # Commit the last records, even when the upload failed
+            if journal is not None:
+                journal.close()
+
+        if not options['--test'] and self.settings.pop('register_chunk_size', None):
+            self.save_settings()
 
         print 'Upload complete.'
 
+    def add_missing_files(self, version_id, path, include, exclude, chunk_size):
+        """
+        Adds the files of the package which have not been added to the version
+
+        @type version_id str
+        @type path str
+        @type include list of str
+        @type exclude list of str
+        @type chunk_size int
+        """
+        added = set(f['Path'].replace('\\', '/') for f in self.api.get_files(version_id))
+
+        for local_path, relative_path, file_stat in walk_files(path, include, exclude):
+            if relative_path.replace('\\', '/') in added:
+                continue
+
+            md5, checksums = UpdateCommand.calculate_checksums(local_path, chunk_size)
+            self.api.add_file(version_id, relative_path, file_stat.st_size, chunk_size, checksums, md5)
+            print '  {0}'.format(relative_path)
+
     @staticmethod
-    def get_bucket(credentials):
+    def calculate_part_digests(path, part_size, cache):
         """
-        Returns the S3 Bucket instance using the supplied credentials
+        Returns the MD5 digest of each part of the file, reading the file only when
+        the digests of its parts are not cached
 
-        @type credentials dict
-        @rtype: Bucket
+        @type path str
+        @type part_size int
+        @type cache ChecksumCache
+        @rtype: list of str
         """
-        s3 = boto.connect_s3(credentials['AccessKeyId'], credentials['SecretAccessKey'],
-                             security_token=credentials['SessionToken'])
+        stat = os.stat(path)
+        digests = cache.get_part_digests(path, stat, part_size)
+
+        if digests is None:
+            digests = UploadCommand.read_digests(path, part_size)[1]
+            cache.set_part_digests(path, stat, part_size, digests)
 
-        return s3.get_bucket(credentials['BucketName'], validate=False)
+        return digests
 
     @staticmethod
-    def create_progress_bar(name, size):
+    def read_digests(path, part_size):
         """
-        Initializes the global progress bar and returns it
+        Returns the MD5 of the file and the MD5 digest of each part, reading the file sequentially once
 
-        @type name str
-        @type size int
-        @rtype: ProgressBar
+        @type path str
+        @param part_size: The size of each part, or None to only calculate the MD5 of the file
+        @type part_size int
+        @rtype: tuple
         """
-        if size == 0:  # Zero-byte files
-            size = 1
+        file_md5 = hashlib.md5()
+        part_md5 = hashlib.md5()
+        digests = []
+        remaining = part_size
+
+        with open(path, 'rb') as f:
+            # Read the file in blocks, so large parts are not held in memory
+            while True:
+                data = f.read(min(READ_SIZE, remaining) if part_size else READ_SIZE)
+
+                if not data:
+                    break
+
+                file_md5.update(data)
 
-        global progress
-        widgets = [Percentage(), ' ', NameWidget(name), ' ', FileTransferSpeed(), ' ', ETA(), ' ']
-        progress = ProgressBar(widgets=widgets, maxval=size)
-        progress.start()
+                if part_size:
+                    part_md5.update(data)
+                    remaining -= len(data)
 
-        return progress
+                    if not remaining:
+                        digests.append(part_md5.digest())
+                        part_md5 = hashlib.md5()
+                        remaining = part_size
+
+        if part_size and remaining < part_size:
+            digests.append(part_md5.digest())
+
+        return file_md5.hexdigest(), digests
 
     @staticmethod
-    def update_progress(current, total):
+    def parse_rate(value):
         """
-        Updates the progress bar being displayed
+        Returns the number of bytes per second of a rate such as 512K or 10M
 
-        @type current int
-        @type total int
+        @type value str
+        @rtype: int
         """
-        if total == 1:  # Zero-byte files
-            current = 1
+        value = value.strip().upper()
+        multiplier = RATE_UNITS.get(value[-1:], 1)
 
-        global progress
-        progress.update(current)
+        if value[-1:] in RATE_UNITS:
+            value = value[:-1]
 
+        rate = int(float(value) * multiplier)
 
-class ParallelUpload(object):
-    """
-    This class handles uploading a file using the S3 multipart upload capabilities
-    It uses gevent/greenlets to do parallel uploading of the chunks
-    """
-    def __init__(self, credentials, key_name, multipart_id, path, relative_path, max_parallel_uploads):
+        if rate < 0:
+            raise ValueError(value)
+
+        return rate
+
+    def upload_files(self, bucket, credentials, uploads, multipart_ids, journal, options, deltas=None):
         """
-        Initializes the multipart upload
+        Uploads the files, largest first, continuing their multipart uploads when they have one
 
+        @type bucket Bucket
         @type credentials dict
-        @type key_name str
-        @type multipart_id str
-        @type path str
-        @type relative_path str
-        @type max_parallel_uploads int
+        @param uploads: The size, local path and relative path of each file
+        @type uploads list of tuple
+        @param multipart_ids: The ID of the multipart upload of each file, keyed by relative path
+        @type multipart_ids dict
+        @type journal UploadJournal
+        @type options dict
+        @param deltas: The delta sources of the files whose unchanged parts are copied, keyed by relative path
+        @type deltas dict
         """
-        file_size = os.path.getsize(path)
+        prefix = credentials['KeyPrefix']
+        deltas = deltas or {}
+        transfers = []
+        processes = min(int(options['--processes']), len(uploads))
+        max_rate = self.parse_rate(options['--max-rate']) if options['--max-rate'] else 0
 
-        self.__chunk_size = max(int(math.sqrt(MINIMUM_CHUNK_SIZE) * math.sqrt(file_size)), MINIMUM_CHUNK_SIZE)
-        self.__chunk_count = int(math.ceil(file_size / float(self.__chunk_size)))
-        self.__credentials = credentials
-        self.__file_size = file_size
-        self.__key_name = key_name
-        self.__max_parallel_uploads = max_parallel_uploads
-        self.__multipart_id = multipart_id
-        self.__path = path
-        self.__progress = [0] * self.__chunk_count
-        self.__relative_path = relative_path
-        self.__progress_bar = UploadCommand.create_progress_bar(self.__relative_path, file_size)
-        self.__cancel = False
+        # Start the largest files first, so the slowest file does not finish alone at the end
+        uploads = sorted(uploads, key=lambda u: u[0], reverse=True)
+        cache = ChecksumCache() if options['--md5-metadata'] or options['--part-md5'] else None
 
-    def _get_multipart(self):
+        for size, local_path, relative_path in uploads:
+            key_name = prefix + relative_path
+
+            # Smaller files can be uploaded directly
+            if size <= MINIMUM_MULTIPART_SIZE:
+                transfers.append((size, key_name, local_path, relative_path, None, None, None, None))
+                continue
+
+            # Continue the last multipart upload?
+            multipart_id = multipart_ids.get(relative_path)
+            delta = deltas.get(relative_path)
+
+            # The multipart uploads recorded in the journal may have been completed or aborted since
+            if multipart_id is not None and journal is not None and journal.parts(multipart_id) is not None:
+                if not self.multipart_upload_exists(bucket, key_name, multipart_id):
+                    key = bucket.get_key(key_name)
+
+                    if key is not None and key.size == size:
+                        journal.add_file(key_name, size)
+                        continue
+
+                    multipart_id = None
+
+            part_size = None
+
+            # The parts of delta uploads are aligned with the checksum chunks, and the
+            # part sizes of other uploads are only known in advance when they are not adaptive
+            if delta is not None:
+                part_size = delta.part_size(size)
+            elif not options['--adaptive']:
+                part_size = ParallelUpload.calculate_chunk_size(size)
+
+            if multipart_id is None:
+                metadata = None
+
+                if options['--md5-metadata']:
+                    metadata = self.calculate_metadata(local_path, part_size, cache)
+
+                multipart_id = bucket.initiate_multipart_upload(key_name, metadata=metadata).id
+
+                if journal is not None:
+                    journal.add_upload(key_name, multipart_id)
+
+            # The digests calculated for the metadata are cached, so they are not read again
+            digests = self.calculate_part_digests(local_path, part_size, cache) if cache and part_size else None
+
+            transfers.append((size, key_name, local_path, relative_path, multipart_id, part_size, delta, digests))
+
+        if cache is not None:
+            cache.close()
+
+        if processes > 1:
+            copied_bytes = self.upload_shards(credentials, transfers, journal, options, processes)
+        else:
+            limiter = None
+
+            # Without a limit, the progress callbacks of the transfers do not share a lock
+            if max_rate or options['--rate-file']:
+                limiter = BandwidthLimiter(max_rate, options['--rate-file'])
+
+            progress = UploadProgress('{0} files'.format(len(transfers)), limiter, options['--progress'])
+            copied_bytes = self.upload_transfers(credentials, transfers, progress, journal, options)
+
+        if copied_bytes:
+            print 'Saved uploading {0:.1f} MB of unchanged parts.'.format(copied_bytes / 1024.0 / 1024.0)
+
+    @staticmethod
+    def upload_transfers(credentials, transfers, progress, journal, options, processes=1):
         """
-        Returns a MultiPartUpload object for the current upload
+        Uploads the files and continues the multipart uploads through a scheduler, returning the
+        number of bytes of the parts which were copied instead of uploaded
 
-        @rtype: MultiPartUpload
+        @type credentials dict
+        @param transfers: The size, key name, local path, relative path, multipart upload ID, part size,
+                          delta source and part digests of each file, the multipart fields being None for
+                          the files uploaded in a single request
+        @type transfers list of tuple
+        @type progress UploadProgress
+        @type journal UploadJournal
+        @type options dict
+        @param processes: The number of processes sharing the read ahead memory, one reader being used by each
+        @type processes int
+        @rtype: int
         """
-        bucket = UploadCommand.get_bucket(self.__credentials)
-        multipart = MultiPartUpload(bucket)
-        multipart.id = self.__multipart_id
-        multipart.key_name = self.__key_name
+        max_parallel_uploads = int(options['--parallel'])
+        sizer = PartSizer(max_parallel_uploads) if options['--adaptive'] else None
+        governor = TransferGovernor(max_parallel_uploads, options['--aimd'])
+        reader = None
 
-        return multipart
+        if options['--read-ahead']:
+            reader = ReadAheadReader(int(options['--read-ahead']) * 1024 * 1024 // processes)
 
-    def _upload_part(self, part_number, offset, size):
+        scheduler = UploadScheduler(credentials, max_parallel_uploads, progress, governor, journal, reader)
+        multipart_uploads = []
+
+        for size, key_name, local_path, relative_path, multipart_id, part_size, delta, digests in transfers:
+            if multipart_id is None:
+                scheduler.add_file(key_name, local_path, size)
+                continue
+
+            # Let the class handle the multipart upload
+            upload = ParallelUpload(credentials, key_name, multipart_id, local_path, relative_path,
+                                    max_parallel_uploads, chunk_size=part_size, progress=progress,
+                                    sizer=None if delta else sizer, governor=governor,
+                                    restore_etag=not options['--md5-metadata'], journal=journal, delta=delta,
+                                    digests=digests)
+            scheduler.add_multipart(upload)
+            multipart_uploads.append(upload)
+
+        scheduler.run()
+
+        return sum(upload.copied_bytes for upload in multipart_uploads)
+
+    def upload_shards(self, credentials, transfers, journal, options, processes):
         """
-        Uploads a single part of the multipart upload
+        Shards the files across worker processes, each with its own S3 connections, and coordinates them,
+        displaying their combined progress and recording their files and parts in the journal
+        Returns the number of bytes of the parts which were copied instead of uploaded
 
-        @type part_number int
-        @type offset int
-        @type size int
+        @type credentials dict
+        @param transfers: The files to upload, as passed to upload_transfers
+        @type transfers list of tuple
+        @type journal UploadJournal
+        @type options dict
+        @type processes int
+        @rtype: int
         """
-        multipart = self._get_multipart()
+        shards = [[] for _ in range(processes)]
+        shard_sizes = [0] * processes
+
+        # The files are sorted largest first, so each goes to the shard with the fewest bytes
+        for transfer in transfers:
+            index = shard_sizes.index(min(shard_sizes))
+            shards[index].append(transfer)
+            shard_sizes[index] += transfer[0]
+
+        queue = multiprocessing.Queue()
+        started = multiprocessing.Event()
+        workers = []
+
+        for index, shard in enumerate(shards):
+            # The workers read the parts uploaded before from the journal through the coordinator
+            parts = None
+
+            if journal is not None:
+                parts = dict((t[4], journal.parts(t[4])) for t in shard if t[4] is not None)
+
+            worker = multiprocessing.Process(target=upload_shard,
+                                             args=(index, credentials, shard, parts, options, processes, queue,
+                                                   started))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+        progress = UploadProgress('{0} files'.format(len(transfers)), mode=options['--progress'])
+        ready = 0
+        running = len(workers)
+        copied_bytes = 0
 
         try:
-            with open(self.__path, 'rb') as f:
-                f.seek(offset)
+            while running:
+                try:
+                    message = queue.get(timeout=1)
+                except Queue.Empty:
+                    # Workers report their failures, so one which exited without finishing was killed
+                    if any(worker.exitcode for worker in workers):
+                        exit('Failure uploading files: a worker process exited unexpectedly')
+
+                    continue
+
+                kind = message[0]
+
+                if kind == 'add':
+                    progress.add(message[1])
+                elif kind == 'ready':
+                    ready += 1
+
+                    # The transfers start once the progress knows the size of every shard
+                    if ready == len(workers):
+                        progress.start()
+                        started.set()
+                elif kind == 'sent':
+                    # Each shard reports the total bytes it sent as a single transfer
+                    progress.update(message[1], message[2], float('inf'))
+                elif kind == 'file_done':
+                    progress.file_done()
+                elif kind == 'add_file' and journal is not None:
+                    journal.add_file(*message[1:])
+                elif kind == 'add_upload' and journal is not None:
+                    journal.add_upload(*message[1:])
+                elif kind == 'add_part' and journal is not None:
+                    journal.add_part(*message[1:])
+                elif kind == 'done':
+                    running -= 1
+                    copied_bytes += message[1]
+
+                    # The connections of the workers are counted with the ones of the coordinator
+                    connections.opened += message[2]
+                    connections.reused += message[3]
+                elif kind == 'error':
+                    exit('Failure uploading files: {0}'.format(message[1]))
 
-                multipart.upload_part_from_file(f, part_number,
-                                                cb=functools.partial(self._update_progress, part_number),
-                                                num_cb=100,
-                                                size=size)
         except KeyboardInterrupt:
-            self.__cancel = True
-            exit()
+            print ''
+            exit('Upload canceled!')
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
 
-    def _update_progress(self, part_number, current, total):
+        progress.finish()
+
+        return copied_bytes
+
+    @staticmethod
+    def find_copies(uploads, skipped):
         """
-        Updates the progress bar with the current status of the multipart upload
+        Finds the files to upload which are identical to another file, returning the files which still
+        need to be uploaded and the size, relative path and source relative path of the files to copy
+        Files which have already been uploaded are used as sources first
 
-        @type part_number int
-        @type current int
-        @type total int
+        @param uploads: The size, local path and relative path of each file to upload
+        @type uploads list of tuple
+        @param skipped: The size, local path and relative path of each file already uploaded
+        @type skipped list of tuple
+        @rtype: tuple
         """
-        if self.__cancel:
-            exit()
+        counts = {}
 
-        self.__progress[part_number - 1] = current
-        sum_current = sum(self.__progress)
+        for size, local_path, relative_path in skipped + uploads:
+            counts[size] = counts.get(size, 0) + 1
 
-        UploadCommand.update_progress(sum_current, self.__file_size)
+        sources = {}
+        remaining = []
+        copies = []
 
-    def _copy_key(self):
+        # Only files sharing their size with another file can be identical, so no other file is hashed
+        with ChecksumCache() as cache:
+            for upload, uploaded in [(u, True) for u in skipped] + [(u, False) for u in uploads]:
+                size, local_path, relative_path = upload
+
+                if counts[size] < 2 or size == 0 or size > MAXIMUM_COPY_SIZE:
+                    if not uploaded:
+                        remaining.append(upload)
+
+                    continue
+
+                identity = (size, UploadCommand.calculate_md5(local_path, cache))
+                source = sources.setdefault(identity, relative_path)
+
+                if source != relative_path:
+                    copies.append((size, relative_path, source))
+                elif not uploaded:
+                    remaining.append(upload)
+
+        return remaining, copies
+
+    def get_base_version_id(self, options):
         """
-        Restores the etag for the key by copying the key over itself
+        Returns the ID of the version files are copied from, or None when there is none
+
+        @type options dict
+        @rtype: str
         """
-        if self.__file_size > MAXIMUM_COPY_SIZE:
-            return
+        if options['--base-version'] or not options['--base-tag']:
+            return options['--base-version']
 
-        bucket = UploadCommand.get_bucket(self.__credentials)
-        key = bucket.get_key(self.__key_name)
-        bucket.copy_key(key.name, bucket.name, key.name, metadata=key.metadata)
+        package = self.api.get_package(self.settings['package_id'])
+        base_version_id = package.get('TagVersions', {}).get(options['--base-tag'])
+
+        if base_version_id is None:
+            exit('The package tag specified is not set')
 
-    def upload(self):
+        return base_version_id
+
+    @staticmethod
+    def get_base_prefix(prefix, version_id, base_version_id):
         """
-        Kicks off the multipart upload
+        Returns the key prefix of the base version, which only differs by its version ID
+
+        @type prefix str
+        @type version_id str
+        @type base_version_id str
+        @rtype: str
         """
-        multipart = self._get_multipart()
-        parts = multipart.get_all_parts()
+        parts = prefix.rstrip('/').split('/')
 
-        # Use a pool to limit the number of parallel uploads
-        pool = ThreadPoolExecutor(max_workers=self.__max_parallel_uploads)
-        futures = []
+        if version_id not in parts:
+            exit('The key prefix does not contain the version')
 
-        for i in range(self.__chunk_count):
-            part_number = i + 1
-            offset = i * self.__chunk_size
-            remaining_bytes = self.__file_size - offset
-            part_size = min([self.__chunk_size, remaining_bytes])
+        return '/'.join(base_version_id if p == version_id else p for p in parts) + '/'
+
+    @staticmethod
+    def find_reused(files, base_files, base_prefix, uploads):
+        """
+        Finds the files to upload whose size and MD5 were added to the base version, returning the files
+        which still need to be uploaded and the size, relative path and source key name of the files to copy
+
+        @param files: The files added to the version
+        @type files list of dict
+        @param base_files: The files added to the base version
+        @type base_files list of dict
+        @type base_prefix str
+        @param uploads: The size, local path and relative path of each file to upload
+        @type uploads list of tuple
+        @rtype: tuple
+        """
+        sources = {}
+
+        for f in base_files:
+            sources[(int(f['Size']), f['MD5'])] = base_prefix + f['Path'].replace('\\', '/')
+
+        # The MD5 of each file was calculated by update when the version was created
+        md5s = dict((f['Path'].replace('\\', '/'), (int(f['Size']), f['MD5'])) for f in files)
+        remaining = []
+        reused = []
+
+        for upload in uploads:
+            size, local_path, relative_path = upload
+            identity = md5s.get(relative_path)
+            source = sources.get(identity)
+
+            if source is None or identity[0] != size or size > MAXIMUM_COPY_SIZE:
+                remaining.append(upload)
+            else:
+                reused.append((size, relative_path, source))
+
+        return remaining, reused
+
+    @staticmethod
+    def find_deltas(files, base_files, base_prefix, uploads):
+        """
+        Returns the delta sources of the files to upload in parts which are in the base version
+        with the same chunk size, keyed by relative path
+
+        @param files: The files added to the version
+        @type files list of dict
+        @param base_files: The files added to the base version
+        @type base_files list of dict
+        @type base_prefix str
+        @param uploads: The size, local path and relative path of each file to upload
+        @type uploads list of tuple
+        @rtype: dict
+        """
+        files = dict((f['Path'].replace('\\', '/'), f) for f in files)
+        base_files = dict((f['Path'].replace('\\', '/'), f) for f in base_files)
+        deltas = {}
+
+        for size, local_path, relative_path in uploads:
+            f = files.get(relative_path)
+            base_file = base_files.get(relative_path)
 
-            if (part_number, part_size) in [(p.part_number, p.size) for p in parts]:
-                self.__progress_bar.maxval -= part_size
+            if size <= MINIMUM_MULTIPART_SIZE or f is None or base_file is None or int(f['Size']) != size:
                 continue
 
-            futures.append(pool.submit(self._upload_part, part_number, offset, part_size))
+            if int(f['Chunk']) != int(base_file['Chunk']):
+                continue
 
-        try:
-            # We must provide a timeout to be able to interrupt the threads
-            for f in futures:
-                f.result(timeout=sys.maxint)
-                
-        except KeyboardInterrupt:
-            self.__cancel = True
-            pool.shutdown()
-            print ''
-            exit('Upload canceled!')
+            deltas[relative_path] = DeltaSource(base_prefix + relative_path, int(base_file['Size']),
+                                                int(f['Chunk']), parse_checksums(base_file['Checksums']),
+                                                parse_checksums(f['Checksums']))
 
-        self.__progress_bar.finish()
-        multipart.complete_upload()
-        self._copy_key()
+        return deltas
+
+    def copy_files(self, credentials, copies, journal, max_parallel_copies):
+        """
+        Creates the files by copying identical objects within the bucket
+
+        @type credentials dict
+        @param copies: The size, relative path and source key name of each file
+        @type copies list of tuple
+        @type journal UploadJournal
+        @type max_parallel_copies int
+        """
+        prefix = credentials['KeyPrefix']
+        governor = TransferGovernor(max_parallel_copies)
+        pool = ThreadPoolExecutor(max_workers=max_parallel_copies)
+        futures = [pool.submit(governor.run, 0, self.copy_file, credentials, source, prefix + relative_path)
+                   for size, relative_path, source in copies]
+
+        for f in futures:
+            f.result(timeout=sys.maxint)
+
+        pool.shutdown()
+
+        if journal is not None:
+            for size, relative_path, source in copies:
+                journal.add_file(prefix + relative_path, size)
+
+    @staticmethod
+    def copy_file(credentials, source_key_name, key_name):
+        """
+        Copies an object within the bucket, using a connection of the calling thread
+
+        @type credentials dict
+        @type source_key_name str
+        @type key_name str
+        """
+        bucket = UploadCommand.get_bucket(credentials)
+        bucket.copy_key(key_name, bucket.name, source_key_name)
+
+    @staticmethod
+    def calculate_md5(path, cache):
+        """
+        Returns the MD5 of the file, reusing the one calculated by update when the file has not changed since
+
+        @type path str
+        @type cache ChecksumCache
+        @rtype: str
+        """
+        md5 = cache.get_md5(path, os.stat(path))
+
+        if md5 is None:
+            file_md5 = hashlib.md5()
+
+            with open(path, 'rb') as f:
+                for data in iter(lambda: f.read(READ_SIZE), ''):
+                    file_md5.update(data)
+
+            md5 = file_md5.hexdigest()
+
+        return md5
+
+    @staticmethod
+    def calculate_metadata(path, part_size, cache):
+        """
+        Returns the metadata recording the MD5 of the file and, when the part size is known,
+        the ETag of the file once uploaded in parts of that size
+
+        @type path str
+        @param part_size: The size of each part, or None when unknown
+        @type part_size int
+        @type cache ChecksumCache
+        @rtype: dict
+        """
+        stat = os.stat(path)
+        md5 = cache.get_md5(path, stat)
+        digests = cache.get_part_digests(path, stat, part_size) if part_size else None
+
+        # The file is read once for both its MD5 and the digests of its parts
+        if md5 is None or (part_size and digests is None):
+            md5, digests = UploadCommand.read_digests(path, part_size)
+
+            if part_size:
+                cache.set_part_digests(path, stat, part_size, digests)
+
+        metadata = {MD5_METADATA: md5}
+
+        if part_size:
+            etag = hashlib.md5(''.join(digests)).hexdigest()
+            metadata[ETAG_METADATA] = '"{0}-{1}"'.format(etag, len(digests))
+
+        return metadata
+
+    @staticmethod
+    def index_keys(bucket, prefix):
+        """
+        Returns the size of each object under the prefix, keyed by its name relative to the prefix
+        The listing is consumed page by page, so only the names and sizes are kept in memory
+
+        @type bucket Bucket
+        @type prefix str
+        @rtype: dict
+        """
+        return dict((k.name[len(prefix):], k.size) for k in bucket.list(prefix))
+
+    @staticmethod
+    def check_keys(credentials, prefix):
+        """
+        Returns the size of each object under the prefix, using a connection of the calling thread
+
+        @type credentials dict
+        @type prefix str
+        @rtype: dict
+        """
+        return UploadCommand.index_keys(UploadCommand.get_bucket(credentials), prefix)
+
+    @staticmethod
+    def index_multipart_uploads(bucket, prefix):
+        """
+        Returns the ID of the most recent multipart upload of each object under the prefix,
+        keyed by its name relative to the prefix
+
+        @type bucket Bucket
+        @type prefix str
+        @rtype: dict
+        """
+        multipart_ids = {}
+
+        # Uploads of the same key are listed in the order they were initiated
+        for upload in UploadCommand.list_multipart_uploads(bucket, prefix):
+            multipart_ids[upload.key_name[len(prefix):]] = upload.id
+
+        return multipart_ids
+
+    @staticmethod
+    def multipart_upload_exists(bucket, key_name, multipart_id):
+        """
+        Returns whether the multipart upload can still be continued, requesting at most one of its parts
+
+        @type bucket Bucket
+        @type key_name str
+        @type multipart_id str
+        @rtype: bool
+        """
+        # MultiPartUpload.get_all_parts does not raise errors, so the parts are requested directly
+        response = bucket.connection.make_request('GET', bucket.name, key_name,
+                                                  query_args='uploadId={0}&max-parts=1'.format(multipart_id))
+        body = response.read()
+
+        if response.status == 200:
+            return True
+
+        error = S3ResponseError(response.status, response.reason, body)
+
+        if error.status == 404 and error.error_code == 'NoSuchUpload':
+            return False
+
+        raise error
+
+    @staticmethod
+    def list_multipart_uploads(bucket, prefix):
+        """
+        Yields the multipart uploads of the objects under the prefix, requesting them page by page
+
+        @type bucket Bucket
+        @type prefix str
+        @rtype: collections.Iterable[MultiPartUpload]
+        """
+        key_marker = ''
+        upload_id_marker = ''
+
+        while True:
+            page = bucket.get_all_multipart_uploads(prefix=prefix, key_marker=key_marker,
+                                                    upload_id_marker=upload_id_marker)
+
+            for upload in page:
+                yield upload
+
+            if not page.is_truncated:
+                break
+
+            key_marker = page.next_key_marker
+            upload_id_marker = page.next_upload_id_marker
+
+    def collect_garbage(self, bucket, credentials, version_id, options):
+        """
+        Aborts the multipart uploads of the version which were started before the age threshold,
+        except the ones recorded in the journal
+
+        @type bucket Bucket
+        @type credentials dict
+        @type version_id str
+        @type options dict
+        """
+        prefix = credentials['KeyPrefix']
+        threshold = datetime.datetime.utcnow() - datetime.timedelta(hours=float(options['--gc-age']))
+
+        with UploadJournal(version_id) as journal:
+            resumable = set(journal.multipart_ids(prefix).values())
+
+        print 'Querying multipart uploads...'
+        stale = [u for u in self.list_multipart_uploads(bucket, prefix)
+                 if u.id not in resumable and self.parse_timestamp(u.initiated) < threshold]
+
+        print 'Aborting {0} multipart uploads...'.format(len(stale))
+        pool = ThreadPoolExecutor(max_workers=int(options['--parallel']))
+        futures = [pool.submit(self.abort_multipart_upload, credentials, u.key_name, u.id) for u in stale]
+
+        for f in futures:
+            f.result(timeout=sys.maxint)
+
+        pool.shutdown()
+        print 'Garbage collection complete.'
+
+    @staticmethod
+    def abort_multipart_upload(credentials, key_name, multipart_id):
+        """
+        Aborts a multipart upload, using a connection of the calling thread
+
+        @type credentials dict
+        @type key_name str
+        @type multipart_id str
+        """
+        UploadCommand.get_bucket(credentials).cancel_multipart_upload(key_name, multipart_id)
+
+    @staticmethod
+    def parse_timestamp(value):
+        """
+        Returns the UTC time of an S3 timestamp such as 2014-10-02T14:01:32.000Z
+
+        @type value str
+        @rtype: datetime.datetime
+        """
+        return datetime.datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S')
+
+    @staticmethod
+    def get_bucket(credentials):
+        """
+        Returns the S3 Bucket instance using the supplied credentials
+
+        @type credentials dict
+        @rtype: Bucket
+        """
+        options = {}
+
+        # The credentials may direct the client to an S3 compatible endpoint
+        if credentials.get('Endpoint'):
+            endpoint = urlparse.urlparse(credentials['Endpoint'])
+            options = {
+                'host': endpoint.hostname,
+                'port': endpoint.port,
+                'is_secure': endpoint.scheme == 'https',
+                'calling_format': OrdinaryCallingFormat()
+            }
+
+        return connections.get_connection(credentials, **options).get_bucket(credentials['BucketName'],
+                                                                              validate=False)
+
+
+class ParallelUpload(object):
+    """
+    This class handles uploading a file using the S3 multipart upload capabilities
+    The parts are uploaded by a pool of threads, which may be shared with the uploads of other files
+    """
+    def __init__(self, credentials, key_name, multipart_id, path, relative_path, max_parallel_uploads,
+                 chunk_size=None, progress=None, sizer=None, governor=None, restore_etag=True, journal=None,
+                 delta=None, digests=None):
+        """
+        Initializes the multipart upload
+
+        @type credentials dict
+        @type key_name str
+        @type multipart_id str
+        @type path str
+        @type relative_path str
+        @type max_parallel_uploads int
+        @param chunk_size: The size of each part, calculated from the file size when omitted
+        @type chunk_size int
+        @param progress: The progress shared by all uploads, instead of displaying the progress of the file
+        @type progress UploadProgress
+        @param sizer: Sizes each part from the measured throughput, instead of using a fixed size
+        @type sizer PartSizer
+        @param governor: Limits and retries the part uploads shared with other uploads
+        @type governor TransferGovernor
+        @param restore_etag: Whether to restore the ETag once uploaded, unless the MD5 was recorded as metadata
+        @type restore_etag bool
+        @param journal: Records the parts as they are uploaded, and the parts uploaded before
+        @type journal UploadJournal
+        @param delta: The file of a previous version the unchanged parts are copied from
+        @type delta DeltaSource
+        @param digests: The MD5 digest of each part of the chunk size, so the parts are not read to hash them
+        @type digests list of str
+        """
+        file_size = os.path.getsize(path)
+
+        self.__chunk_size = chunk_size or self.calculate_chunk_size(file_size)
+        self.__chunk_count = int(math.ceil(file_size / float(self.__chunk_size)))
+        self.__credentials = credentials
+        self.__file_size = file_size
+        self.__key_name = key_name
+        self.__max_parallel_uploads = max_parallel_uploads
+        self.__multipart_id = multipart_id
+        self.__path = path
+        self.__relative_path = relative_path
+        self.__progress = progress or UploadProgress(relative_path)
+        self.__owns_progress = progress is None
+        self.__sizer = sizer
+        self.__governor = governor
+        self.__restore_etag = restore_etag
+        self.__journal = journal
+        self.__delta = delta
+        self.__digests = digests
+        self.copied_bytes = 0
+        self.__cancel = False
+
+        # The parts left to upload and the ETags of the parts making up the file
+        self.__parts = []
+        self.__etags = {}
+        self.__next_offset = 0
+        self.__next_part_number = 1
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def calculate_chunk_size(file_size):
+        """
+        Returns the default size of each part for a file of the specified size
+
+        @type file_size int
+        @rtype: int
+        """
+        return max(int(math.sqrt(MINIMUM_CHUNK_SIZE) * math.sqrt(file_size)), MINIMUM_CHUNK_SIZE)
+
+    def _get_multipart(self):
+        """
+        Returns a MultiPartUpload object for the current upload
+
+        @rtype: MultiPartUpload
+        """
+        bucket = UploadCommand.get_bucket(self.__credentials)
+        multipart = MultiPartUpload(bucket)
+        multipart.id = self.__multipart_id
+        multipart.key_name = self.__key_name
+
+        return multipart
+
+    def _upload_part(self, part_number, offset, size):
+        """
+        Uploads a single part of the multipart upload
+
+        @type part_number int
+        @type offset int
+        @type size int
+        """
+        multipart = self._get_multipart()
+
+        try:
+            with open(self.__path, 'rb') as f:
+                f.seek(offset)
+
+                key = multipart.upload_part_from_file(f, part_number,
+                                                      cb=functools.partial(self._update_progress, part_number),
+                                                      num_cb=100,
+                                                      md5=self._part_md5(part_number, offset, size),
+                                                      size=size)
+        except KeyboardInterrupt:
+            self.__cancel = True
+            exit()
+
+        self.__etags[part_number] = key.etag
+
+        if self.__journal is not None:
+            self.__journal.add_part(self.__multipart_id, part_number, size, key.etag)
+
+    def _part_md5(self, part_number, offset, size):
+        """
+        Returns the hex and base64 MD5 digests of the part when they were precomputed, or None
+
+        @type part_number int
+        @type offset int
+        @type size int
+        @rtype: tuple
+        """
+        aligned = offset == (part_number - 1) * self.__chunk_size
+
+        # The digests only apply to the parts of the chunk size they were calculated with
+        if not self.__digests or not aligned or size != min(self.__chunk_size, self.__file_size - offset):
+            return None
+
+        digest = self.__digests[part_number - 1]
+
+        return binascii.hexlify(digest), base64.b64encode(digest)
+
+    def _upload_part_data(self, part_number, data, md5):
+        """
+        Uploads a single part of the multipart upload from data which has already been read
+
+        @type part_number int
+        @type data str
+        @param md5: The hex and base64 MD5 digests of the data, or None to calculate them
+        @type md5 tuple
+        """
+        multipart = self._get_multipart()
+
+        try:
+            key = multipart.upload_part_from_file(StringIO(data), part_number,
+                                                  cb=functools.partial(self._update_progress, part_number),
+                                                  num_cb=100,
+                                                  md5=md5,
+                                                  size=len(data))
+        except KeyboardInterrupt:
+            self.__cancel = True
+            exit()
+
+        self.__etags[part_number] = key.etag
+
+        if self.__journal is not None:
+            self.__journal.add_part(self.__multipart_id, part_number, len(data), key.etag)
+
+    def _update_progress(self, part_number, current, total):
+        """
+        Updates the progress with the current status of the multipart upload
+
+        @type part_number int
+        @type current int
+        @type total int
+        """
+        if self.__cancel:
+            exit()
+
+        self.__progress.update((self.__key_name, part_number), current, total)
+
+    def _copy_key(self):
+        """
+        Restores the etag for the key by copying the key over itself
+        """
+        if self.__file_size > MAXIMUM_COPY_SIZE:
+            return
+
+        bucket = UploadCommand.get_bucket(self.__credentials)
+        key = bucket.get_key(self.__key_name)
+
+        # Uploads initiated with the MD5 as metadata do not need to be copied
+        if not self.__restore_etag and key.get_metadata(MD5_METADATA):
+            return
+
+        bucket.copy_key(key.name, bucket.name, key.name, metadata=key.metadata)
+
+    def prepare(self):
+        """
+        Queries the parts which have already been uploaded and returns the number of bytes left to upload
+
+        @rtype: int
+        """
+        uploaded = None
+
+        if self.__journal is not None:
+            uploaded = self.__journal.parts(self.__multipart_id)
+
+        # Iterating the upload pages through all of its parts
+        if uploaded is None:
+            uploaded = dict((p.part_number, (p.size, p.etag)) for p in self._get_multipart())
+
+            if self.__journal is not None:
+                self.__journal.add_upload(self.__key_name, self.__multipart_id)
+
+                for part_number, (size, etag) in uploaded.items():
+                    self.__journal.add_part(self.__multipart_id, part_number, size, etag)
+
+        if self.__sizer is not None:
+            return self._prepare_adaptive(uploaded)
+
+        # The offset of a part is only known when the parts before it have the fixed size, since
+        # adaptive uploads have parts of other sizes, so only the leading parts which line up are reused
+        aligned = True
+
+        for i in range(self.__chunk_count):
+            part_number = i + 1
+            offset = i * self.__chunk_size
+            remaining_bytes = self.__file_size - offset
+            part_size = min([self.__chunk_size, remaining_bytes])
+
+            if aligned and uploaded.get(part_number, (None, None))[0] == part_size:
+                self.__etags[part_number] = uploaded[part_number][1]
+            else:
+                aligned = False
+                self.__parts.append((part_number, offset, part_size))
+
+        return sum(size for part_number, offset, size in self.__parts)
+
+    def _prepare_adaptive(self, uploaded):
+        """
+        Continues after the leading parts which have already been uploaded, whatever their size,
+        and returns the number of bytes left to upload
+
+        @param uploaded: The size and ETag of each uploaded part, keyed by part number
+        @type uploaded dict
+        @rtype: int
+        """
+        while self.__next_part_number in uploaded:
+            size, etag = uploaded[self.__next_part_number]
+            end = self.__next_offset + size
+
+            # Only the last part may be smaller than the minimum
+            if end > self.__file_size or (size < MINIMUM_CHUNK_SIZE and end < self.__file_size):
+                break
+
+            self.__etags[self.__next_part_number] = etag
+            self.__next_offset = end
+            self.__next_part_number += 1
+
+        return self.__file_size - self.__next_offset
+
+    def _next_part(self):
+        """
+        Returns the part number, offset and size of the next part sized from the measured throughput,
+        or None once the whole file has been assigned
+
+        @rtype: tuple
+        """
+        with self.__lock:
+            remaining_bytes = self.__file_size - self.__next_offset
+
+            if remaining_bytes <= 0:
+                return None
+
+            size = self.__sizer.part_size(remaining_bytes, MAXIMUM_PART_COUNT - self.__next_part_number + 1)
+
+            # Avoid leaving a tiny last part
+            if remaining_bytes - size < MINIMUM_CHUNK_SIZE and remaining_bytes <= MAXIMUM_PART_SIZE:
+                size = remaining_bytes
+
+            part = (self.__next_part_number, self.__next_offset, size)
+            self.__next_offset += size
+            self.__next_part_number += 1
+
+            return part
+
+    def _upload_parts_adaptive(self):
+        """
+        Keeps uploading the next part until the whole file has been assigned
+        """
+        part = self._next_part()
+
+        while part is not None:
+            self.__sizer.record(part[2], self._transfer_part(*part))
+            part = self._next_part()
+
+    def _transfer_part(self, part_number, offset, size):
+        """
+        Uploads a single part through the governor, when there is one, and returns the seconds it took
+
+        @type part_number int
+        @type offset int
+        @type size int
+        @rtype: float
+        """
+        upload_part = self._upload_part
+
+        if self.__delta is not None and self.__delta.is_unchanged(offset, size):
+            upload_part = self._copy_part
+
+        if self.__governor is not None:
+            return self.__governor.run(size, upload_part, part_number, offset, size)
+
+        start = time.time()
+        upload_part(part_number, offset, size)
+
+        return time.time() - start
+
+    def _transfer_read_ahead(self, reader, part_number, offset, size):
+        """
+        Uploads a single part from the buffer the reader read it into, through the governor when there is one
+
+        @type reader ReadAheadReader
+        @type part_number int
+        @type offset int
+        @type size int
+        """
+        # The buffer is taken before the governor, so no transfer slot is held while the part is being read
+        buf = reader.get(self.__path, offset)
+
+        try:
+            data = buffer(buf, 0, size)
+            md5 = self._part_md5(part_number, offset, size)
+
+            if self.__governor is not None:
+                self.__governor.run(size, self._upload_part_data, part_number, data, md5)
+            else:
+                self._upload_part_data(part_number, data, md5)
+        finally:
+            reader.release(buf)
+
+    def _copy_part(self, part_number, offset, size):
+        """
+        Copies a part whose chunks did not change from the same range of the delta source,
+        uploading it instead when the MD5 of the copied range differs from the MD5 of the file range
+
+        @type part_number int
+        @type offset int
+        @type size int
+        """
+        multipart = self._get_multipart()
+        key = multipart.copy_part_from_key(multipart.bucket.name, self.__delta.key_name, part_number,
+                                           offset, offset + size - 1)
+        md5 = hashlib.md5()
+
+        with open(self.__path, 'rb') as f:
+            f.seek(offset)
+            remaining = size
+
+            while remaining:
+                data = f.read(min(READ_SIZE, remaining))
+
+                if not data:
+                    break
+
+                md5.update(data)
+                remaining -= len(data)
+
+        # The CRC values only matched by chance
+        if key.etag.strip('"') != md5.hexdigest():
+            self._upload_part(part_number, offset, size)
+            return
+
+        with self.__lock:
+            self.__etags[part_number] = key.etag
+            self.copied_bytes += size
+
+        self._update_progress(part_number, size, size)
+
+        if self.__journal is not None:
+            self.__journal.add_part(self.__multipart_id, part_number, size, key.etag)
+
+    def submit(self, pool, reader=None):
+        """
+        Submits the parts left to upload to a pool which may be shared with other uploads and returns their futures
+        The worker finishing the last task completes the upload
+
+        @type pool ThreadPoolExecutor
+        @param reader: Reads the parts to upload ahead of the tasks, when the parts are not adaptive
+        @type reader ReadAheadReader
+        @rtype: list of Future
+        """
+        if self.__sizer is None:
+            tasks = []
+
+            for part_number, offset, size in self.__parts:
+                # The unchanged parts of delta uploads are copied rather than read
+                if reader is None or (self.__delta is not None and self.__delta.is_unchanged(offset, size)):
+                    tasks.append(functools.partial(self._transfer_part, part_number, offset, size))
+                else:
+                    reader.add(self.__path, offset, size)
+                    tasks.append(functools.partial(self._transfer_read_ahead, reader, part_number, offset, size))
+        else:
+            # Each task uploads parts until the file is done, so the part sizes can follow the throughput
+            remaining_bytes = self.__file_size - self.__next_offset
+            count = min(self.__max_parallel_uploads, int(math.ceil(remaining_bytes / float(MINIMUM_CHUNK_SIZE))))
+            tasks = [self._upload_parts_adaptive] * count
+
+        if not tasks:
+            return [pool.submit(self._complete)]
+
+        remaining = [len(tasks)]
+
+        def run(task):
+            task()
+
+            with self.__lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+
+            if last:
+                self._complete()
+
+        return [pool.submit(run, task) for task in tasks]
+
+    def upload_parts(self, parts):
+        """
+        Uploads the parts yielded by the iterable instead of reading them from the file
+        Parts are only read ahead while all of the uploads are busy, which bounds the memory used
+
+        @param parts: The part number, data and (hex, base64) MD5 digests of each part
+        @type parts collections.Iterable[tuple]
+        """
+        if self.__owns_progress:
+            self.__progress.add(self.__file_size)
+            self.__progress.start()
+
+        pool = ThreadPoolExecutor(max_workers=self.__max_parallel_uploads)
+        futures = set()
+
+        try:
+            for part_number, data, md5 in parts:
+                # Wait for an upload to finish before reading the next part
+                if len(futures) >= self.__max_parallel_uploads:
+                    done, futures = wait(futures, timeout=sys.maxint, return_when=FIRST_COMPLETED)
+
+                    for f in done:
+                        f.result()
+
+                futures.add(pool.submit(self._upload_part_data, part_number, data, md5))
+
+        except KeyboardInterrupt:
+            self.__cancel = True
+            pool.shutdown()
+            print ''
+            exit('Upload canceled!')
+
+        self._wait(pool, futures)
+        self._complete()
+
+    def _wait(self, pool, futures):
+        """
+        Waits for the part uploads to finish, canceling them when interrupted
+
+        @type pool ThreadPoolExecutor
+        @type futures list of Future
+        """
+        try:
+            # We must provide a timeout to be able to interrupt the threads
+            for f in futures:
+                f.result(timeout=sys.maxint)
+
+        except KeyboardInterrupt:
+            self.__cancel = True
+            pool.shutdown()
+            print ''
+            exit('Upload canceled!')
+
+    def _complete(self):
+        """
+        Completes the multipart upload once all of its parts have been uploaded
+        Only the parts making up the file are listed, so parts left over by an upload
+        which used different part sizes are discarded
+        """
+        self.__progress.file_done()
+
+        if self.__owns_progress:
+            self.__progress.finish()
+
+        parts = ''.join('<Part><PartNumber>{0}</PartNumber><ETag>{1}</ETag></Part>'.format(part_number, etag)
+                        for part_number, etag in sorted(self.__etags.items()))
+        bucket = UploadCommand.get_bucket(self.__credentials)
+        bucket.complete_multipart_upload(self.__key_name, self.__multipart_id,
+                                         '<CompleteMultipartUpload>{0}</CompleteMultipartUpload>'.format(parts))
+        self._copy_key()
+
+        if self.__journal is not None:
+            self.__journal.add_file(self.__key_name, self.__file_size)
+
+
+class DeltaSource(object):
+    """
+    The file of a previous version which the unchanged parts of a file are copied from
+    """
+    def __init__(self, key_name, size, chunk_size, checksums, new_checksums):
+        """
+        @param key_name: The key name of the previous version's file
+        @type key_name str
+        @param size: The size of the previous version's file
+        @type size int
+        @type chunk_size int
+        @param checksums: The CRC chunk values of the previous version's file
+        @type checksums array
+        @param new_checksums: The CRC chunk values of the file
+        @type new_checksums array
+        """
+        self.key_name = key_name
+        self.size = size
+        self.chunk_size = chunk_size
+        self.checksums = checksums
+        self.new_checksums = new_checksums
+
+    def part_size(self, file_size):
+        """
+        Returns the default size of each part rounded up to a whole number of chunks
+
+        @type file_size int
+        @rtype: int
+        """
+        part_size = ParallelUpload.calculate_chunk_size(file_size)
+
+        return part_size + -part_size % self.chunk_size
+
+    def is_unchanged(self, offset, size):
+        """
+        Returns whether the chunks of the part have the same CRC values in both files
+        The size of the source file is not limited, only the size of each copied part
+
+        @type offset int
+        @type size int
+        @rtype: bool
+        """
+        if offset + size > self.size or size > MAXIMUM_COPY_SIZE:
+            return False
+
+        first = offset // self.chunk_size
+        last = int(math.ceil((offset + size) / float(self.chunk_size)))
+
+        return self.checksums[first:last] == self.new_checksums[first:last]
+
+
+class PartSizer(object):
+    """
+    Sizes the parts of multipart uploads from the throughput of the parts uploaded before them
+    The first parts use the minimum size to probe the throughput of each worker
+    """
+    def __init__(self, max_parallel_uploads, part_seconds=PART_SECONDS):
+        """
+        @type max_parallel_uploads int
+        @param part_seconds: The number of seconds each part should take to upload
+        @type part_seconds float
+        """
+        self.__max_parallel_uploads = max_parallel_uploads
+        self.__part_seconds = part_seconds
+        self.__samples = 0
+        self.__rate = 0.0
+        self.__lock = threading.Lock()
+
+    def record(self, size, seconds):
+        """
+        Records the time a single worker took to upload a part
+
+        @type size int
+        @type seconds float
+        """
+        rate = size / max(seconds, 0.001)
+
+        with self.__lock:
+            # Favor the recent parts, so the sizes follow changes in the throughput
+            self.__rate = rate if not self.__samples else 0.7 * self.__rate + 0.3 * rate
+            self.__samples += 1
+
+    def part_size(self, remaining_bytes, remaining_parts):
+        """
+        Returns the size of the next part
+
+        @type remaining_bytes int
+        @param remaining_parts: The number of parts which can still be uploaded
+        @type remaining_parts int
+        @rtype: int
+        """
+        with self.__lock:
+            probing = self.__samples < self.__max_parallel_uploads
+            size = MINIMUM_CHUNK_SIZE if probing else int(self.__rate * self.__part_seconds)
+
+        # Keep every worker busy until the end of the file
+        size = min(size, remaining_bytes // self.__max_parallel_uploads)
+
+        # Round up to whole megabytes, staying under the part count limit
+        size = max(size, MINIMUM_CHUNK_SIZE, int(math.ceil(remaining_bytes / float(remaining_parts))))
+        size += -size % (1024 * 1024)
+
+        return min(size, MAXIMUM_PART_SIZE)
+
+
+class UploadScheduler(object):
+    """
+    Keeps a fixed number of transfers in flight across all of the files being uploaded,
+    mixing the uploads of smaller files with the parts of multipart uploads
+    Transfers are started in the order they are added
+    """
+    def __init__(self, credentials, max_parallel_uploads, progress, governor, journal=None, reader=None):
+        """
+        @type credentials dict
+        @type max_parallel_uploads int
+        @type progress UploadProgress
+        @type governor TransferGovernor
+        @param journal: Records the files as they are uploaded
+        @type journal UploadJournal
+        @param reader: Reads the parts of multipart uploads sequentially ahead of their transfers
+        @type reader ReadAheadReader
+        """
+        self.__credentials = credentials
+        self.__max_parallel_uploads = max_parallel_uploads
+        self.__progress = progress
+        self.__governor = governor
+        self.__journal = journal
+        self.__reader = reader
+        self.__transfers = []
+
+    def add_file(self, key_name, path, size):
+        """
+        Adds a file uploaded in a single request
+
+        @type key_name str
+        @type path str
+        @type size int
+        """
+        self.__transfers.append((None, (key_name, path, size)))
+        self.__progress.add(size)
+
+    def add_multipart(self, upload):
+        """
+        Adds a multipart upload, querying which of its parts still need to be uploaded
+
+        @type upload ParallelUpload
+        """
+        self.__progress.add(upload.prepare())
+        self.__transfers.append((upload, None))
+
+    def _transfer_file(self, key_name, path, size):
+        """
+        Uploads a file in a single request through the governor
+
+        @type key_name str
+        @type path str
+        @type size int
+        """
+        self.__governor.run(size, self._upload_file, key_name, path)
+        self.__progress.file_done()
+
+        if self.__journal is not None:
+            self.__journal.add_file(key_name, size)
+
+    def _upload_file(self, key_name, path):
+        """
+        Uploads a file in a single request
+
+        @type key_name str
+        @type path str
+        """
+        bucket = UploadCommand.get_bucket(self.__credentials)
+        key = bucket.new_key(key_name)
+        key.set_contents_from_filename(path, cb=functools.partial(self.__progress.update, key_name), num_cb=100)
+
+    def run(self):
+        """
+        Uploads all of the files which were added, waiting for them to finish
+        """
+        pool = ThreadPoolExecutor(max_workers=self.__max_parallel_uploads)
+        futures = []
+        self.__progress.start()
+
+        # The pool starts the transfers in the order they were added
+        for upload, transfer in self.__transfers:
+            if upload is None:
+                futures.append(pool.submit(self._transfer_file, *transfer))
+            else:
+                futures += upload.submit(pool, self.__reader)
+
+        # The reader sizes its buffers once every part has been added
+        if self.__reader is not None:
+            self.__reader.start()
+
+        try:
+            # We must provide a timeout to be able to interrupt the threads
+            for f in futures:
+                f.result(timeout=sys.maxint)
+
+        except KeyboardInterrupt:
+            for f in futures:
+                f.cancel()
+
+            pool.shutdown(wait=False)
+            print ''
+            exit('Upload canceled!')
+
+        pool.shutdown()
+        self.__progress.finish()
+
+
+class ReadAheadReader(object):
+    """
+    Reads the parts of multipart uploads sequentially, in the order their transfers were submitted,
+    into a fixed pool of reusable buffers, so parallel transfers do not turn into random disk reads
+    The reader waits for a buffer to be released when every buffer holds a part not yet uploaded
+    """
+    def __init__(self, max_memory):
+        """
+        @param max_memory: The maximum number of bytes buffered, at least one part being buffered
+        @type max_memory int
+        """
+        self.__max_memory = max_memory
+        self.__parts = []
+        self.__ready = {}
+        self.__buffers = []
+        self.__buffer_count = 0
+        self.__condition = threading.Condition()
+
+    def add(self, path, offset, size):
+        """
+        Adds a part to read, parts being read in the order they are added
+
+        @type path str
+        @type offset int
+        @type size int
+        """
+        self.__parts.append((path, offset, size))
+
+    def start(self):
+        """
+        Starts reading the parts in the background
+        """
+        if not self.__parts:
+            return
+
+        buffer_size = max(size for path, offset, size in self.__parts)
+        self.__buffer_count = max(self.__max_memory // buffer_size, 1)
+
+        thread = threading.Thread(target=self._read_parts, args=(buffer_size,))
+        thread.daemon = True
+        thread.start()
+
+    def get(self, path, offset):
+        """
+        Waits for the part to be read and returns the buffer holding it, which must be released
+
+        @type path str
+        @type offset int
+        @rtype: bytearray
+        """
+        with self.__condition:
+            while (path, offset) not in self.__ready:
+                # We must provide a timeout to be able to interrupt the threads
+                self.__condition.wait(1)
+
+            buf = self.__ready.pop((path, offset))
+
+        if isinstance(buf, Exception):
+            raise buf
+
+        return buf
+
+    def release(self, buf):
+        """
+        Returns a buffer to the pool once its part was uploaded
+
+        @type buf bytearray
+        """
+        with self.__condition:
+            self.__buffers.append(buf)
+            self.__condition.notify_all()
+
+    def _read_parts(self, buffer_size):
+        """
+        Reads every part into the next free buffer, keeping the file of consecutive parts open
+
+        @type buffer_size int
+        """
+        allocated = 0
+        f = None
+
+        try:
+            for path, offset, size in self.__parts:
+                with self.__condition:
+                    while not self.__buffers and allocated >= self.__buffer_count:
+                        self.__condition.wait(1)
+
+                    # Buffers are only allocated when none can be reused
+                    if self.__buffers:
+                        buf = self.__buffers.pop()
+                    else:
+                        buf = bytearray(buffer_size)
+                        allocated += 1
+
+                try:
+                    if f is None or f.name != path:
+                        if f is not None:
+                            f.close()
+
+                        f = open(path, 'rb')
+
+                    # The parts of a file are consecutive, unless some were uploaded before
+                    if f.tell() != offset:
+                        f.seek(offset)
+
+                    view = memoryview(buf) if memoryview is not None else None
+                    read = 0
+
+                    while read < size:
+                        if view is not None:
+                            count = f.readinto(view[read:size])
+                        else:
+                            data = f.read(size - read)
+                            count = len(data)
+                            buf[read:read + count] = data
+
+                        if not count:
+                            raise IOError('Unexpected end of file {0}'.format(path))
+
+                        read += count
+                except (IOError, OSError) as e:
+                    # The transfer waiting for the part raises the error
+                    self.release(buf)
+                    buf = e
+
+                with self.__condition:
+                    self.__ready[(path, offset)] = buf
+                    self.__condition.notify_all()
+        finally:
+            if f is not None:
+                f.close()
+
+
+class UploadProgress(object):
+    """
+    Aggregates the progress of every transfer, displaying it as a single progress bar or as JSON lines
+    Each thread counts the bytes of its own transfers, so reporting progress does not lock,
+    and the display is redrawn at most once per interval
+    Every transfer reports its progress here, so this is also where they are throttled
+    """
+    def __init__(self, name, limiter=None, mode='bar'):
+        """
+        @type name str
+        @type limiter BandwidthLimiter
+        @param mode: Either bar or json
+        @type mode str
+        """
+        self.__mode = mode
+        self.__limiter = limiter
+        self.__total = 0
+        self.__files = 0
+        self.__files_done = 0
+        self.__start = None
+        self.__next_draw = 0
+        self.__counters = []
+        self.__local = threading.local()
+        self.__lock = threading.Lock()
+        self.__progress_bar = None
+
+        if mode == 'bar':
+            widgets = [Percentage(), ' ', NameWidget(name), ' ', FileTransferSpeed(), ' ', ETA(), ' ']
+            self.__progress_bar = ProgressBar(widgets=widgets, maxval=1)
+
+    def add(self, size):
+        """
+        Adds a file and the number of its bytes left to upload to the total
+
+        @type size int
+        """
+        self.__total += size
+        self.__files += 1
+
+    def start(self):
+        """
+        Displays the progress
+        """
+        self.__start = time.time()
+
+        if self.__progress_bar is not None:
+            # Zero-byte files
+            self.__progress_bar.maxval = max(self.__total, 1)
+            self.__progress_bar.start()
+        else:
+            self._draw(time.time())
+
+    def update(self, transfer, current, total):
+        """
+        Updates the progress of a single transfer
+
+        @param transfer: The key identifying the transfer
+        @type transfer object
+        @type current int
+        @type total int
+        """
+        local = self.__local
+        transfers = getattr(local, 'transfers', None)
+
+        if transfers is None:
+            transfers = local.transfers = {}
+            local.counter = [0]
+
+            with self.__lock:
+                self.__counters.append(local.counter)
+
+        # A transfer only reports from the thread running it
+        sent = current - transfers.get(transfer, 0)
+        local.counter[0] += sent
+
+        if current < total:
+            transfers[transfer] = current
+        else:
+            transfers.pop(transfer, None)
+
+        now = time.time()
+
+        if now >= self.__next_draw and self.__lock.acquire(False):
+            try:
+                self._draw(now)
+            finally:
+                self.__lock.release()
+
+        # Delaying the callback delays the next block the transfer sends
+        if self.__limiter is not None and sent > 0:
+            self.__limiter.consume(sent)
+
+    def file_done(self):
+        """
+        Counts a file which has been uploaded
+        """
+        with self.__lock:
+            self.__files_done += 1
+
+    def finish(self):
+        """
+        Completes the progress display
+        """
+        with self.__lock:
+            if self.__progress_bar is not None:
+                self.__progress_bar.finish()
+            else:
+                self._draw(time.time())
+
+    def _draw(self, now):
+        """
+        Redraws the progress, the caller holding the lock
+
+        @type now float
+        """
+        done = max(min(sum(counter[0] for counter in self.__counters), self.__total), 0)
+
+        if self.__progress_bar is not None:
+            self.__next_draw = now + BAR_INTERVAL
+            self.__progress_bar.update(min(done, self.__progress_bar.maxval))
+            return
+
+        self.__next_draw = now + JSON_INTERVAL
+        elapsed = now - self.__start
+        rate = done / elapsed if elapsed > 0 else 0.0
+
+        sys.stdout.write(json.dumps({
+            'bytes': done,
+            'total_bytes': self.__total,
+            'rate': int(rate),
+            'eta': int((self.__total - done) / rate) if rate else None,
+            'files': self.__files_done,
+            'total_files': self.__files
+        }) + '\n')
+        sys.stdout.flush()
+
+
+class ShardProgress(object):
+    """
+    Reports the progress of the transfers of a worker process to the coordinator, sending the bytes
+    sent at most once per interval, and throttles them like UploadProgress
+    """
+    def __init__(self, index, queue, started, limiter=None):
+        """
+        @param index: The index of the shard
+        @type index int
+        @type queue multiprocessing.Queue
+        @param started: Set by the coordinator once every shard is ready to upload
+        @type started multiprocessing.Event
+        @type limiter BandwidthLimiter
+        """
+        self.__index = index
+        self.__queue = queue
+        self.__started = started
+        self.__limiter = limiter
+        self.__transfers = {}
+        self.__sent = 0
+        self.__next_report = 0
+        self.__lock = threading.Lock()
+
+    def add(self, size):
+        """
+        Adds a file and the number of its bytes left to upload to the total of the coordinator
+
+        @type size int
+        """
+        self.__queue.put(('add', size))
+
+    def start(self):
+        """
+        Waits for the coordinator to start the progress of every shard
+        """
+        self.__queue.put(('ready',))
+
+        # We must provide a timeout to be able to interrupt the thread, and check the event
+        # separately since wait returns None on Python 2.6
+        while not self.__started.is_set():
+            self.__started.wait(1)
+
+    def update(self, transfer, current, total):
+        """
+        Updates the progress of a single transfer
+
+        @param transfer: The key identifying the transfer
+        @type transfer object
+        @type current int
+        @type total int
+        """
+        now = time.time()
+
+        with self.__lock:
+            sent = current - self.__transfers.get(transfer, 0)
+            self.__sent += sent
+
+            if current < total:
+                self.__transfers[transfer] = current
+            else:
+                self.__transfers.pop(transfer, None)
+
+            if now >= self.__next_report:
+                self.__next_report = now + BAR_INTERVAL
+                self.__queue.put(('sent', self.__index, self.__sent))
+
+        # Delaying the callback delays the next block the transfer sends
+        if self.__limiter is not None and sent > 0:
+            self.__limiter.consume(sent)
+
+    def file_done(self):
+        """
+        Counts a file which has been uploaded
+        """
+        self.__queue.put(('file_done',))
+
+    def flush(self):
+        """
+        Reports the bytes sent since the last report
+        """
+        with self.__lock:
+            self.__queue.put(('sent', self.__index, self.__sent))
+
+    def finish(self):
+        """
+        Reports the bytes sent since the last report, the coordinator completing the progress display
+        """
+        self.flush()
+
+
+class ShardJournal(object):
+    """
+    Forwards the files and parts uploaded by a worker process to the coordinator, which owns the journal
+    """
+    def __init__(self, queue, parts):
+        """
+        @type queue multiprocessing.Queue
+        @param parts: The parts recorded in the journal of each multipart upload, keyed by multipart upload ID
+        @type parts dict
+        """
+        self.__queue = queue
+        self.__parts = parts
+
+    def parts(self, multipart_id):
+        """
+        Returns the size and ETag of each uploaded part keyed by part number, or None when
+        the multipart upload was not started with the journal
+
+        @type multipart_id str
+        @rtype: dict
+        """
+        return self.__parts.get(multipart_id)
+
+    def add_file(self, key_name, size):
+        """
+        @type key_name str
+        @type size int
+        """
+        self.__queue.put(('add_file', key_name, size))
+
+    def add_upload(self, key_name, multipart_id):
+        """
+        @type key_name str
+        @type multipart_id str
+        """
+        self.__queue.put(('add_upload', key_name, multipart_id))
+
+    def add_part(self, multipart_id, part_number, size, etag):
+        """
+        @type multipart_id str
+        @type part_number int
+        @type size int
+        @type etag str
+        """
+        self.__queue.put(('add_part', multipart_id, part_number, size, etag))
+
+
+class BandwidthLimiter(object):
+    """
+    Limits the combined rate of every transfer using a token bucket
+    The rate can be changed while uploading through the rate file
+    """
+    def __init__(self, rate=0, path=None, shares=1):
+        """
+        @param rate: The maximum number of bytes per second, zero for no limit
+        @type rate int
+        @param path: The rate file
+        @type path str
+        @param shares: The number of processes the rate is divided between
+        @type shares int
+        """
+        self.rate = rate / shares
+        self.__path = path
+        self.__shares = shares
+        self.__modified = None
+        self.__checked = 0
+        self.__allowance = 0.0
+        self.__last = time.time()
+        self.__lock = threading.Lock()
+
+    def consume(self, size):
+        """
+        Waits until the bytes which were sent are allowed by the rate
+
+        @type size int
+        """
+        # The rate can only change through the rate file
+        if not self.rate and not self.__path:
+            return
+
+        with self.__lock:
+            now = time.time()
+
+            if self.__path and now - self.__checked >= RATE_FILE_INTERVAL:
+                self.__checked = now
+                self._read_rate_file()
+
+            elapsed = now - self.__last
+            self.__last = now
+
+            if not self.rate:
+                return
+
+            # Allow bursts of up to a second
+            self.__allowance = min(self.__allowance + elapsed * self.rate, self.rate)
+            self.__allowance -= size
+            delay = -self.__allowance / self.rate
+
+        if delay > 0:
+            time.sleep(delay)
+
+    def _read_rate_file(self):
+        """
+        Reads the rate from the rate file when it was modified, keeping the current rate if it is invalid
+        """
+        try:
+            modified = os.path.getmtime(self.__path)
+
+            if modified == self.__modified:
+                return
+
+            self.__modified = modified
+
+            with open(self.__path) as f:
+                self.rate = UploadCommand.parse_rate(f.read()) / self.__shares
+        except (IOError, OSError, ValueError):
+            pass
+
+
+class TransferGovernor(object):
+    """
+    Limits the number of transfers in flight and retries the ones which fail
+    In AIMD mode, the limit is increased by one after a round of transfers succeeds
+    and halved when a part slows down or a transfer fails
+    """
+    def __init__(self, max_transfers, aimd=False):
+        """
+        @type max_transfers int
+        @type aimd bool
+        """
+        self.limit = max_transfers
+        self.__max_transfers = max_transfers
+        self.__aimd = aimd
+        self.__active = 0
+        self.__successes = 0
+        self.__best_rate = 0.0
+        self.__decreased = 0
+        self.__condition = threading.Condition()
+
+    def run(self, size, function, *args):
+        """
+        Calls the function transferring the bytes once a transfer is allowed and returns the seconds it took
+
+        @type size int
+        @type function callable
+        @rtype: float
+        """
+        for attempt in range(UPLOAD_ATTEMPTS):
+            self._acquire()
+            start = time.time()
+
+            try:
+                function(*args)
+            except Exception:
+                self._release(size, start, None)
+
+                if attempt + 1 == UPLOAD_ATTEMPTS:
+                    raise
+
+                time.sleep(2 ** attempt)
+                continue
+
+            seconds = time.time() - start
+            self._release(size, start, seconds)
+
+            return seconds
+
+    def _acquire(self):
+        """
+        Waits until fewer transfers than the limit are in flight
+        """
+        with self.__condition:
+            while self.__active >= self.limit:
+                self.__condition.wait()
+
+            self.__active += 1
+
+    def _release(self, size, start, seconds):
+        """
+        Records the outcome of a transfer and adjusts the limit in AIMD mode
+
+        @type size int
+        @type start float
+        @param seconds: The seconds the transfer took, or None when it failed
+        @type seconds float
+        """
+        with self.__condition:
+            self.__active -= 1
+
+            if self.__aimd:
+                slow = False
+
+                # Only parts are large enough for their throughput not to be dominated by the request latency
+                if seconds is not None and size >= MINIMUM_CHUNK_SIZE:
+                    rate = size / max(seconds, 0.001)
+                    slow = rate < self.__best_rate * SLOW_PART_RATIO
+                    self.__best_rate = max(self.__best_rate, rate)
+
+                if seconds is None or slow:
+                    # The transfers in flight during the last decrease do not count against the new limit
+                    if start > self.__decreased:
+                        self.limit = max(self.limit / 2, 1)
+                        self.__best_rate *= SLOW_PART_RATIO
+                        self.__decreased = time.time()
+
+                    self.__successes = 0
+                else:
+                    self.__successes += 1
+
+                    if self.__successes >= self.limit:
+                        self.limit = min(self.limit + 1, self.__max_transfers)
+                        self.__successes = 0
+
+            self.__condition.notify_all()
+
+
+class ConnectionCache(object):
+    """
+    Keeps a single S3 connection open for each thread, so its keep-alive connections are reused
+    by every request the thread sends instead of connecting again for each file and part
+    """
+    def __init__(self):
+        self.opened = 0
+        self.reused = 0
+        self.__local = threading.local()
+        self.__lock = threading.Lock()
+
+    def reset(self):
+        """
+        Forgets the connections inherited from the parent process, so a worker process opens its own
+        """
+        self.opened = 0
+        self.reused = 0
+        self.__local = threading.local()
+
+    def get_connection(self, credentials, **options):
+        """
+        Returns the connection of the current thread, opening a new one when the credentials changed
+
+        @type credentials dict
+        @rtype: S3Connection
+        """
+        identity = (credentials['AccessKeyId'], credentials['SecretAccessKey'], credentials['SessionToken'],
+                    credentials.get('Endpoint'))
+        connection = getattr(self.__local, 'connection', None)
+
+        if connection is not None and self.__local.identity == identity:
+            with self.__lock:
+                self.reused += 1
+
+            return connection
+
+        # The previous credentials expired or belong to another version
+        if connection is not None:
+            connection.close()
+
+        connection = boto.connect_s3(credentials['AccessKeyId'], credentials['SecretAccessKey'],
+                                     security_token=credentials['SessionToken'], **options)
+        self.__local.connection = connection
+        self.__local.identity = identity
+
+        with self.__lock:
+            self.opened += 1
+
+        return connection
+
+
+# The S3 connections are reused by every upload in the process
+connections = ConnectionCache()
 
 
 class NameWidget(WidgetHFill):
@@ -0,0 +1,215 @@
+import os
+import sqlite3
+import threading
+
+JOURNAL_PATH = os.path.expanduser('~/package.journal')
+
+# The number of writes buffered, and the seconds they may be buffered for, before they are committed
+# The seconds are counted by a timer, so the writes are committed even while the next part is being uploaded
+COMMIT_INTERVAL = 100
+COMMIT_SECONDS = 1
+
+
+class UploadJournal(object):
+    """
+    Records the files, multipart uploads and parts of a version as they finish uploading,
+    in a local SQLite database, so an interrupted upload can resume without listing the bucket.
+
+    Files and multipart uploads are committed immediately, and parts in batches within a second
+    by a timer, even when no other part follows, so the lock is never held while parts are uploaded.
+    Losing the last parts in a crash only causes them to be uploaded again.
+    """
+    def __init__(self, version_id, path=JOURNAL_PATH):
+        """
+        Opens the journal of the version, creating the database when it does not exist
+
+        @type version_id: str
+        @type path: str
+        """
+        self.__connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.__version_id = version_id
+        self.__pending = 0
+        self.__timer = None
+        self.__closed = False
+        self.__lock = threading.Lock()
+
+        self.__connection.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            'version_id TEXT NOT NULL, key_name TEXT NOT NULL, size INTEGER NOT NULL, '
+            'PRIMARY KEY (version_id, key_name))')
+        self.__connection.execute(
+            'CREATE TABLE IF NOT EXISTS uploads ('
+            'version_id TEXT NOT NULL, key_name TEXT NOT NULL, multipart_id TEXT NOT NULL, '
+            'PRIMARY KEY (version_id, key_name))')
+        self.__connection.execute(
+            'CREATE TABLE IF NOT EXISTS parts ('
+            'multipart_id TEXT NOT NULL, part_number INTEGER NOT NULL, size INTEGER NOT NULL, '
+            'etag TEXT NOT NULL, PRIMARY KEY (multipart_id, part_number))')
+        self.__connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def is_empty(self):
+        """
+        Returns whether nothing has been recorded for the version
+
+        @rtype: bool
+        """
+        with self.__lock:
+            return not any(self.__connection.execute(
+                'SELECT 1 FROM {0} WHERE version_id = ? LIMIT 1'.format(table), (self.__version_id,)).fetchone()
+                for table in ('files', 'uploads'))
+
+    def file_sizes(self, prefix):
+        """
+        Returns the size of each uploaded file, keyed by its name relative to the prefix
+
+        @type prefix: str
+        @rtype: dict
+        """
+        with self.__lock:
+            rows = self.__connection.execute(
+                'SELECT key_name, size FROM files WHERE version_id = ?', (self.__version_id,)).fetchall()
+
+        return dict((key_name[len(prefix):], size) for key_name, size in rows if key_name.startswith(prefix))
+
+    def multipart_ids(self, prefix):
+        """
+        Returns the ID of the multipart upload of each file, keyed by its name relative to the prefix
+
+        @type prefix: str
+        @rtype: dict
+        """
+        with self.__lock:
+            rows = self.__connection.execute(
+                'SELECT key_name, multipart_id FROM uploads WHERE version_id = ?', (self.__version_id,)).fetchall()
+
+        return dict((key_name[len(prefix):], str(multipart_id)) for key_name, multipart_id in rows
+                    if key_name.startswith(prefix))
+
+    def parts(self, multipart_id):
+        """
+        Returns the size and ETag of each uploaded part keyed by part number, or None when
+        the multipart upload was not started with the journal
+
+        @type multipart_id: str
+        @rtype: dict
+        """
+        with self.__lock:
+            if self.__connection.execute('SELECT 1 FROM uploads WHERE version_id = ? AND multipart_id = ?',
+                                         (self.__version_id, multipart_id)).fetchone() is None:
+                return None
+
+            rows = self.__connection.execute(
+                'SELECT part_number, size, etag FROM parts WHERE multipart_id = ?', (multipart_id,)).fetchall()
+
+        return dict((part_number, (size, str(etag))) for part_number, size, etag in rows)
+
+    def add_file(self, key_name, size):
+        """
+        Records an uploaded file, forgetting its multipart upload, committing it immediately
+
+        @type key_name: str
+        @type size: int
+        """
+        with self.__lock:
+            row = self.__connection.execute('SELECT multipart_id FROM uploads WHERE version_id = ? AND key_name = ?',
+                                            (self.__version_id, key_name)).fetchone()
+
+            if row is not None:
+                self._write('DELETE FROM parts WHERE multipart_id = ?', (row[0],))
+                self._write('DELETE FROM uploads WHERE version_id = ? AND key_name = ?', (self.__version_id, key_name))
+
+            self._write('INSERT OR REPLACE INTO files VALUES (?, ?, ?)', (self.__version_id, key_name, size))
+
+            # The multipart upload is completed, so it must not be resumed after a crash
+            self._commit()
+
+    def add_upload(self, key_name, multipart_id):
+        """
+        Records a multipart upload which has been started, committing it immediately so it is never left behind
+
+        @type key_name: str
+        @type multipart_id: str
+        """
+        with self.__lock:
+            # Forget the parts of the upload it replaces, which could not be continued
+            self._write('DELETE FROM parts WHERE multipart_id IN (SELECT multipart_id FROM uploads '
+                        'WHERE version_id = ? AND key_name = ? AND multipart_id != ?)',
+                        (self.__version_id, key_name, multipart_id))
+            self._write('INSERT OR REPLACE INTO uploads VALUES (?, ?, ?)', (self.__version_id, key_name, multipart_id))
+            self._commit()
+
+    def add_part(self, multipart_id, part_number, size, etag):
+        """
+        Records an uploaded part
+
+        @type multipart_id: str
+        @type part_number: int
+        @type size: int
+        @type etag: str
+        """
+        with self.__lock:
+            self._write('INSERT OR REPLACE INTO parts VALUES (?, ?, ?, ?)', (multipart_id, part_number, size, etag))
+
+    def remove(self):
+        """
+        Forgets everything recorded for the version, once its upload is complete
+        """
+        with self.__lock:
+            self._write('DELETE FROM parts WHERE multipart_id IN '
+                        '(SELECT multipart_id FROM uploads WHERE version_id = ?)', (self.__version_id,))
+            self._write('DELETE FROM uploads WHERE version_id = ?', (self.__version_id,))
+            self._write('DELETE FROM files WHERE version_id = ?', (self.__version_id,))
+            self._commit()
+
+    def _write(self, sql, parameters):
+        """
+        Executes the statement, committing once enough writes are buffered or when the timer
+        expires, the caller holding the lock
+
+        @type sql: str
+        @type parameters: tuple
+        """
+        self.__connection.execute(sql, parameters)
+        self.__pending += 1
+
+        if self.__pending >= COMMIT_INTERVAL:
+            self._commit()
+        elif self.__timer is None:
+            self.__timer = threading.Timer(COMMIT_SECONDS, self._flush)
+            self.__timer.daemon = True
+            self.__timer.start()
+
+    def _flush(self):
+        """
+        Commits the writes buffered since the timer started
+        """
+        with self.__lock:
+            self.__timer = None
+
+            if not self.__closed and self.__pending:
+                self._commit()
+
+    def _commit(self):
+        """
+        Commits the buffered writes, the caller holding the lock
+        """
+        self.__connection.commit()
+        self.__pending = 0
+
+    def close(self):
+        """
+        Commits the buffered writes and closes the journal
+        """
+        with self.__lock:
+            if self.__timer is not None:
+                self.__timer.cancel()
+
+            self._commit()
+            self.__connection.close()
+            self.__closed = True
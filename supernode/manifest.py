@@ -0,0 +1,220 @@
+from array import array
+import binascii
+import mmap
+import os
+import struct
+import sys
+
+MANIFEST_FOLDER = os.path.expanduser('~/package.manifests')
+
+# The number of most recently written manifests kept, so recent versions can still be used as base versions
+MAXIMUM_MANIFESTS = 10
+
+# The signature at the start of every manifest, followed by the number of files
+MANIFEST_SIGNATURE = 'SNM1'
+HEADER = struct.Struct('<4sI')
+
+# The path length, size, chunk size, checksum count and MD5 digest of each file, followed by its path and checksums
+RECORD = struct.Struct('<IQII16s')
+
+# The checksums are stored as little-endian unsigned 32-bit integers
+CHECKSUM_SIZE = 4
+
+
+def manifest_path(version_id, folder=MANIFEST_FOLDER):
+    """
+    Returns the path of the manifest of the version
+
+    @type version_id: str
+    @type folder: str
+    @rtype: str
+    """
+    return os.path.join(folder, '{0}.manifest'.format(version_id))
+
+
+def prune_manifests(folder=MANIFEST_FOLDER, keep=MAXIMUM_MANIFESTS):
+    """
+    Removes the manifests written before the most recent ones
+
+    @type folder: str
+    @param keep: The number of most recent manifests kept
+    @type keep: int
+    """
+    paths = [os.path.join(folder, name) for name in os.listdir(folder) if name.endswith('.manifest')]
+    paths.sort(key=os.path.getmtime, reverse=True)
+
+    for path in paths[keep:]:
+        try:
+            os.remove(path)
+        except OSError:
+            # Another process removed it first
+            pass
+
+
+def pack_checksums(checksums):
+    """
+    Returns the CRC chunk values packed as little-endian unsigned 32-bit integers
+
+    @type checksums: array or list of int
+    @rtype: str
+    """
+    if not isinstance(checksums, array) or checksums.typecode != 'I':
+        checksums = array('I', checksums)
+
+    if sys.byteorder != 'little':
+        checksums = array('I', checksums)
+        checksums.byteswap()
+
+    return checksums.tostring()
+
+
+def unpack_checksums(data):
+    """
+    Returns the CRC chunk values packed by pack_checksums
+
+    @type data: str or buffer
+    @rtype: array
+    """
+    checksums = array('I')
+    checksums.fromstring(data)
+
+    if sys.byteorder != 'little':
+        checksums.byteswap()
+
+    return checksums
+
+
+class ManifestWriter(object):
+    """
+    Writes the files of a version, with their checksums packed as binary, to its manifest as they are added
+    The manifest only replaces the previous one of the version once it is closed, so it is never partial,
+    and only the most recent manifests are kept
+    """
+    def __init__(self, version_id, folder=MANIFEST_FOLDER):
+        """
+        @type version_id: str
+        @type folder: str
+        """
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        self.__folder = folder
+        self.__path = manifest_path(version_id, folder)
+        self.__file = open(self.__path + '.tmp', 'wb')
+        self.__count = 0
+
+        # The number of files is written once they are all added
+        self.__file.write(HEADER.pack(MANIFEST_SIGNATURE, 0))
+
+    def add(self, path, size, chunk_size, md5, checksums):
+        """
+        Adds a file to the manifest
+
+        @type path: str
+        @type size: int
+        @type chunk_size: int
+        @param md5: The MD5 hex of the file
+        @type md5: str
+        @type checksums: array or list of int
+        """
+        if isinstance(path, unicode):
+            path = path.encode('utf-8')
+
+        self.__file.write(RECORD.pack(len(path), size, chunk_size, len(checksums), binascii.unhexlify(md5)))
+        self.__file.write(path)
+        self.__file.write(pack_checksums(checksums))
+        self.__count += 1
+
+    def close(self):
+        """
+        Writes the number of files, replaces the previous manifest of the version and removes the oldest manifests
+        """
+        self.__file.seek(0)
+        self.__file.write(HEADER.pack(MANIFEST_SIGNATURE, self.__count))
+        self.__file.close()
+
+        # Windows does not replace existing files when renaming
+        if os.path.exists(self.__path):
+            os.remove(self.__path)
+
+        os.rename(self.__path + '.tmp', self.__path)
+        prune_manifests(self.__folder)
+
+    def abort(self):
+        """
+        Discards the manifest, keeping the previous one of the version
+        """
+        self.__file.close()
+        os.remove(self.__path + '.tmp')
+
+
+class Manifest(object):
+    """
+    Reads the manifest of a version through a memory map, so the checksums of a file are
+    only read from the disk and unpacked when they are used
+    """
+    def __init__(self, path):
+        """
+        @type path: str
+        """
+        self.__file = open(path, 'rb')
+        self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        signature, self.__count = HEADER.unpack_from(self.__map, 0)
+
+        if signature != MANIFEST_SIGNATURE:
+            self.close()
+            raise Exception('Failure reading manifest {0}'.format(path))
+
+    @staticmethod
+    def open(version_id, folder=MANIFEST_FOLDER):
+        """
+        Returns the manifest of the version, or None when it was not written on this computer
+
+        @type version_id: str
+        @type folder: str
+        @rtype: Manifest
+        """
+        path = manifest_path(version_id, folder)
+
+        return Manifest(path) if os.path.isfile(path) else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.__count
+
+    def files(self):
+        """
+        Yields the files in the same form as the REST API returns them, their checksums being
+        a buffer over the memory map which is unpacked by unpack_checksums
+
+        @rtype: collections.Iterable[dict]
+        """
+        offset = HEADER.size
+
+        for _ in range(self.__count):
+            path_length, size, chunk_size, count, md5 = RECORD.unpack_from(self.__map, offset)
+            offset += RECORD.size
+            path = self.__map[offset:offset + path_length].decode('utf-8')
+            offset += path_length
+
+            yield {
+                'Path': path,
+                'Size': size,
+                'Chunk': chunk_size,
+                'MD5': binascii.hexlify(md5),
+                'Checksums': buffer(self.__map, offset, count * CHECKSUM_SIZE)
+            }
+
+            offset += count * CHECKSUM_SIZE
+
+    def close(self):
+        """
+        Closes the memory map, after which the checksum buffers must not be used
+        """
+        self.__map.close()
+        self.__file.close()
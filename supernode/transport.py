@@ -0,0 +1,267 @@
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, ConnectTimeout, Timeout
+import random
+import requests
+import threading
+import time
+import urllib
+
+# The number of keep-alive connections kept open to the REST API
+MAXIMUM_CONNECTIONS = 32
+
+# The default seconds to wait for a connection and for each response
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 120
+
+# The default number of retries and the delay before the first one in seconds
+RETRIES = 5
+RETRY_DELAY = 0.5
+MAXIMUM_RETRY_DELAY = 30
+
+# Status codes which indicate the request may succeed when retried
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Status codes which guarantee the request was not processed, so even non-idempotent requests are retried
+REJECTED_STATUS_CODES = (429, 503)
+
+# The number of list values encoded at a time by a streaming form
+FORM_BATCH_SIZE = 4096
+
+# The URL encoded separator of list values
+FORM_SEPARATOR = urllib.quote_plus(',')
+
+
+class EndpointMetrics(object):
+    """
+    The request counters of a single REST API endpoint
+    """
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    @property
+    def average_seconds(self):
+        """
+        Returns the average latency of the requests
+
+        @rtype: float
+        """
+        return self.seconds / self.requests if self.requests else 0.0
+
+
+class StreamingForm(object):
+    """
+    A URL encoded form whose last field is a long list of integers, encoded into comma separated values
+    in batches while the form is sent, so the whole payload is never built in memory
+    """
+    def __init__(self, fields, name, values):
+        """
+        @param fields: The other fields of the form
+        @type fields: dict
+        @param name: The name of the field of the list
+        @type name: str
+        @type values: array or list of int
+        """
+        fields = sorted((k, v.encode('utf-8') if isinstance(v, unicode) else v) for k, v in fields.items())
+        self.__prefix = urllib.urlencode(fields) + '&' + urllib.quote_plus(name) + '='
+        self.__values = values
+        self.__length = (len(self.__prefix) + sum(len(str(v)) for v in values) +
+                         len(FORM_SEPARATOR) * max(len(values) - 1, 0))
+        self.seek(0)
+
+    def __len__(self):
+        return self.__length
+
+    def seek(self, offset, whence=0):
+        """
+        Rewinds the form, so a retried request sends it again, or moves to its end, which requests
+        before 2.12 do to find the length of the body. Only these two positions are supported
+
+        @type offset: int
+        @type whence: int
+        """
+        if offset == 0 and whence == 2:
+            self.__buffer = ''
+            self.__index = len(self.__values)
+            self.__position = self.__length
+            return
+
+        if offset != 0 or whence != 0:
+            raise IOError('Streaming forms can only be rewound to the start or moved to the end')
+
+        self.__buffer = self.__prefix
+        self.__index = 0
+        self.__position = 0
+
+    def tell(self):
+        """
+        @rtype: int
+        """
+        return self.__position
+
+    def read(self, size=-1):
+        """
+        Returns up to the number of bytes requested, or the rest of the form
+
+        @type size: int
+        @rtype: str
+        """
+        while (size < 0 or len(self.__buffer) < size) and self.__index < len(self.__values):
+            batch = self.__values[self.__index:self.__index + FORM_BATCH_SIZE]
+            separator = FORM_SEPARATOR if self.__index else ''
+            self.__buffer += separator + FORM_SEPARATOR.join(str(v) for v in batch)
+            self.__index += len(batch)
+
+        if size < 0:
+            size = len(self.__buffer)
+
+        data, self.__buffer = self.__buffer[:size], self.__buffer[size:]
+        self.__position += len(data)
+
+        return data
+
+
+class Transport(object):
+    """
+    Sends the REST API requests through a pooled keep-alive session, retrying failures
+    with an exponential backoff and recording the metrics of each endpoint
+    """
+    def __init__(self, auth, verify, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, retries=RETRIES,
+                 pool_size=MAXIMUM_CONNECTIONS):
+        """
+        @type auth: tuple
+        @type verify: bool
+        @type connect_timeout: float
+        @type read_timeout: float
+        @type retries: int
+        @type pool_size: int
+        """
+        self.auth = auth
+        self.verify = verify
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.metrics = {}
+        self.__lock = threading.Lock()
+
+        # Share the connections between requests and threads
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method, endpoint, url, idempotent=True, **kwargs):
+        """
+        Sends the request, retrying connection failures and server errors, and returns the response
+        Requests which are not idempotent are only retried when the server rejected them
+
+        @param method: The HTTP method
+        @type method: str
+        @param endpoint: The name the metrics are recorded under
+        @type endpoint: str
+        @type url: str
+        @type idempotent: bool
+        @rtype: requests.Response
+        """
+        retry_status_codes = RETRY_STATUS_CODES if idempotent else REJECTED_STATUS_CODES
+        attempt = 0
+
+        while True:
+            start = time.time()
+
+            # Streamed bodies are sent again from the start
+            if hasattr(kwargs.get('data'), 'seek'):
+                kwargs['data'].seek(0)
+
+            try:
+                response = self.session.request(method, url, auth=self.auth, verify=self.verify,
+                                                timeout=self.timeout, **kwargs)
+            except (ConnectionError, Timeout) as e:
+                self._record(endpoint, start, None, attempt)
+                response = None
+
+                # A connect timeout guarantees the request was never sent
+                if (not idempotent and not isinstance(e, ConnectTimeout)) or attempt >= self.retries:
+                    raise
+            else:
+                self._record(endpoint, start, response, attempt)
+
+                if response.status_code not in retry_status_codes or attempt >= self.retries:
+                    return response
+
+            time.sleep(self._retry_delay(attempt, response))
+            attempt += 1
+
+    def get(self, endpoint, url, **kwargs):
+        """
+        @rtype: requests.Response
+        """
+        return self.request('GET', endpoint, url, **kwargs)
+
+    def post(self, endpoint, url, idempotent=False, **kwargs):
+        """
+        @rtype: requests.Response
+        """
+        return self.request('POST', endpoint, url, idempotent=idempotent, **kwargs)
+
+    def put(self, endpoint, url, **kwargs):
+        """
+        @rtype: requests.Response
+        """
+        return self.request('PUT', endpoint, url, **kwargs)
+
+    def delete(self, endpoint, url, **kwargs):
+        """
+        @rtype: requests.Response
+        """
+        return self.request('DELETE', endpoint, url, **kwargs)
+
+    @staticmethod
+    def _retry_delay(attempt, response):
+        """
+        Returns the seconds to wait before retrying, honoring the Retry-After header when present
+
+        @type attempt: int
+        @type response: requests.Response
+        @rtype: float
+        """
+        if response is not None and response.headers.get('Retry-After', '').isdigit():
+            return min(int(response.headers['Retry-After']), MAXIMUM_RETRY_DELAY)
+
+        delay = min(RETRY_DELAY * 2 ** attempt, MAXIMUM_RETRY_DELAY)
+
+        # Add jitter so parallel requests do not retry in lockstep
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _record(self, endpoint, start, response, attempt):
+        """
+        Records the metrics of a single request attempt
+
+        @type endpoint: str
+        @type start: float
+        @type response: requests.Response
+        @type attempt: int
+        """
+        elapsed = time.time() - start
+
+        with self.__lock:
+            metrics = self.metrics.get(endpoint)
+
+            if metrics is None:
+                metrics = self.metrics[endpoint] = EndpointMetrics()
+
+            metrics.requests += 1
+            metrics.seconds += elapsed
+
+            if attempt:
+                metrics.retries += 1
+
+            if response is None or response.status_code >= 400:
+                metrics.errors += 1
+
+            if response is not None:
+                metrics.bytes_sent += len(response.request.body or '')
+                metrics.bytes_received += len(response.content)
@@ -0,0 +1,112 @@
+import fnmatch
+import os
+import stat
+
+# scandir returns the file type with each directory entry, so only the files are stat'ed
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+def parse_patterns(value):
+    """
+    Returns the glob patterns of a comma separated option, or None when it is not set
+
+    @type value: str
+    @rtype: list of str
+    """
+    if not value:
+        return None
+
+    return [pattern.strip() for pattern in value.split(',') if pattern.strip()]
+
+
+def matches(relative_path, name, patterns):
+    """
+    Returns whether the relative path or the name matches any of the glob patterns
+
+    @type relative_path: str
+    @type name: str
+    @type patterns: list of str
+    @rtype: bool
+    """
+    relative_path = relative_path.replace('\\', '/')
+
+    return any(fnmatch.fnmatch(relative_path, pattern) or fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+
+def walk_files(path, include=None, exclude=None):
+    """
+    Recursively yields the path, the path relative to the specified path and the stat of each file,
+    in the same sorted order on every walk: the files of a folder first, then its subfolders
+
+    Each file is stat'ed once, and folders are only listed, using scandir when it is available.
+    Symbolic links to files are followed, but not symbolic links to folders.
+
+    @type path: str
+    @param include: The glob patterns of the files to walk, or None for every file
+    @type include: list of str
+    @param exclude: The glob patterns of the files and folders to skip
+    @type exclude: list of str
+    @rtype: collections.Iterable[tuple]
+    """
+    folders = [(path, '')]
+
+    while folders:
+        folder, relative_folder = folders.pop()
+        files = []
+        subfolders = []
+
+        for name, is_folder, file_stat in list_folder(folder):
+            relative_path = os.path.join(relative_folder, name) if relative_folder else name
+
+            if exclude and matches(relative_path, name, exclude):
+                continue
+
+            if is_folder:
+                subfolders.append((os.path.join(folder, name), relative_path))
+            elif not include or matches(relative_path, name, include):
+                files.append((os.path.join(folder, name), relative_path, file_stat))
+
+        for f in sorted(files):
+            yield f
+
+        # The subfolders are walked in order, so they are pushed in reverse
+        folders.extend(sorted(subfolders, reverse=True))
+
+
+def list_folder(folder):
+    """
+    Yields the name of each entry of the folder, whether it is a folder and the stat of the files
+
+    @type folder: str
+    @rtype: collections.Iterable[tuple]
+    """
+    if scandir is not None:
+        for entry in scandir(folder):
+            if entry.is_dir(follow_symlinks=False):
+                yield entry.name, True, None
+            elif not entry.is_symlink() or not entry.is_dir():
+                yield entry.name, False, entry.stat()
+
+        return
+
+    for name in os.listdir(folder):
+        file_path = os.path.join(folder, name)
+        file_stat = os.lstat(file_path)
+
+        if stat.S_ISLNK(file_stat.st_mode):
+            # Only the symbolic links are stat'ed again to follow them
+            file_stat = os.stat(file_path)
+
+            if stat.S_ISDIR(file_stat.st_mode):
+                continue
+        elif stat.S_ISDIR(file_stat.st_mode):
+            yield name, True, None
+            continue
+
+        yield name, False, file_stat
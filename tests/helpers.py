@@ -0,0 +1,75 @@
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+
+# The configuration, journal and cache of the commands are written to a temporary home folder
+HOME = tempfile.mkdtemp(prefix='supernode-tests-')
+os.environ['HOME'] = HOME
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from docopt import docopt
+from servers import start_servers
+from supernode.config import Config
+
+
+class ServerTestCase(object):
+    """
+    Starts the fake S3 and REST API servers of the benchmarks and saves a configuration using them
+    """
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='supernode-tests-')
+        self.api, self.s3 = start_servers(0, 0, os.path.join(self.root, 'bucket'))
+        Config.save({'url': self.api.url, 'email': 'test', 'password': 'test', 'verify': 'False',
+                     'partner_id': 'partner'})
+
+    def tearDown(self):
+        for server in (self.api, self.s3):
+            server.shutdown()
+            server.server_close()
+
+        shutil.rmtree(self.root)
+
+    @staticmethod
+    def run_command(command_class, argv):
+        """
+        @type command_class type
+        @type argv list of str
+        """
+        command = command_class()
+        return command.run(docopt(command.help(), argv=argv))
+
+    def write_file(self, relative_path, size):
+        """
+        Writes a file of random bytes to the package folder and returns its MD5 hex
+
+        @type relative_path str
+        @type size int
+        @rtype str
+        """
+        path = os.path.join(self.root, 'package', relative_path)
+
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        data = os.urandom(size)
+
+        with open(path, 'wb') as f:
+            f.write(data)
+
+        return hashlib.md5(data).hexdigest()
+
+    def uploaded_md5s(self):
+        """
+        Returns the MD5 hex of each object of the current version, keyed by relative path
+
+        @rtype dict
+        """
+        version_id = Config.load()['version_id']
+        version = [v for v in self.api.state.versions.values() if v['VersionId'] == version_id][0]
+        prefix = 'partner/{0}/{1}/'.format(version['PackageId'], version_id)
+
+        return dict((key[len(prefix):], o.md5) for (bucket, key), o in self.s3.state.objects.items()
+                    if key.startswith(prefix))
@@ -0,0 +1,76 @@
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from supernode import cache
+from supernode.cache import ChecksumCache
+
+
+class ChecksumCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='supernode-tests-')
+        self.path = os.path.join(self.folder, 'test.cache')
+        self.file_path = os.path.join(self.folder, 'file.bin')
+
+        with open(self.file_path, 'wb') as f:
+            f.write('data')
+
+        self.stat = os.stat(self.file_path)
+
+    def tearDown(self):
+        for name in os.listdir(self.folder):
+            os.remove(os.path.join(self.folder, name))
+
+        os.rmdir(self.folder)
+
+    def write_other_connection(self):
+        """
+        Writes to the cache from another connection which does not wait for the lock
+        """
+        connection = sqlite3.connect(self.path, timeout=0)
+
+        try:
+            connection.execute('DELETE FROM parts')
+            connection.commit()
+        finally:
+            connection.close()
+
+    def used(self):
+        """
+        @rtype: float
+        """
+        connection = sqlite3.connect(self.path)
+
+        try:
+            return connection.execute('SELECT used FROM checksums').fetchone()[0]
+        finally:
+            connection.close()
+
+    def test_reading_does_not_lock(self):
+        with ChecksumCache(self.path) as c:
+            c.set(self.file_path, self.stat, 1024, 'md5', [1, 2])
+
+        used = self.used()
+
+        with ChecksumCache(self.path) as c:
+            self.assertEqual(c.get(self.file_path, self.stat, 1024)[0], 'md5')
+            self.write_other_connection()
+
+        # The time the file was used is written when the cache is closed
+        self.assertTrue(self.used() > used)
+
+    def test_writes_are_committed_in_time(self):
+        with ChecksumCache(self.path) as c:
+            c.set(self.file_path, self.stat, 1024, 'md5', [1, 2])
+
+            # No other write follows, as while the next file is read
+            time.sleep(cache.COMMIT_SECONDS + 0.5)
+            self.write_other_connection()
+
+            self.assertEqual(c.get(self.file_path, self.stat, 1024)[1].tolist(), [1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import os
+import sqlite3
+import time
+import unittest
+
+from tests.helpers import ServerTestCase
+from supernode.commands.create import CreateCommand
+from supernode.commands.upload import MINIMUM_MULTIPART_SIZE, UploadCommand
+from supernode.config import Config
+from supernode import journal as journal_module
+from supernode.journal import UploadJournal
+
+
+class UploadJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(os.environ['HOME'], 'test.journal')
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_add_file_is_committed(self):
+        journal = UploadJournal('version', self.path)
+
+        try:
+            journal.add_upload('prefix/large.bin', 'upload')
+            journal.add_part('upload', 1, 1024, 'etag')
+            journal.add_file('prefix/large.bin', 2048)
+
+            # Another connection sees the file and no longer sees its multipart upload
+            connection = sqlite3.connect(self.path)
+            self.assertEqual(connection.execute('SELECT size FROM files').fetchall(), [(2048,)])
+            self.assertEqual(connection.execute('SELECT COUNT(*) FROM uploads').fetchone(), (0,))
+            connection.close()
+        finally:
+            journal.close()
+
+    def test_add_part_is_committed_in_time(self):
+        with UploadJournal('version', self.path) as journal:
+            journal.add_upload('prefix/large.bin', 'upload')
+            journal.add_part('upload', 1, 1024, 'etag')
+
+            # No other write follows, as while the next part is uploaded
+            time.sleep(journal_module.COMMIT_SECONDS + 0.5)
+
+            connection = sqlite3.connect(self.path, timeout=0)
+            connection.execute('DELETE FROM files')
+            connection.commit()
+            self.assertEqual(connection.execute('SELECT etag FROM parts').fetchall(), [(u'etag',)])
+            connection.close()
+
+    def test_add_upload_forgets_replaced_parts(self):
+        with UploadJournal('version', self.path) as journal:
+            journal.add_upload('prefix/large.bin', 'old')
+            journal.add_part('old', 1, 1024, 'etag')
+            journal.add_upload('prefix/large.bin', 'new')
+
+            self.assertEqual(journal.multipart_ids('prefix/'), {'large.bin': 'new'})
+            self.assertEqual(journal.parts('old'), None)
+            self.assertEqual(journal.parts('new'), {})
+
+
+class ResumeTest(ServerTestCase, unittest.TestCase):
+    def setUp(self):
+        super(ResumeTest, self).setUp()
+        self.md5s = {
+            'large.bin': self.write_file('large.bin', MINIMUM_MULTIPART_SIZE + 1024),
+            'small.bin': self.write_file('small.bin', 1024)
+        }
+
+        self.run_command(CreateCommand, ['create', '--path', os.path.join(self.root, 'package'), '--name', 'test'])
+
+        version_id = Config.load()['version_id']
+        version = [v for v in self.api.state.versions.values() if v['VersionId'] == version_id][0]
+        self.prefix = 'partner/{0}/{1}/'.format(version['PackageId'], version_id)
+        self.version_id = version_id
+
+    def tearDown(self):
+        os.remove(os.path.expanduser('~/package.journal'))
+        super(ResumeTest, self).tearDown()
+
+    def test_missing_upload_is_started_again(self):
+        # The multipart upload recorded in the journal was aborted
+        with UploadJournal(self.version_id) as journal:
+            journal.add_upload(self.prefix + 'large.bin', 'aborted')
+            journal.add_part('aborted', 1, MINIMUM_MULTIPART_SIZE, 'etag')
+
+        self.run_command(UploadCommand, ['upload'])
+
+        self.assertEqual(self.uploaded_md5s(), self.md5s)
+
+    def test_completed_upload_is_skipped(self):
+        self.run_command(UploadCommand, ['upload', '--test'])
+        uploads = self.s3.state.uploads.copy()
+
+        # The multipart upload recorded in the journal was completed, but not the file
+        with UploadJournal(self.version_id) as journal:
+            journal.add_upload(self.prefix + 'large.bin', 'completed')
+
+        self.run_command(UploadCommand, ['upload'])
+
+        self.assertEqual(self.uploaded_md5s(), self.md5s)
+        self.assertEqual(self.s3.state.uploads, uploads)
+
+
+if __name__ == '__main__':
+    unittest.main()
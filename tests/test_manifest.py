@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from supernode.manifest import MAXIMUM_MANIFESTS, Manifest, ManifestWriter, manifest_path
+
+
+class ManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='supernode-tests-')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, version_id):
+        """
+        @type version_id: str
+        """
+        writer = ManifestWriter(version_id, self.folder)
+        writer.add(u'folder/file.bin', 10, 4, 'd41d8cd98f00b204e9800998ecf8427e', [1, 2, 3])
+        writer.close()
+
+    def test_files(self):
+        self.write('version')
+
+        with Manifest.open('version', self.folder) as manifest:
+            files = list(manifest.files())
+            self.assertEqual(str(files[0].pop('Checksums')), '\x01\x00\x00\x00\x02\x00\x00\x00\x03\x00\x00\x00')
+
+        self.assertEqual(files, [{'Path': u'folder/file.bin', 'Size': 10, 'Chunk': 4,
+                                  'MD5': 'd41d8cd98f00b204e9800998ecf8427e'}])
+
+    def test_oldest_manifests_are_removed(self):
+        version_ids = ['version{0}'.format(i) for i in range(MAXIMUM_MANIFESTS + 2)]
+
+        for version_id in version_ids:
+            self.write(version_id)
+
+        kept = [v for v in version_ids if os.path.isfile(manifest_path(v, self.folder))]
+        self.assertEqual(kept, version_ids[2:])
+
+
+if __name__ == '__main__':
+    unittest.main()
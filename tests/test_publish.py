@@ -0,0 +1,61 @@
+import os
+import unittest
+
+from tests.helpers import ServerTestCase
+from supernode.commands.create import CreateCommand
+from supernode.commands.publish import PublishCommand
+from supernode.commands.update import ADD_FILE_ATTEMPTS, UpdateCommand
+from supernode.commands.upload import MINIMUM_MULTIPART_SIZE, UploadCommand
+from supernode.config import Config
+
+
+class PublishTest(ServerTestCase, unittest.TestCase):
+    def setUp(self):
+        super(PublishTest, self).setUp()
+        self.path = os.path.join(self.root, 'package')
+        self.md5s = {
+            'large.bin': self.write_file('large.bin', MINIMUM_MULTIPART_SIZE + 1024),
+            'small.bin': self.write_file('small.bin', 1024),
+            'folder/other.bin': self.write_file('folder/other.bin', 2048)
+        }
+
+        self.run_command(CreateCommand, ['create', '--path', self.path, '--name', 'test'])
+
+    def assert_published(self):
+        settings = Config.load()
+        version = self.api.state.versions[settings['version_id']]
+        files = dict((f['Path'], (f['MD5'], f['Checksums'])) for f in version['Files'])
+        expected = {}
+
+        for relative_path in self.md5s:
+            md5, checksums = UpdateCommand.calculate_checksums(os.path.join(self.path, relative_path), 1048576)
+            expected[relative_path] = (md5, ','.join(str(c) for c in checksums))
+
+        self.assertTrue(version['Complete'])
+        self.assertEqual(files, expected)
+        self.assertEqual(self.uploaded_md5s(), self.md5s)
+        self.assertFalse('register_chunk_size' in settings)
+
+    def test_publish(self):
+        self.run_command(PublishCommand, ['publish', '--path', self.path])
+
+        self.assert_published()
+
+    def test_upload_finishes_interrupted_publish(self):
+        version_id = Config.load()['version_id']
+
+        # Adding the first file fails every attempt, which interrupts the publish
+        for _ in range(ADD_FILE_ATTEMPTS):
+            self.api.state.fail('add_file', 500)
+
+        self.assertRaises(Exception, self.run_command, PublishCommand, ['publish', '--path', self.path,
+                                                                        '--parallel', '1'])
+        self.assertNotEqual(Config.load()['version_id'], version_id)
+
+        self.run_command(UploadCommand, ['upload'])
+
+        self.assert_published()
+
+
+if __name__ == '__main__':
+    unittest.main()
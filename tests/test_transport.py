@@ -0,0 +1,171 @@
+import time
+import unittest
+
+import requests
+
+from tests.helpers import ServerTestCase
+from supernode import transport
+from supernode.config import Config
+from supernode.transport import FORM_BATCH_SIZE, MAXIMUM_RETRY_DELAY, REJECTED_STATUS_CODES, RETRY_STATUS_CODES, \
+    StreamingForm, Transport
+
+
+class StreamingFormTest(unittest.TestCase):
+    def setUp(self):
+        self.values = range(FORM_BATCH_SIZE * 2 + 3)
+        self.form = StreamingForm({'Path': u'folder/file.bin', 'Size': 10}, 'Checksums', self.values)
+        self.expected = 'Path=folder%2Ffile.bin&Size=10&Checksums=' + '%2C'.join(str(v) for v in self.values)
+
+    def test_read(self):
+        self.assertEqual(len(self.form), len(self.expected))
+        self.assertEqual(''.join(iter(lambda: self.form.read(1000), '')), self.expected)
+
+    def test_seek_end(self):
+        # Requests before 2.12 find the length of the body this way
+        self.form.read(100)
+        self.form.seek(0, 2)
+        self.assertEqual(self.form.tell(), len(self.expected))
+        self.assertEqual(self.form.read(), '')
+
+        self.form.seek(0)
+        self.assertEqual(self.form.read(), self.expected)
+
+    def test_seek_other(self):
+        self.assertRaises(IOError, self.form.seek, 10)
+
+
+class TransportFormTest(ServerTestCase, unittest.TestCase):
+    def test_post_form(self):
+        self.api.state.versions['version'] = {'VersionId': 'version', 'Files': []}
+        settings = Config.load()
+        values = range(FORM_BATCH_SIZE + 1)
+
+        transport = Transport(None, False)
+        form = StreamingForm({'Path': 'file.bin', 'Size': 10, 'Chunk': 4, 'MD5': 'md5'}, 'Checksums', values)
+        response = transport.post('add_file', '{0}/versions/version/files'.format(settings['url']), data=form,
+                                  headers={'Content-Type': 'application/x-www-form-urlencoded'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.api.state.versions['version']['Files'],
+                         [{'Path': 'file.bin', 'Size': 10, 'Chunk': 4, 'MD5': 'md5',
+                           'Checksums': ','.join(str(v) for v in values)}])
+        self.assertEqual(transport.metrics['add_file'].requests, 1)
+
+
+class TransportRetryTest(ServerTestCase, unittest.TestCase):
+    def setUp(self):
+        super(TransportRetryTest, self).setUp()
+        self.api.state.versions['version'] = {'VersionId': 'version', 'Files': []}
+        self.url = '{0}/versions/version/files'.format(Config.load()['url'])
+        self.transport = Transport(None, False)
+
+        # Retry without waiting, unless the server asks for a delay
+        self.retry_delay = transport.RETRY_DELAY
+        transport.RETRY_DELAY = 0
+
+    def tearDown(self):
+        transport.RETRY_DELAY = self.retry_delay
+        super(TransportRetryTest, self).tearDown()
+
+    def add_file(self, idempotent=False):
+        form = StreamingForm({'Path': 'file.bin', 'Size': 10, 'Chunk': 4, 'MD5': 'md5'}, 'Checksums',
+                             range(FORM_BATCH_SIZE + 1))
+
+        return self.transport.post('add_file', self.url, idempotent=idempotent, data=form,
+                                   headers={'Content-Type': 'application/x-www-form-urlencoded'})
+
+    def test_idempotent_requests_are_retried(self):
+        for status in RETRY_STATUS_CODES:
+            self.api.state.fail('get_files', status)
+
+        response = self.transport.get('get_files', self.url)
+        metrics = self.transport.metrics['get_files']
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((metrics.requests, metrics.retries, metrics.errors),
+                         (len(RETRY_STATUS_CODES) + 1, len(RETRY_STATUS_CODES), len(RETRY_STATUS_CODES)))
+
+    def test_client_errors_are_not_retried(self):
+        self.api.state.fail('get_files', 400)
+
+        response = self.transport.get('get_files', self.url)
+        metrics = self.transport.metrics['get_files']
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual((metrics.requests, metrics.retries, metrics.errors), (1, 0, 1))
+
+    def test_retries_are_limited(self):
+        self.transport.retries = 2
+
+        for _ in range(4):
+            self.api.state.fail('get_files', 500)
+
+        response = self.transport.get('get_files', self.url)
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.transport.metrics['get_files'].requests, 3)
+
+    def test_processed_requests_are_not_sent_twice(self):
+        for status in set(RETRY_STATUS_CODES) - set(REJECTED_STATUS_CODES):
+            self.api.state.fail('add_file', status, processed=True)
+            self.assertEqual(self.add_file().status_code, status)
+
+        metrics = self.transport.metrics['add_file']
+
+        # Each request was processed once, despite the server errors
+        self.assertEqual(len(self.api.state.versions['version']['Files']), 3)
+        self.assertEqual((metrics.requests, metrics.retries), (3, 0))
+
+    def test_rejected_requests_are_retried(self):
+        for status in REJECTED_STATUS_CODES:
+            self.api.state.fail('add_file', status)
+
+        response = self.add_file()
+        metrics = self.transport.metrics['add_file']
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.api.state.versions['version']['Files']), 1)
+        self.assertEqual((metrics.requests, metrics.retries, metrics.errors), (3, 2, 2))
+
+    def test_idempotent_posts_are_retried(self):
+        self.api.state.fail('add_file', 500)
+
+        response = self.add_file(idempotent=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.transport.metrics['add_file'].retries, 1)
+
+    def test_streamed_body_is_sent_again(self):
+        self.api.state.fail('add_file', 503)
+
+        response = self.add_file()
+        form_length = len(response.request.body)
+
+        # The second attempt sent the whole form instead of the end left by the first one
+        self.assertEqual(self.api.state.versions['version']['Files'][0]['Checksums'],
+                         ','.join(str(v) for v in range(FORM_BATCH_SIZE + 1)))
+        self.assertEqual(self.transport.metrics['add_file'].bytes_sent, 2 * form_length)
+
+    def test_retry_after(self):
+        self.api.state.fail('get_files', 503, headers={'Retry-After': '1'})
+
+        start = time.time()
+        response = self.transport.get('get_files', self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(time.time() - start >= 1)
+
+    def test_retry_delay(self):
+        response = requests.Response()
+        response.headers['Retry-After'] = '3600'
+        self.assertEqual(Transport._retry_delay(0, response), MAXIMUM_RETRY_DELAY)
+
+        # Dates are not supported, so the backoff is used instead
+        response.headers['Retry-After'] = 'Fri, 31 Dec 1999 23:59:59 GMT'
+        transport.RETRY_DELAY = 1
+        self.assertTrue(2 <= Transport._retry_delay(2, response) <= 4)
+        self.assertTrue(Transport._retry_delay(10, None) <= MAXIMUM_RETRY_DELAY)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import binascii
+import hashlib
+import os
+import tempfile
+import unittest
+
+from tests.helpers import ServerTestCase
+from supernode.commands import update
+from supernode.commands.create import CreateCommand
+from supernode.commands.publish import PublishCommand
+from supernode.commands.update import UpdateCommand
+from supernode.config import Config
+
+
+class ChecksumTest(unittest.TestCase):
+    def setUp(self):
+        self.data = os.urandom(10000)
+        fd, self.path = tempfile.mkstemp(prefix='supernode-tests-')
+        os.write(fd, self.data)
+        os.close(fd)
+
+        self.expected = (hashlib.md5(self.data).hexdigest(),
+                         [binascii.crc32(self.data[i:i + 4096]) & 0xffffffff for i in range(0, 10000, 4096)])
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_calculate_checksums(self):
+        md5, checksums = UpdateCommand.calculate_checksums(self.path, 4096)
+
+        self.assertEqual((md5, checksums.tolist()), self.expected)
+
+    def test_calculate_checksums_without_memoryview(self):
+        # As on Python 2.6, hiding the builtin
+        update.memoryview = None
+
+        try:
+            md5, checksums = UpdateCommand.calculate_checksums(self.path, 4096)
+        finally:
+            del update.memoryview
+
+        self.assertEqual((md5, checksums.tolist()), self.expected)
+
+    def test_calculate_chunk_checksums(self):
+        self.assertEqual(PublishCommand.calculate_chunk_checksums(self.data, 4096).tolist(), self.expected[1])
+
+
+class RunPathTest(ServerTestCase, unittest.TestCase):
+    def create(self, run_path):
+        """
+        @param run_path: The run path relative to the folder containing the package
+        @type run_path: str
+        @rtype: dict
+        """
+        self.write_file('bin/run.sh', 16)
+        self.write_file('../package2/run.sh', 16)
+
+        self.run_command(CreateCommand, ['create', '--path', os.path.join(self.root, 'package'), '--name', 'test',
+                                         '--run', os.path.join(self.root, run_path)])
+
+        return self.api.state.versions[Config.load()['version_id']]
+
+    def test_relative_run_path(self):
+        self.assertEqual(self.create('package/bin/run.sh')['Run'], os.path.join('bin', 'run.sh'))
+
+    def test_run_path_outside_package(self):
+        # The folder starts with the path of the package, but is not inside it
+        self.assertRaises(SystemExit, self.create, 'package2/run.sh')
+
+
+class AddFileTest(ServerTestCase, unittest.TestCase):
+    def test_retry_after_lost_response(self):
+        for name in ('a.bin', 'b.bin', 'c.bin'):
+            self.write_file(name, 16)
+
+        # The first file is added but its response is lost, and the second is rejected by a gateway
+        self.api.state.fail('add_file', 502, processed=True)
+        self.api.state.fail('add_file', 502)
+
+        self.run_command(CreateCommand, ['create', '--path', os.path.join(self.root, 'package'), '--name', 'test',
+                                         '--parallel', '1'])
+
+        files = self.api.state.versions[Config.load()['version_id']]['Files']
+        self.assertEqual(sorted(f['Path'] for f in files), ['a.bin', 'b.bin', 'c.bin'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+import hashlib
+import os
+import unittest
+
+from cStringIO import StringIO
+
+from tests.helpers import ServerTestCase
+from supernode.api import RestApi
+from supernode.commands import upload
+from supernode.commands.create import CreateCommand
+from supernode.commands.tag import TagCommand
+from supernode.commands.update import UpdateCommand
+from supernode.commands.upload import MAXIMUM_COPY_SIZE, MINIMUM_CHUNK_SIZE, MINIMUM_MULTIPART_SIZE, DeltaSource, \
+    ParallelUpload, UploadCommand
+from supernode.config import Config
+from supernode.journal import UploadJournal
+
+
+class UploadTest(ServerTestCase, unittest.TestCase):
+    def test_multipart_without_journal(self):
+        md5s = self.write_package()
+        self.run_command(UploadCommand, ['upload', '--test', '--processes', '2'])
+
+        self.assertEqual(self.uploaded_md5s(), md5s)
+
+    def test_multipart_with_journal(self):
+        md5s = self.write_package()
+        self.run_command(UploadCommand, ['upload', '--processes', '2'])
+
+        self.assertEqual(self.uploaded_md5s(), md5s)
+
+    def test_read_ahead_without_memoryview(self):
+        md5s = self.write_package()
+
+        # As on Python 2.6, hiding the builtin
+        upload.memoryview = None
+
+        try:
+            self.run_command(UploadCommand, ['upload', '--test', '--read-ahead', '16'])
+        finally:
+            del upload.memoryview
+
+        self.assertEqual(self.uploaded_md5s(), md5s)
+
+    def test_read_ahead_divided_between_processes(self):
+        memory = []
+        reader_class = upload.ReadAheadReader
+
+        class RecordingReader(reader_class):
+            def __init__(self, max_memory):
+                reader_class.__init__(self, max_memory)
+                memory.append(max_memory)
+
+        options = {'--parallel': '4', '--adaptive': False, '--aimd': False, '--read-ahead': '16',
+                   '--md5-metadata': False}
+        upload.ReadAheadReader = RecordingReader
+
+        try:
+            UploadCommand.upload_transfers({}, [], upload.UploadProgress('', mode='json'), None, options, 4)
+        finally:
+            upload.ReadAheadReader = reader_class
+
+        self.assertEqual(memory, [4 * 1024 * 1024])
+
+    def test_resume_adaptive_parts(self):
+        size = 6 * MINIMUM_CHUNK_SIZE
+        md5s = {'large.bin': self.write_file('large.bin', size)}
+        self.run_command(CreateCommand, ['create', '--path', os.path.join(self.root, 'package'), '--name', 'test'])
+
+        version_id = Config.load()['version_id']
+        credentials = RestApi(Config.load()).get_upload_credentials(version_id)
+        key_name = credentials['KeyPrefix'] + 'large.bin'
+        multipart = UploadCommand.get_bucket(credentials).initiate_multipart_upload(key_name)
+
+        # An adaptive upload was interrupted after a small part, followed by one of the fixed part size
+        chunk_size = ParallelUpload.calculate_chunk_size(size)
+
+        with open(os.path.join(self.root, 'package', 'large.bin'), 'rb') as f:
+            data = f.read()
+
+        with UploadJournal(version_id) as journal:
+            journal.add_upload(key_name, multipart.id)
+
+            for part_number, offset, part_size in ((1, 0, MINIMUM_CHUNK_SIZE), (2, MINIMUM_CHUNK_SIZE, chunk_size)):
+                key = multipart.upload_part_from_file(StringIO(data[offset:offset + part_size]), part_number)
+                journal.add_part(multipart.id, part_number, part_size, key.etag)
+
+        self.run_command(UploadCommand, ['upload'])
+
+        self.assertEqual(self.uploaded_md5s(), md5s)
+
+    def test_delta_copies_unchanged_parts(self):
+        size = 6 * MINIMUM_CHUNK_SIZE
+        path = os.path.join(self.root, 'package')
+        self.write_file('large.bin', size)
+        self.run_command(CreateCommand, ['create', '--path', path, '--name', 'test'])
+        self.run_command(UploadCommand, ['upload'])
+        self.run_command(TagCommand, ['tag', '--tag', 'current'])
+
+        # Change a region in the second part, the parts being aligned with the checksum chunks of update
+        part_size = DeltaSource(None, size, 1048576, None, None).part_size(size)
+
+        with open(os.path.join(path, 'large.bin'), 'r+b') as f:
+            f.seek(part_size + 1000)
+            f.write(os.urandom(1000))
+
+        with open(os.path.join(path, 'large.bin'), 'rb') as f:
+            md5s = {'large.bin': hashlib.md5(f.read()).hexdigest()}
+
+        self.run_command(UpdateCommand, ['update', '--path', path])
+
+        copied = []
+        copy_part = ParallelUpload._copy_part
+
+        def record_copy(upload, part_number, offset, size):
+            copied.append(part_number)
+            copy_part(upload, part_number, offset, size)
+
+        ParallelUpload._copy_part = record_copy
+
+        try:
+            self.run_command(UploadCommand, ['upload', '--delta', '--base-tag', 'current'])
+        finally:
+            ParallelUpload._copy_part = copy_part
+
+        part_count = (size + part_size - 1) // part_size
+        self.assertEqual(sorted(copied), [1] + range(3, part_count + 1))
+        self.assertEqual(self.uploaded_md5s(), md5s)
+
+    def test_delta_of_files_over_copy_limit(self):
+        size = MAXIMUM_COPY_SIZE + 1
+        files = [{'Path': 'large.bin', 'Size': size, 'Chunk': 1048576, 'Checksums': '1,2'}]
+        deltas = UploadCommand.find_deltas(files, files, 'base/', [(size, 'large.bin', 'large.bin')])
+
+        self.assertEqual(deltas['large.bin'].key_name, 'base/large.bin')
+
+    def write_package(self):
+        """
+        Writes a package with a multipart file and creates it
+
+        @rtype dict
+        """
+        md5s = {
+            'large.bin': self.write_file('large.bin', MINIMUM_MULTIPART_SIZE + 1024),
+            'small.bin': self.write_file('small.bin', 1024),
+            'folder/other.bin': self.write_file('folder/other.bin', 2048)
+        }
+
+        self.run_command(CreateCommand, ['create', '--path', os.path.join(self.root, 'package'), '--name', 'test'])
+
+        return md5s
+
+
+if __name__ == '__main__':
+    unittest.main()